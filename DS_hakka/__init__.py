@@ -3,6 +3,82 @@ from flask import Flask
 
 def create_app():
     app = Flask(__name__)
+
+    # ロギング設定（ルートのモジュールを読み込んだときではなく、アプリ作成時に1回だけ行う）
+    import logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    # .envファイルの読み込み（PayPayの認証情報など）
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    # DB接続（スレッドごとに使い回す共通接続）の設定
+    from services import database
+    database.init_app(app)
+
+    # リクエストごとの性能計測（/metrics）
+    from services import metrics
+    metrics.init_app(app)
+
+    # 遅いクエリのログ（SLOW_QUERY_MS を設定したときだけ記録）
+    from services import slow_queries
+    slow_queries.init_app(app)
+
+    # リクエスト単位のプロファイラ（PROFILER_TOKEN / PROFILER_SAMPLE_RATE を設定したときだけ有効）
+    from services import profiler
+    profiler.init_app(app)
+
+    # 未適用のスキーマ変更（psql/migrations）を起動時に適用
+    from services import migrations
+    migrations.init_app(app)
+
+    # 店舗ごとのメニューキャッシュ
+    from services import menu_cache
+    menu_cache.init_app(app)
+
+    # 売り上げ予測分析ページの集計キャッシュ
+    from services import sales_analytics
+    sales_analytics.init_app(app)
+
+    # 店舗の注文画面へのリアルタイム通知
+    from services import order_events
+    order_events.init_app(app)
+
+    # 対応中の注文の投影（注文イベントで更新し、起動時に DB から読み込む。待ち時間の目安・キッチン表示が読む）
+    from services import open_orders
+    open_orders.init_app(app)
+
+    # 受け取りまでの待ち時間の目安（段階ごとの所要時間をステータス変更で更新）
+    from services import wait_times
+    wait_times.init_app(app)
+
+    # 注文の書き込み（単一の書き込みスレッドでまとめてコミットする）
+    from services import order_writer
+    order_writer.init_app(app)
+
+    # PayPay決済ステータスのバックグラウンドポーリング
+    from services import paypay_poller
+    paypay_poller.init_app(app)
+
+    # PayPay API呼び出し（スレッドプール・タイムアウト・サーキットブレーカー）
+    from services import paypay_gateway
+    paypay_gateway.init_app(app)
+
+    # 店舗住所のジオコーディング（バックグラウンドのジョブキュー）
+    from services import geocoding
+    geocoding.init_app(app)
+
+    # メニュー一括登録のバックグラウンドジョブ
+    from services import menu_import_jobs
+    menu_import_jobs.init_app(app)
+
+    # サーバー側セッション・カート（クッキーにはセッションIDだけを入れる）
+    from services import session_store
+    session_store.init_app(app)
+
+    # flask コマンド（ベンチマークなど）の登録
+    from cli import register_commands
+    register_commands(app)
     
     # ルートの登録
     from routes.general.explamation import general_bp
@@ -0,0 +1,709 @@
+# cli.py
+# --- flask コマンドの登録 ---
+# DS_hakka直下に __init__.py があるため `flask --app app` では読み込めない。
+# DS_hakka ディレクトリで `python cli.py <コマンド名>` として実行する。
+import os
+import sqlite3
+import tempfile
+import time
+
+import click
+
+from flask.cli import with_appcontext
+
+from services import database, query_plans, sales_rollup, store_customers
+
+
+def register_commands(app):
+    app.cli.add_command(bench_db)
+    app.cli.add_command(check_query_plans)
+    app.cli.add_command(rebuild_sales_rollup)
+    app.cli.add_command(rebuild_store_customers)
+    app.cli.add_command(fake_paypay)
+    app.cli.add_command(bench_paypay)
+    app.cli.add_command(bench_menu_import)
+    app.cli.add_command(bench_session)
+    app.cli.add_command(check_startup)
+    app.cli.add_command(slow_query_report)
+    app.cli.add_command(bench_analytics)
+    app.cli.add_command(bench_order_writer)
+    app.cli.add_command(check_paypay_poller)
+
+
+# --- DB接続のマイクロベンチマーク ---
+@click.command('bench-db')
+@click.option('--requests', 'n_requests', default=5000, show_default=True, help='疑似リクエスト数')
+def bench_db(n_requests):
+    """リクエストごとに接続する方式と共通接続を使い回す方式の requests/sec を比較する"""
+    tmpdir = tempfile.mkdtemp()
+    settings = dict(database.DEFAULT_SETTINGS, DATABASE=os.path.join(tmpdir, 'bench.db'))
+
+    conn = database.connect(settings)
+    conn.execute("CREATE TABLE menus (menu_id INTEGER PRIMARY KEY, store_id INTEGER, menu_name TEXT, price INTEGER, soldout INTEGER)")
+    conn.executemany(
+        "INSERT INTO menus (store_id, menu_name, price, soldout) VALUES (?, ?, ?, ?)",
+        [(i % 50, f'menu{i}', 500, i % 7 == 0) for i in range(5000)]
+    )
+    conn.commit()
+    conn.force_close()
+
+    # 1リクエスト分の処理（メニュー画面相当のクエリ）
+    def handle(conn, i):
+        conn.execute("SELECT menu_id, menu_name, price FROM menus WHERE store_id = ? AND soldout = 0", (i % 50,)).fetchall()
+
+    # 変更前: 毎回 sqlite3.connect して閉じる
+    start = time.perf_counter()
+    for i in range(n_requests):
+        conn = sqlite3.connect(settings['DATABASE'])
+        conn.row_factory = sqlite3.Row
+        handle(conn, i)
+        conn.close()
+    before = n_requests / (time.perf_counter() - start)
+
+    # 変更後: 共通接続を使い回す
+    conn = database.connect(settings)
+    start = time.perf_counter()
+    for i in range(n_requests):
+        handle(conn, i)
+        conn.close()  # プール接続では巻き戻しのみ
+    after = n_requests / (time.perf_counter() - start)
+    conn.force_close()
+
+    click.echo(f"接続を毎回作成: {before:,.0f} req/s")
+    click.echo(f"共通接続を再利用: {after:,.0f} req/s ({after / before:.1f}倍)")
+
+
+# --- 実行計画のチェック ---
+@click.command('check-query-plans')
+@with_appcontext
+def check_query_plans():
+    """主要クエリがテーブル全体を走査していないか EXPLAIN QUERY PLAN で確認する"""
+    conn = database.get_db_connection()
+    problems = query_plans.find_table_scans(conn)
+    for name in query_plans.HOT_QUERIES:
+        mark = 'NG' if name in problems else 'OK'
+        click.echo(f"[{mark}] {name}")
+        for detail in problems.get(name, []):
+            click.echo(f"      {detail}")
+    if problems:
+        raise SystemExit(1)
+
+
+# --- 売上集計の再作成 ---
+@click.command('rebuild-sales-rollup')
+@click.option('--store-id', type=int, default=None, help='指定した店舗のみ作り直す')
+@with_appcontext
+def rebuild_sales_rollup(store_id):
+    """daily_sales / daily_item_sales / item_sales を orders から作り直す"""
+    conn = database.get_db_connection()
+    try:
+        sales_rollup.rebuild(conn, store_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    click.echo("売上集計を作り直しました")
+
+
+# --- 顧客履歴の集計の再作成 ---
+@click.command('rebuild-store-customers')
+@click.option('--store-id', type=int, default=None, help='指定した店舗のみ作り直す')
+@with_appcontext
+def rebuild_store_customers(store_id):
+    """store_customers を orders から作り直す"""
+    conn = database.get_db_connection()
+    try:
+        store_customers.rebuild(conn, store_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    click.echo("顧客履歴の集計を作り直しました")
+
+
+# --- ローカル用の PayPay 代替サーバー ---
+@click.command('fake-paypay')
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', default=8999, show_default=True)
+@click.option('--complete-after', default=5.0, show_default=True, help='QR作成から支払い完了までの秒数')
+@click.option('--latency', default=0.0, show_default=True, help='各レスポンスの遅延（秒）')
+@click.option('--rate-limit-every', default=0, show_default=True, help='N回に1回 RATE_LIMIT を返す')
+def fake_paypay(host, port, complete_after, latency, rate_limit_every):
+    """PayPay API の代替サーバーを起動する（アプリ側は PAYPAY_BASE_URL で指定）"""
+    from services.fake_paypay import make_server
+
+    server = make_server(host, port, complete_after=complete_after, latency=latency,
+                         rate_limit_every=rate_limit_every)
+    click.echo(f"PAYPAY_BASE_URL=http://{host}:{port} で起動しました")
+    server.serve_forever()
+
+
+# --- PayPay 呼び出しの負荷テスト（代替サーバーを使用）---
+@click.command('bench-paypay')
+@click.option('--calls', default=200, show_default=True, help='呼び出し回数')
+@click.option('--concurrency', default=20, show_default=True, help='同時に呼び出すスレッド数')
+@click.option('--latency', default=0.05, show_default=True, help='代替サーバーの応答遅延（秒）')
+@with_appcontext
+def bench_paypay(calls, concurrency, latency):
+    """代替サーバーに対して PayPay ゲートウェイ経由の呼び出しを並列に行い、レイテンシを計測する"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from services.fake_paypay import start_in_thread
+    from services.paypay_gateway import paypay_gateway, PaymentGatewayError
+
+    server, base_url = start_in_thread(latency=latency)
+    paypay_gateway.configure(credentials={'api_key': 'bench', 'api_secret': 'bench',
+                                          'merchant_id': 'bench', 'base_url': base_url})
+    qr = paypay_gateway.create_qr_code({
+        'merchantPaymentId': 'bench', 'codeType': 'ORDER_QR',
+        'amount': {'amount': 100, 'currency': 'JPY'},
+    })
+
+    def one_call(_):
+        start = time.perf_counter()
+        try:
+            paypay_gateway.get_payment_details(qr['data']['merchantPaymentId'])
+            ok = True
+        except PaymentGatewayError:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one_call, range(calls)))
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    latencies = sorted(t for t, _ in results)
+    failed = sum(1 for _, ok in results if not ok)
+    click.echo(f"{calls}回 / {elapsed:.2f}秒 ({calls / elapsed:,.0f} calls/s)  失敗: {failed}")
+    click.echo(f"p50: {latencies[len(latencies) // 2] * 1000:.1f}ms  "
+               f"p95: {latencies[int(len(latencies) * 0.95)] * 1000:.1f}ms")
+    click.echo(f"ゲートウェイ: {paypay_gateway.stats()}")
+
+
+# --- メニュー一括登録のベンチマーク ---
+@click.command('bench-menu-import')
+@click.option('--rows', default=100000, show_default=True, help='メニューの行数')
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'xlsx']), default='csv', show_default=True)
+@click.option('--chunk-size', default=1000, show_default=True, help='executemany 1回あたりの件数')
+def bench_menu_import(rows, file_format, chunk_size):
+    """従来の一括読み込み方式とストリーミング方式で、取り込み時間とメモリのピークを比較する"""
+    import csv
+    import io
+    import json
+    import tracemalloc
+
+    from services import menu_import
+
+    tmpdir = tempfile.mkdtemp()
+
+    def write_file(n):
+        path = os.path.join(tmpdir, f'menus_{n}.{file_format}')
+        header = ['menu_name', 'category', 'price', 'soldout']
+        data = ([f'メニュー{i}', f'カテゴリ{i % 20}', 300 + i % 700, int(i % 9 == 0)] for i in range(n))
+        if file_format == 'csv':
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(header)
+                writer.writerows(data)
+        else:
+            from openpyxl import Workbook
+            workbook = Workbook(write_only=True)
+            sheet = workbook.create_sheet()
+            sheet.append(header)
+            for row in data:
+                sheet.append(row)
+            workbook.save(path)
+        return path
+
+    def new_db(name):
+        settings = dict(database.DEFAULT_SETTINGS, DATABASE=os.path.join(tmpdir, name))
+        conn = database.connect(settings)
+        conn.execute("CREATE TABLE menus (menu_id INTEGER PRIMARY KEY AUTOINCREMENT, store_id INTEGER, menu_name TEXT NOT NULL, "
+                     "category TEXT NOT NULL, price INTEGER NOT NULL, soldout INTEGER NOT NULL DEFAULT 0)")
+        conn.execute("CREATE INDEX idx_menus_store_name ON menus (store_id, menu_name)")
+        conn.commit()
+        return conn
+
+    # 変更前: ファイル全体を読み込み、リストで検証し、1行ずつ INSERT
+    def legacy(path, conn):
+        with open(path, 'rb') as f:
+            if file_format == 'csv':
+                menus = list(csv.DictReader(io.StringIO(f.read().decode('utf-8-sig'))))
+            else:
+                import pandas as pd
+                menus = pd.read_excel(f, dtype=str).to_dict('records')
+        errors = menu_import.ImportErrors(limit=None)
+        validated = list(menu_import.validate_rows(enumerate(menus, start=2), errors))
+        # 確認画面を経由するため、検証済みのデータは JSON にして受け渡していた
+        validated = json.loads(json.dumps(validated))
+        for menu in validated:
+            conn.execute("INSERT INTO menus (store_id, menu_name, category, price, soldout) VALUES (?, ?, ?, ?, ?)",
+                         (1, menu['menu_name'], menu['category'], menu['price'], menu['soldout']))
+        conn.commit()
+        return len(validated)
+
+    # 変更後: 読み込み・検証・登録をすべてストリーミングで行う
+    def streaming(path, conn):
+        with open(path, 'rb') as f:
+            errors = menu_import.ImportErrors()
+            rows_iter = menu_import.iter_menu_rows(path, f)
+            result = menu_import.import_menus(conn, 1, menu_import.validate_rows(rows_iter, errors),
+                                              chunk_size=chunk_size)
+        conn.commit()
+        return result['inserted']
+
+    def measure(func, path, db_name):
+        conn = new_db(db_name)
+        tracemalloc.start()
+        start = time.perf_counter()
+        count = func(path, conn)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        conn.force_close()
+        return count, elapsed, peak / 1024 / 1024
+
+    small = max(rows // 10, 1)
+    small_path, path = write_file(small), write_file(rows)
+    click.echo(f"{file_format.upper()} {rows:,}行 / chunk={chunk_size}")
+    for label, func in (('一括読み込み（変更前）', legacy), ('ストリーミング（変更後）', streaming)):
+        _, small_elapsed, small_peak = measure(func, small_path, f'{func.__name__}_small.db')
+        count, elapsed, peak = measure(func, path, f'{func.__name__}.db')
+        click.echo(f"{label}: {count:,}件 {elapsed:.2f}秒 ({count / elapsed:,.0f} rows/s)  "
+                   f"メモリのピーク: {small:,}行 {small_peak:.1f}MB → {rows:,}行 {peak:.1f}MB")
+
+
+
+# --- セッション・カートのベンチマーク ---
+@click.command('bench-session')
+@click.option('--items', default=30, show_default=True, help='カートに入れる商品数')
+@click.option('--requests', 'n_requests', default=300, show_default=True, help='計測するリクエスト数')
+def bench_session(items, n_requests):
+    """クッキーセッションとサーバー側セッションで、カートがある状態のクッキーの大きさと応答時間を比較する"""
+    from werkzeug.security import generate_password_hash
+    from __init__ import create_app
+
+    tmpdir = tempfile.mkdtemp()
+    environ = {key: os.environ.get(key) for key in ('DATABASE_PATH', 'SESSION_BACKEND')}
+
+    def run(backend):
+        os.environ['DATABASE_PATH'] = os.path.join(tmpdir, f'{backend}.db')
+        os.environ['SESSION_BACKEND'] = backend
+        app = create_app()
+        app.secret_key = 'bench-session'
+        with app.app_context():
+            conn = database.get_db_connection()
+            conn.execute("INSERT INTO store (store_name, email, password, location) VALUES ('bench', 'bench@example.com', 'x', '東京')")
+            store_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            conn.execute("INSERT INTO users_table (u_name, email, password_hash) VALUES ('bench', 'bench@example.com', ?)",
+                         (generate_password_hash('bench'),))
+            conn.executemany("INSERT INTO menus (store_id, menu_name, category, price, soldout) VALUES (?, ?, ?, ?, 0)",
+                             [(store_id, f'ベンチマーク用メニュー{i}', f'カテゴリ{i % 5}', 300 + i * 10) for i in range(items)])
+            menu_ids = [row[0] for row in conn.execute("SELECT menu_id FROM menus WHERE store_id = ?", (store_id,))]
+            conn.commit()
+
+        client = app.test_client()
+        client.post('/users_login/login', data={'u_name': 'bench', 'password': 'bench'})
+        client.get(f'/users_order/menu/{store_id}')
+        for menu_id in menu_ids:
+            client.post('/users_order/add_to_cart', json={'menu_id': menu_id, 'quantity': 1})
+        cookie = client.get_cookie(app.config['SESSION_COOKIE_NAME'])
+        cookie_size = len(f'{cookie.key}={cookie.value}')
+
+        def measure(func):
+            start = time.perf_counter()
+            for i in range(n_requests):
+                func(i)
+            return (time.perf_counter() - start) / n_requests * 1000
+
+        add_ms = measure(lambda i: client.post('/users_order/add_to_cart',
+                                               json={'menu_id': menu_ids[i % items], 'quantity': 1}))
+        view_ms = measure(lambda i: client.get('/users_order/cart_confirmation'))
+        return cookie_size, add_ms, view_ms
+
+    try:
+        click.echo(f"カート {items}品 / 各 {n_requests}リクエスト")
+        for backend in ('cookie', 'sqlite', 'memory'):
+            cookie_size, add_ms, view_ms = run(backend)
+            click.echo(f"{backend:>6}: Cookieヘッダ {cookie_size:,}バイト  "
+                       f"カート追加 {add_ms:.2f}ms/回  カート確認 {view_ms:.2f}ms/回")
+    finally:
+        for key, value in environ.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+
+# --- 遅いクエリの集計 ---
+@click.command('slow-query-report')
+@click.option('--path', default=None, help='ログファイル（省略時は SLOW_QUERY_LOG の設定）')
+@click.option('--by', 'order', type=click.Choice(['total', 'count', 'max']), default='total', show_default=True,
+              help='並べ替えの基準（合計時間・回数・最大時間）')
+@click.option('--limit', default=10, show_default=True, help='表示する件数')
+@with_appcontext
+def slow_query_report(path, order, limit):
+    """SLOW_QUERY_MS で記録した遅いクエリを SQL ごとに集計して表示する"""
+    from flask import current_app
+
+    from services import slow_queries
+
+    path = path or current_app.config['SLOW_QUERY_LOG']
+    if not os.path.exists(path):
+        click.echo(f"ログファイルがありません: {path}（SLOW_QUERY_MS を設定して起動すると記録されます）")
+        return
+    key = {'total': 'total_ms', 'count': 'count', 'max': 'max_ms'}[order]
+    stats = sorted(slow_queries.read_log(path), key=lambda s: s[key], reverse=True)
+    click.echo(f"{path}: {len(stats)}種類のクエリ（{order} 順に上位 {min(limit, len(stats))} 件）")
+    for rank, s in enumerate(stats[:limit], start=1):
+        click.echo(f"\n#{rank} 合計 {s['total_ms']:,.1f}ms / {s['count']:,}回 / 平均 {s['total_ms'] / s['count']:,.1f}ms / 最大 {s['max_ms']:,.1f}ms")
+        click.echo(f"  {s['sql']}")
+        routes = sorted(s['routes'].items(), key=lambda item: item[1], reverse=True)
+        click.echo("  ルート: " + ', '.join(f"{route} ({count})" for route, count in routes))
+        click.echo("  パラメータ: " + ', '.join(f"{shape} ({count})" for shape, count in s['params'].items()))
+        for detail in s['plan'] or []:
+            click.echo(f"  | {detail}")
+
+
+# --- 売上分析のベンチマーク ---
+@click.command('bench-analytics')
+@click.option('--orders', 'n_orders', default=1000000, show_default=True, help='合成する注文数')
+@click.option('--items-per-order', default=3, show_default=True, help='1注文あたりの明細数の最大')
+@click.option('--days', default=365, show_default=True, help='注文を散らばらせる日数')
+@click.option('--repeat', default=20, show_default=True, help='キャッシュ済みの取得を計測する回数')
+def bench_analytics(n_orders, items_per_order, days, repeat):
+    """合成した注文データで、配列演算での集計・キャッシュからの取得・同じ集計の SQL を比較する"""
+    import datetime
+
+    import numpy as np
+
+    from __init__ import create_app
+    from services import sales_analytics
+
+    tmpdir = tempfile.mkdtemp()
+    previous = os.environ.get('DATABASE_PATH')
+    os.environ['DATABASE_PATH'] = os.path.join(tmpdir, 'analytics.db')
+    try:
+        app = create_app()
+    finally:
+        if previous is None:
+            os.environ.pop('DATABASE_PATH', None)
+        else:
+            os.environ['DATABASE_PATH'] = previous
+
+    today = datetime.date.today()
+    rng = np.random.default_rng(0)
+    with app.app_context():
+        conn = database.get_db_connection()
+        conn.execute("INSERT INTO store (store_name, email, password, location) VALUES ('bench', 'bench@example.com', 'x', '東京')")
+        store_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        prices = rng.integers(3, 15, 50) * 100
+        conn.executemany("INSERT INTO menus (store_id, menu_name, category, price, soldout) VALUES (?, ?, ?, ?, 0)",
+                         [(store_id, f'ベンチマーク用メニュー{i}', f'カテゴリ{i % 5}', int(price)) for i, price in enumerate(prices)])
+        menu_ids = np.array([row[0] for row in conn.execute("SELECT menu_id FROM menus WHERE store_id = ?", (store_id,))])
+
+        # 注文日時: 直近 days 日に、昼と夜に山がある分布で散らばらせる
+        start = time.perf_counter()
+        first_day = np.datetime64(today, 'D') - (days - 1)
+        seconds = (rng.integers(0, days, n_orders) * 86400
+                   + np.clip(rng.choice([12, 19], n_orders) * 3600 + rng.normal(0, 7200, n_orders), 0, 86399).astype(np.int64))
+        # 実際のデータと同じく order_id の順に日時が進むよう並べる
+        stamps = np.datetime_as_string(first_day + np.sort(seconds).astype('timedelta64[s]'), unit='s')
+        stamps = np.char.replace(stamps, 'T', ' ')
+        statuses = np.where(rng.random(n_orders) < 0.03, 'canceled', 'completed')
+        n_items = rng.integers(1, items_per_order + 1, n_orders)
+        item_order = np.repeat(np.arange(n_orders), n_items)
+        item_menu = rng.integers(0, len(menu_ids), len(item_order))
+        item_qty = rng.integers(1, 4, len(item_order))
+        item_amount = item_qty * prices[item_menu]
+        totals = np.bincount(item_order, weights=item_amount, minlength=n_orders).astype(np.int64)
+
+        conn.executemany("INSERT INTO orders (order_id, user_id, store_id, status, datetime, payment_method, total_amount) "
+                         "VALUES (?, 1, ?, ?, ?, 'PayPay', ?)",
+                         zip(range(1, n_orders + 1), [store_id] * n_orders, statuses.tolist(), stamps.tolist(), totals.tolist()))
+        conn.executemany("INSERT INTO order_items (order_id, menu_id, quantity, price_at_order) VALUES (?, ?, ?, ?)",
+                         zip((item_order + 1).tolist(), menu_ids[item_menu].tolist(), item_qty.tolist(),
+                             prices[item_menu].tolist()))
+        conn.commit()
+        click.echo(f"注文 {n_orders:,}件 / 明細 {len(item_order):,}件 を作成（{time.perf_counter() - start:.1f}秒）")
+
+        def measure(label, func, n=1):
+            start = time.perf_counter()
+            for _ in range(n):
+                result = func()
+            elapsed = (time.perf_counter() - start) / n
+            click.echo(f"{label}: {elapsed * 1000:,.1f}ms")
+            return result
+
+        # 変更前の書き方に近い、集計ごとに SQL の GROUP BY を発行する方式
+        def sql_aggregates():
+            where = "o.store_id = ? AND o.status != 'canceled'"
+            conn.execute(f"SELECT (CAST(strftime('%w', o.datetime) AS INTEGER) + 6) % 7, CAST(strftime('%H', o.datetime) AS INTEGER), "
+                         f"COUNT(*), SUM(o.total_amount) FROM orders o WHERE {where} GROUP BY 1, 2", (store_id,)).fetchall()
+            conn.execute(f"SELECT (CAST(strftime('%w', d) AS INTEGER) + 6) % 7, COUNT(*) FROM "
+                         f"(SELECT DISTINCT DATE(o.datetime) AS d FROM orders o WHERE {where}) GROUP BY 1", (store_id,)).fetchall()
+            conn.execute(f"SELECT oi.menu_id, SUM(oi.quantity), SUM(oi.quantity * oi.price_at_order) AS sales "
+                         f"FROM orders o JOIN order_items oi ON oi.order_id = o.order_id WHERE {where} "
+                         f"GROUP BY oi.menu_id ORDER BY sales DESC LIMIT 10", (store_id,)).fetchall()
+            conn.execute(f"SELECT AVG(o.total_amount), COUNT(*) FROM orders o WHERE {where}", (store_id,)).fetchall()
+            conn.execute(f"SELECT SUM(oi.quantity) FROM orders o JOIN order_items oi ON oi.order_id = o.order_id "
+                         f"WHERE {where}", (store_id,)).fetchall()
+            conn.execute(f"SELECT DATE(o.datetime, 'weekday 0', '-6 days'), COUNT(*), SUM(o.total_amount) "
+                         f"FROM orders o WHERE {where} AND o.datetime >= ? GROUP BY 1",
+                         (store_id, str(today - datetime.timedelta(weeks=8)))).fetchall()
+
+        measure('SQL の GROUP BY で集計（毎回）', sql_aggregates)
+        data = measure('配列への読み込み', lambda: sales_analytics.load(conn, store_id))
+        measure('配列演算での集計', lambda: sales_analytics.compute(data, today))
+        cache = sales_analytics.SalesAnalytics()
+        measure('読み込み + 集計（キャッシュなし）', lambda: cache.get(store_id, today))
+        measure(f'キャッシュからの取得（{repeat}回平均）', lambda: cache.get(store_id, today), n=repeat)
+
+        # 新しい注文が1件入ったあと: 増えた分だけを読み足して集計し直す
+        conn.execute("INSERT INTO orders (user_id, store_id, status, datetime, payment_method, total_amount) "
+                     "VALUES (1, ?, '注文受付中', ?, 'PayPay', ?)", (store_id, str(datetime.datetime.now()), int(prices[0])))
+        order_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        conn.execute("INSERT INTO order_items (order_id, menu_id, quantity, price_at_order) VALUES (?, ?, 1, ?)",
+                     (order_id, int(menu_ids[0]), int(prices[0])))
+        sales_rollup.record_order(conn, store_id, str(datetime.datetime.now()), int(prices[0]),
+                                  [(int(menu_ids[0]), 1, int(prices[0]))])
+        conn.commit()
+        cache.version_check_seconds = 0
+        result = measure('新しい注文1件を読み足して集計', lambda: cache.get(store_id, today))
+        click.echo(f"集計結果: 注文 {result['order_count']:,}件 / 売上 {result['sales_total']:,}円 / "
+                   f"客単価 {result['basket']['average_amount']:,}円")
+
+
+# --- 注文の書き込みのベンチマーク ---
+@click.command('bench-order-writer')
+@click.option('--orders', 'n_orders', default=2000, show_default=True, help='書き込む注文数')
+@click.option('--concurrency', default=16, show_default=True, help='同時に注文するスレッド数')
+@click.option('--busy-timeout-ms', default=200, show_default=True,
+              help='リクエストごとにコミットする方式での SQLite のロック待ち時間（短いほど database is locked が出やすい）')
+@click.option('--max-delay-ms', type=float, default=None, help='ORDER_WRITER_MAX_DELAY_MS（省略時は設定値）')
+def bench_order_writer(n_orders, concurrency, busy_timeout_ms, max_delay_ms):
+    """同時に注文を確定したときの、リクエストごとのコミットと書き込みスレッドでのまとめてコミットを比較する"""
+    import collections
+    import datetime
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    from __init__ import create_app
+    from services.order_writer import NewOrder, insert_order, order_writer
+
+    tmpdir = tempfile.mkdtemp()
+    previous = os.environ.get('DATABASE_PATH')
+    os.environ['DATABASE_PATH'] = os.path.join(tmpdir, 'orders.db')
+    try:
+        app = create_app()
+    finally:
+        if previous is None:
+            os.environ.pop('DATABASE_PATH', None)
+        else:
+            os.environ['DATABASE_PATH'] = previous
+
+    with app.app_context():
+        conn = database.get_db_connection()
+        conn.execute("INSERT INTO store (store_name, email, password, location) VALUES ('bench', 'bench@example.com', 'x', '東京')")
+        store_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        conn.execute("INSERT INTO users_table (u_name, email, password_hash) VALUES ('bench', 'bench@example.com', 'x')")
+        user_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        conn.executemany("INSERT INTO menus (store_id, menu_name, category, price, soldout) VALUES (?, ?, 'ベンチマーク', ?, 0)",
+                         [(store_id, f'ベンチマーク用メニュー{i}', 500 + i * 100) for i in range(5)])
+        menu_ids = [row[0] for row in conn.execute("SELECT menu_id FROM menus WHERE store_id = ?", (store_id,))]
+        conn.commit()
+    settings = dict(app.config, SQLITE_BUSY_TIMEOUT_MS=busy_timeout_ms)
+    if max_delay_ms is not None:
+        order_writer.configure(ORDER_WRITER_MAX_DELAY_MS=max_delay_ms)
+
+    def new_order(i):
+        items = [(menu_ids[i % len(menu_ids)], 1 + i % 3, 500), (menu_ids[(i + 1) % len(menu_ids)], 1, 600)]
+        return NewOrder(user_id, store_id, '注文受付中', 'PayPay', sum(q * p for _, q, p in items), items,
+                        datetime.datetime.now())
+
+    # 変更前: リクエストのスレッドがそれぞれ自分の接続で書き込み、1件ごとにコミットする
+    local = threading.local()
+
+    def per_request(i):
+        if not hasattr(local, 'conn'):
+            local.conn = database.connect(settings)
+        start = time.perf_counter()
+        try:
+            insert_order(local.conn, new_order(i))
+            local.conn.commit()
+            return time.perf_counter() - start, None
+        except sqlite3.Error as e:
+            local.conn.rollback()
+            return time.perf_counter() - start, str(e)
+
+    # 変更後: 書き込みスレッドに渡して注文IDが返るのを待つ
+    def via_writer(i):
+        start = time.perf_counter()
+        try:
+            order_writer.submit(new_order(i))
+            return time.perf_counter() - start, None
+        except sqlite3.Error as e:
+            return time.perf_counter() - start, str(e)
+
+    def run(label, func):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(func, range(n_orders)))
+        elapsed = time.perf_counter() - start
+        latencies = sorted(t for t, _ in results)
+        errors = collections.Counter(error for _, error in results if error)
+        click.echo(f"{label}: {n_orders}件 / {elapsed:.2f}秒 ({n_orders / elapsed:,.0f} orders/s)  "
+                   f"p50: {latencies[len(latencies) // 2] * 1000:.1f}ms  "
+                   f"p99: {latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms  "
+                   f"失敗: {sum(errors.values())}")
+        for error, count in errors.most_common(3):
+            click.echo(f"    {count}件: {error}")
+
+    run(f'リクエストごとにコミット（{concurrency}スレッド）', per_request)
+    run(f'書き込みスレッドでまとめてコミット（{concurrency}スレッド）', via_writer)
+    stats = order_writer.stats()
+    click.echo(f"書き込みスレッド: トランザクション {stats['batches']}回 / 平均 {stats['average_batch']:.1f}件 / "
+               f"最大 {stats['largest_batch']}件 / 最後のコミット {stats['last_commit_ms']}ms")
+
+
+# --- PayPay ポーラーのキャッシュのチェック ---
+@click.command('check-paypay-poller')
+@click.option('--ttl', default=0.3, show_default=True, help='チェックに使う PAYPAY_STATUS_TTL（秒）')
+def check_paypay_poller(ttl):
+    """代替の問い合わせ関数でポーラーを動かし、確定したステータスが TTL を過ぎても返ること・追跡する決済が増えすぎないことを確認する"""
+    from services.paypay_poller import PaymentStatusPoller
+
+    responses = {'completed': ['PENDING', 'COMPLETED'], 'pending': ['PENDING'], 'extra': ['PENDING']}
+    calls = {}
+
+    def fetch(merchant_payment_id):
+        calls[merchant_payment_id] = calls.get(merchant_payment_id, 0) + 1
+        answers = responses[merchant_payment_id]
+        return answers[min(calls[merchant_payment_id], len(answers)) - 1]
+
+    poller = PaymentStatusPoller(fetch=fetch, PAYPAY_POLL_INTERVAL=0.02, PAYPAY_POLL_MAX_INTERVAL=0.05,
+                                 PAYPAY_MAX_CALLS_PER_SECOND=1000.0, PAYPAY_STATUS_TTL=ttl)
+
+    def wait_for(merchant_payment_id, expected, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if poller.get_status(merchant_payment_id) == expected:
+                return True
+            time.sleep(0.01)
+        return False
+
+    failures = []
+    try:
+        # 状態の確認だけでは追跡を始めない（QR コードを作成した決済だけをポーリングする）
+        if poller.get_status('unknown') is not None or poller.stats()['tracked'] != 0:
+            failures.append("追跡していない決済の確認でポーリング対象が増えました")
+        for merchant_payment_id in ('completed', 'pending'):
+            poller.track(merchant_payment_id)
+        if not wait_for('completed', 'COMPLETED'):
+            failures.append("COMPLETED を取得できませんでした")
+        completed_calls = calls.get('completed', 0)
+        time.sleep(ttl * 3)
+        status = poller.get_status('completed')
+        if status != 'COMPLETED':
+            failures.append(f"TTL を過ぎた COMPLETED が {status!r} になりました（決済済みなのに注文が確定されません）")
+        if calls.get('completed', 0) != completed_calls:
+            failures.append("確定したステータスをポーリングし続けています")
+
+        # 未確定のステータスは TTL を過ぎても取り直されて返り続ける
+        if not wait_for('pending', 'PENDING'):
+            failures.append("PENDING を取得できませんでした")
+        pending_calls = calls.get('pending', 0)
+        time.sleep(ttl * 3)
+        if calls.get('pending', 0) <= pending_calls:
+            failures.append("未確定の決済のポーリングが止まっています")
+
+        # 追跡数の上限を超えたら、確定済み・参照の古いものから外す
+        poller.configure(PAYPAY_POLL_MAX_TRACKED=2)
+        poller.track('extra')
+        if poller.stats()['tracked'] != 2 or poller.get_status('completed') is not None:
+            failures.append(f"追跡数が上限を超えました: {poller.stats()}")
+        if 'unknown' in calls:
+            failures.append("追跡していない決済を PayPay に問い合わせました")
+    finally:
+        poller.stop()
+
+    for failure in failures:
+        click.echo(f"[NG] {failure}")
+    if failures:
+        raise SystemExit(1)
+    click.echo(f"[OK] 問い合わせ {sum(calls.values())}回 / {poller.stats()}")
+
+
+# --- 起動時間のチェック ---
+# 初回の利用時に読み込むべき重いライブラリ（起動時に読み込まれていたら NG）
+LAZY_MODULES = ('pandas', 'numpy', 'openpyxl', 'geopy', 'paypayopa', 'requests')
+
+_STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from __init__ import create_app
+create_app()
+elapsed = time.perf_counter() - start
+print(json.dumps({'seconds': elapsed, 'loaded': [m for m in %r if m in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+
+@click.command('check-startup')
+@click.option('--budget', default=1.0, show_default=True, help='create_app() までの許容時間（秒）')
+@click.option('--runs', default=5, show_default=True, help='計測回数（中央値で判定）')
+@click.option('--top', default=10, show_default=True, help='読み込みに時間のかかったモジュールを何件表示するか')
+def check_startup(budget, runs, top):
+    """新しいプロセスでアプリを読み込み・作成するまでの時間を計り、予算を超えたら失敗する"""
+    import json
+    import statistics
+    import subprocess
+    import sys
+
+    app_root = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, DATABASE_PATH=os.path.join(tempfile.mkdtemp(), 'startup.db'))
+    timings, loaded, importtime = [], set(), ''
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', _STARTUP_SCRIPT],
+                                cwd=app_root, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            click.echo(result.stderr, err=True)
+            raise SystemExit(1)
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        timings.append(report['seconds'])
+        loaded.update(report['loaded'])
+        importtime = result.stderr
+
+    # -X importtime の出力（self | cumulative | モジュール名）から、直接 import されたモジュールを時間順に表示
+    modules = []
+    for line in importtime.splitlines():
+        parts = line.split('|')
+        if line.startswith('import time:') and len(parts) == 3 and not parts[2].startswith('  '):
+            try:
+                modules.append((int(parts[1]), parts[2].strip()))
+            except ValueError:
+                continue  # 見出し行
+    for cumulative, name in sorted(modules, reverse=True)[:top]:
+        click.echo(f"  {cumulative / 1000:8.1f}ms  {name}")
+
+    median = statistics.median(timings)
+    click.echo(f"起動時間: 中央値 {median:.3f}秒（最小 {min(timings):.3f}秒 / 最大 {max(timings):.3f}秒, {runs}回） 予算 {budget:.3f}秒")
+    failed = False
+    if loaded:
+        click.echo(f"[NG] 起動時に読み込まれている重いライブラリ: {', '.join(sorted(loaded))}")
+        failed = True
+    if median > budget:
+        click.echo("[NG] 起動時間が予算を超えています")
+        failed = True
+    if failed:
+        raise SystemExit(1)
+    click.echo("[OK]")
+
+
+if __name__ == '__main__':
+    from flask.cli import FlaskGroup
+    from __init__ import create_app
+
+    FlaskGroup(create_app=create_app)()
@@ -0,0 +1,77 @@
+-- 0001: psql/ 以下の各テーブル定義をまとめたもの
+-- 既存のapp.dbに対しても安全に適用できるよう IF NOT EXISTS を付ける
+
+CREATE TABLE IF NOT EXISTS store (
+    store_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    store_name TEXT NOT NULL,
+    email TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL,
+    location TEXT,
+    representative TEXT,
+    description TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS locations (
+    location_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    location_title TEXT NOT NULL,
+    store_id INTEGER NOT NULL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (store_id) REFERENCES store(store_id)
+);
+
+CREATE TABLE IF NOT EXISTS menus (
+    menu_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    store_id INTEGER,
+    menu_name TEXT NOT NULL,
+    category TEXT NOT NULL,
+    price INTEGER NOT NULL,
+    soldout INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (store_id) REFERENCES store(store_id)
+);
+
+CREATE TABLE IF NOT EXISTS users_table (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    u_name TEXT NOT NULL,
+    email TEXT UNIQUE NOT NULL,
+    password_hash TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS orders (
+    order_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    store_id INTEGER NOT NULL,
+    status TEXT DEFAULT '注文受付中' CHECK (
+        status IN (
+            '注文受付中', '受付完了', '商品作成中', '作成直前', '受け取り待ち', 'completed', 'canceled'
+        )
+    ),
+    datetime DATETIME NOT NULL,
+    payment_method TEXT CHECK (payment_method IN ('PayPay')),
+    total_amount INTEGER NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users(user_id),
+    FOREIGN KEY (store_id) REFERENCES store(store_id)
+);
+
+CREATE TABLE IF NOT EXISTS order_items (
+    order_item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INTEGER NOT NULL,
+    menu_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL DEFAULT 1,
+    price_at_order INTEGER NOT NULL,
+    FOREIGN KEY (order_id) REFERENCES orders(order_id),
+    FOREIGN KEY (menu_id) REFERENCES menus(menu_id)
+);
+
+CREATE TABLE IF NOT EXISTS order_status_log (
+    status_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INTEGER NOT NULL,
+    status TEXT NOT NULL CHECK (status IN (
+        '注文受付中', '受付完了', '商品作成中', '作成直前', '受け取り待ち'
+    )),
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (order_id) REFERENCES orders(order_id)
+);
@@ -0,0 +1,20 @@
+-- 0002: よく使うクエリ用のインデックス
+
+-- stores_detail.order_list / store_home（店舗ごとの注文を日時順に）
+CREATE INDEX IF NOT EXISTS idx_orders_store_datetime ON orders (store_id, datetime);
+
+-- users_home.payment_history（ユーザーごとの注文を日時順に）
+CREATE INDEX IF NOT EXISTS idx_orders_user_datetime ON orders (user_id, datetime);
+
+-- 注文明細の結合（order_list / payment_history / details_payment_history）
+CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id);
+
+-- users_order.menu / store_home_menu（販売中メニューの取得）
+CREATE INDEX IF NOT EXISTS idx_menus_store_soldout ON menus (store_id, soldout);
+
+-- users_login.login / store.store_login（名前でのログイン）
+CREATE INDEX IF NOT EXISTS idx_users_u_name ON users_table (u_name);
+CREATE INDEX IF NOT EXISTS idx_store_store_name ON store (store_name);
+
+-- users_home.map_shop（店舗と位置情報の結合）
+CREATE INDEX IF NOT EXISTS idx_locations_store ON locations (store_id);
@@ -0,0 +1,35 @@
+-- 0003: 店舗ホーム用の売上集計テーブル（店舗×日、店舗×日×商品）
+-- 注文確定・キャンセル時に同じトランザクション内で更新する（services/sales_rollup.py）
+
+CREATE TABLE IF NOT EXISTS daily_sales (
+    store_id INTEGER NOT NULL,
+    sales_date TEXT NOT NULL,              -- 'YYYY-MM-DD'
+    order_count INTEGER NOT NULL DEFAULT 0,
+    sales_amount INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (store_id, sales_date)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS daily_item_sales (
+    store_id INTEGER NOT NULL,
+    sales_date TEXT NOT NULL,
+    menu_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL DEFAULT 0,
+    sales_amount INTEGER NOT NULL DEFAULT 0,
+    price_at_order INTEGER NOT NULL,       -- 最後に記録された単価
+    PRIMARY KEY (store_id, sales_date, menu_id)
+) WITHOUT ROWID;
+
+-- 既存の注文から初期データを作成
+INSERT OR REPLACE INTO daily_sales (store_id, sales_date, order_count, sales_amount)
+SELECT store_id, DATE(datetime), COUNT(*), SUM(total_amount)
+FROM orders
+WHERE status != 'canceled'
+GROUP BY store_id, DATE(datetime);
+
+INSERT OR REPLACE INTO daily_item_sales (store_id, sales_date, menu_id, quantity, sales_amount, price_at_order)
+SELECT o.store_id, DATE(o.datetime), oi.menu_id,
+       SUM(oi.quantity), SUM(oi.quantity * oi.price_at_order), MAX(oi.price_at_order)
+FROM orders o
+JOIN order_items oi ON oi.order_id = o.order_id
+WHERE o.status != 'canceled'
+GROUP BY o.store_id, DATE(o.datetime), oi.menu_id;
@@ -0,0 +1,7 @@
+-- 0004: 店舗ごとのメニューのバージョン番号
+-- メニューを変更するたびに加算し、各ワーカーのメニューキャッシュが古くなったことを検知する
+
+CREATE TABLE IF NOT EXISTS menu_versions (
+    store_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
@@ -0,0 +1,6 @@
+-- 0005: 注文リストの「対応中」表示用の部分インデックス
+-- 完了・キャンセル済みの注文を含まないので、履歴が増えても大きさは対応中の件数に比例する
+
+CREATE INDEX IF NOT EXISTS idx_orders_store_active
+    ON orders (store_id, datetime)
+    WHERE status NOT IN ('completed', 'canceled');
@@ -0,0 +1,27 @@
+-- 0006: 店舗住所の非同期ジオコーディング
+-- geocode_cache: 住所 -> 緯度経度の永続キャッシュ（見つからなかった住所も found = 0 で記録）
+-- geocode_jobs: 店舗登録時に積まれ、バックグラウンドのワーカーが処理する
+
+CREATE TABLE IF NOT EXISTS geocode_cache (
+    address TEXT PRIMARY KEY,              -- 正規化した住所
+    latitude REAL,
+    longitude REAL,
+    found INTEGER NOT NULL DEFAULT 1,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS geocode_jobs (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    store_id INTEGER NOT NULL,
+    address TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'done', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    next_attempt_at REAL NOT NULL DEFAULT 0, -- UNIX時刻（秒）
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (store_id) REFERENCES store(store_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_geocode_jobs_pending
+    ON geocode_jobs (next_attempt_at)
+    WHERE status = 'pending';
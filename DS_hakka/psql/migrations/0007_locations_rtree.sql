@@ -0,0 +1,32 @@
+-- 0007: 店舗位置の空間インデックス（R*Tree）
+-- マップの表示範囲（緯度経度の矩形）に入る店舗だけを取り出すために使う。
+-- 店舗は点なので min と max には同じ値を入れる。id は locations.location_id。
+-- locations への書き込みはトリガーで反映するので、アプリ側で更新する必要はない。
+
+CREATE VIRTUAL TABLE IF NOT EXISTS locations_rtree USING rtree (
+    id,
+    min_lat, max_lat,
+    min_lng, max_lng
+);
+
+INSERT OR REPLACE INTO locations_rtree (id, min_lat, max_lat, min_lng, max_lng)
+SELECT location_id, latitude, latitude, longitude, longitude FROM locations;
+
+CREATE TRIGGER IF NOT EXISTS locations_rtree_insert AFTER INSERT ON locations
+BEGIN
+    INSERT OR REPLACE INTO locations_rtree (id, min_lat, max_lat, min_lng, max_lng)
+    VALUES (NEW.location_id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+END;
+
+CREATE TRIGGER IF NOT EXISTS locations_rtree_update AFTER UPDATE OF latitude, longitude ON locations
+BEGIN
+    UPDATE locations_rtree
+    SET min_lat = NEW.latitude, max_lat = NEW.latitude,
+        min_lng = NEW.longitude, max_lng = NEW.longitude
+    WHERE id = NEW.location_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS locations_rtree_delete AFTER DELETE ON locations
+BEGIN
+    DELETE FROM locations_rtree WHERE id = OLD.location_id;
+END;
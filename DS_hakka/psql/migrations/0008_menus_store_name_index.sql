@@ -0,0 +1,4 @@
+-- 0008: メニュー一括登録の上書きモード用のインデックス
+-- 取り込んだ商品名と同じ名前の既存メニューを店舗ごとに探すために使う
+
+CREATE INDEX IF NOT EXISTS idx_menus_store_name ON menus (store_id, menu_name);
@@ -0,0 +1,35 @@
+-- 0009: メニュー一括登録のジョブ
+-- menu_import_jobs: アップロード1回分の進捗と結果
+-- menu_import_rows: 検証済みの行（確認画面で表示し、確定時に menus へ登録したら削除する）
+
+CREATE TABLE IF NOT EXISTS menu_import_jobs (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    store_id INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    mode TEXT NOT NULL DEFAULT 'insert' CHECK (mode IN ('insert', 'upsert')),
+    status TEXT NOT NULL DEFAULT 'validating'
+        CHECK (status IN ('validating', 'ready', 'importing', 'done', 'failed', 'canceled')),
+    processed_rows INTEGER NOT NULL DEFAULT 0,  -- 読み込んだ行数
+    valid_rows INTEGER NOT NULL DEFAULT 0,
+    error_count INTEGER NOT NULL DEFAULT 0,
+    errors TEXT,                                -- 先頭のエラーメッセージ（JSON 配列）
+    progress REAL NOT NULL DEFAULT 0,           -- 0〜1
+    inserted INTEGER NOT NULL DEFAULT 0,
+    updated INTEGER NOT NULL DEFAULT 0,
+    message TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at REAL NOT NULL DEFAULT 0,         -- UNIX時刻（秒）
+    FOREIGN KEY (store_id) REFERENCES store(store_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_menu_import_jobs_store ON menu_import_jobs (store_id, status);
+
+CREATE TABLE IF NOT EXISTS menu_import_rows (
+    job_id INTEGER NOT NULL,
+    row_num INTEGER NOT NULL,                   -- ファイル上の行番号
+    menu_name TEXT NOT NULL,
+    category TEXT NOT NULL,
+    price INTEGER NOT NULL,
+    soldout INTEGER NOT NULL,
+    PRIMARY KEY (job_id, row_num)
+) WITHOUT ROWID;
@@ -0,0 +1,23 @@
+-- 0010: サーバー側セッションとカート
+-- sessions: セッションの中身（クッキーにはランダムなセッションIDだけを入れる）
+-- cart_items: カートの商品を1行ずつ持ち、追加・数量変更は該当の行だけを更新する
+
+CREATE TABLE IF NOT EXISTS sessions (
+    sid TEXT PRIMARY KEY,
+    data TEXT NOT NULL,           -- Flask の TaggedJSONSerializer で直列化した辞書
+    expires_at REAL NOT NULL      -- UNIX時刻（秒）
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at);
+
+CREATE TABLE IF NOT EXISTS cart_items (
+    sid TEXT NOT NULL,
+    store_id INTEGER NOT NULL,
+    menu_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    price INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    added_at REAL NOT NULL,       -- カートに入れた順に表示するため
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (sid, store_id, menu_id)
+) WITHOUT ROWID;
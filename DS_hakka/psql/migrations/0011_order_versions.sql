@@ -0,0 +1,10 @@
+-- 0011: 店舗ごとの注文の更新番号
+-- 注文の確定・キャンセルのたびに sales_rollup が同じトランザクションで加算する。
+-- 売上分析のキャッシュ（services/sales_analytics.py）は、version が変わったら新しい注文だけを読み足し、
+-- cancel_version が変わったら（キャンセルやその取り消しで既存の注文が増減したので）全件を読み直す。
+
+CREATE TABLE IF NOT EXISTS order_versions (
+    store_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    cancel_version INTEGER NOT NULL DEFAULT 0
+);
@@ -0,0 +1,28 @@
+-- 0012: 顧客履歴ページ用の店舗×顧客の集計
+-- 注文確定・キャンセル時に同じトランザクション内で更新する（services/store_customers.py）
+
+CREATE TABLE IF NOT EXISTS store_customers (
+    store_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    order_count INTEGER NOT NULL DEFAULT 0,     -- キャンセルを除く注文数（来店回数）
+    total_amount INTEGER NOT NULL DEFAULT 0,    -- キャンセルを除く累計金額
+    first_order_at DATETIME NOT NULL,
+    last_order_at DATETIME NOT NULL,
+    PRIMARY KEY (store_id, user_id)
+) WITHOUT ROWID;
+
+-- 一覧の並べ替え（最終来店・来店回数・累計金額）ごとのインデックス
+-- （WITHOUT ROWID なので user_id も末尾に含まれ、同じ値の行もキーセット方式で辿れる）
+CREATE INDEX IF NOT EXISTS idx_store_customers_last ON store_customers (store_id, last_order_at);
+CREATE INDEX IF NOT EXISTS idx_store_customers_count ON store_customers (store_id, order_count);
+CREATE INDEX IF NOT EXISTS idx_store_customers_amount ON store_customers (store_id, total_amount);
+
+-- 顧客ごとの注文履歴（詳細ページ・キャンセル時の集計し直し）
+CREATE INDEX IF NOT EXISTS idx_orders_store_user_datetime ON orders (store_id, user_id, datetime);
+
+-- 既存の注文から初期データを作成
+INSERT OR REPLACE INTO store_customers (store_id, user_id, order_count, total_amount, first_order_at, last_order_at)
+SELECT store_id, user_id, COUNT(*), SUM(total_amount), MIN(datetime), MAX(datetime)
+FROM orders
+WHERE status != 'canceled'
+GROUP BY store_id, user_id;
@@ -0,0 +1,41 @@
+-- 0013: 注文ステータスの履歴と、段階ごとの所要時間の集計
+-- 注文の作成・ステータス変更と同じトランザクション内で追記・更新する（services/order_status_log.py）
+
+-- 完了・キャンセルも記録できるよう CHECK 制約を広げる（SQLite は制約を変更できないため作り直す）
+-- 時刻は orders.datetime と同じくアプリ側の現地時刻で入れる（CURRENT_TIMESTAMP は UTC になる）
+CREATE TABLE order_status_log_new (
+    status_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INTEGER NOT NULL,
+    status TEXT NOT NULL CHECK (status IN (
+        '注文受付中', '受付完了', '商品作成中', '作成直前', '受け取り待ち', 'completed', 'canceled'
+    )),
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (order_id) REFERENCES orders(order_id)
+);
+INSERT INTO order_status_log_new (status_id, order_id, status, updated_at)
+SELECT status_id, order_id, status, updated_at FROM order_status_log;
+DROP TABLE order_status_log;
+ALTER TABLE order_status_log_new RENAME TO order_status_log;
+
+-- 注文ごとのタイムライン・直前のステータスの取得
+CREATE INDEX IF NOT EXISTS idx_order_status_log_order ON order_status_log (order_id, status_id);
+
+-- 店舗×時間帯（段階に入った時刻の 0〜23 時）×段階ごとの所要時間
+CREATE TABLE IF NOT EXISTS stage_duration_stats (
+    store_id INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    sample_count INTEGER NOT NULL DEFAULT 0,
+    total_seconds REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (store_id, hour, stage)
+) WITHOUT ROWID;
+
+-- 同じ単位の所要時間のヒストグラム（パーセンタイルの推定用。bucket は order_status_log.DURATION_BUCKETS の添字）
+CREATE TABLE IF NOT EXISTS stage_duration_buckets (
+    store_id INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    sample_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (store_id, hour, stage, bucket)
+) WITHOUT ROWID;
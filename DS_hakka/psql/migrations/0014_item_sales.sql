@@ -0,0 +1,17 @@
+-- 0014: 店舗ホームの商品別売上（全期間）の集計テーブル（店舗×商品）
+-- daily_item_sales を全期間合計すると店舗の営業日数に比例するので、同じトランザクション内で合計も持つ（services/sales_rollup.py）
+
+CREATE TABLE IF NOT EXISTS item_sales (
+    store_id INTEGER NOT NULL,
+    menu_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL DEFAULT 0,
+    sales_amount INTEGER NOT NULL DEFAULT 0,
+    price_at_order INTEGER NOT NULL,       -- 記録された単価の最大値
+    PRIMARY KEY (store_id, menu_id)
+) WITHOUT ROWID;
+
+-- 既存の日別集計から初期データを作成
+INSERT OR REPLACE INTO item_sales (store_id, menu_id, quantity, sales_amount, price_at_order)
+SELECT store_id, menu_id, SUM(quantity), SUM(sales_amount), MAX(price_at_order)
+FROM daily_item_sales
+GROUP BY store_id, menu_id;
@@ -1,10 +1,16 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from werkzeug.security import generate_password_hash
 import sqlite3
-from geopy.geocoders import Nominatim
+
+from services import session_store
+from services.database import get_db_connection
+from services.geocoding import geocode_worker
 
 store_bp = Blueprint('store', __name__, url_prefix='/store')
 
+# ルートで実行するクエリ（services/query_plans.py でも同じものの実行計画を確認する）
+STORE_LOGIN_SQL = "SELECT store_id, password FROM store WHERE store_name = ?"
+
 
 @store_bp.route('/store_registration', methods=['GET', 'POST'])
 def store_registration():
@@ -37,28 +43,6 @@ def info_confirmed():
     return render_template('stores/info_confirmed.html', store=store_info)
 
 
-from geopy.geocoders import Nominatim
-import time
-
-geolocator = Nominatim(user_agent="store_locator")
-
-def get_lat_lng(place_name):
-    """
-    Nominatimを使って地名から緯度・経度を取得する。
-    連続リクエストを避けるため1秒スリープを入れる。
-    """
-    try:
-        location = geolocator.geocode(place_name, timeout=10)
-        time.sleep(1)  # リクエスト間隔を空ける
-        if location:
-            return location.latitude, location.longitude
-        else:
-            return None, None
-    except Exception as e:
-        print(f"Nominatim取得エラー: {e}")
-        return None, None
-
-
 @store_bp.route('/registration_complete', methods=['POST'])
 def registration_complete():
     store_info = session.get('store_info')
@@ -69,11 +53,8 @@ def registration_complete():
     weekend_info = "休業" if store_info['weekend_closed'] == '1' else f"{store_info['weekend_open']}〜{store_info['weekend_close']}"
     description = f"月〜金: {store_info['weekday_open']}〜{store_info['weekday_close']}, 土日祝: {weekend_info}"
 
-    # 緯度経度取得関数を呼ぶ
-    latitude, longitude = get_lat_lng(store_info['location'])
-
     try:
-        conn = sqlite3.connect('app.db')
+        conn = get_db_connection()
         cursor = conn.cursor()
 
         cursor.execute("""
@@ -89,15 +70,13 @@ def registration_complete():
         ))
         store_id = cursor.lastrowid
 
-        if latitude and longitude:
-            cursor.execute("""
-                INSERT INTO locations (location_title, store_id, latitude, longitude)
-                VALUES (?, ?, ?, ?)
-            """, (store_info['location'], store_id, latitude, longitude))
-
+        # 緯度経度はバックグラウンドで取得する（キャッシュ済みの住所ならここで locations に入る）
+        coords = geocode_worker.enqueue(conn, store_id, store_info['location'])
 
         conn.commit()
         conn.close()
+        if coords is None:
+            geocode_worker.wake()
 
         flash("店舗情報を登録しました")
         session.pop('store_info', None)
@@ -106,6 +85,7 @@ def registration_complete():
         flash("このメールアドレスはすでに登録されています")
         return redirect(url_for('store.store_registration'))
 
+    latitude, longitude = coords or (None, None)
     return render_template('stores/registration_complete.html',
                            latitude=latitude,
                            longitude=longitude,
@@ -120,15 +100,16 @@ def store_login():
         store_name = request.form.get('store_name')
         password = request.form.get('password')
 
-        conn = sqlite3.connect('app.db')
+        conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT store_id, password FROM store WHERE store_name = ?", (store_name,))
+        cursor.execute(STORE_LOGIN_SQL, (store_name,))
         result = cursor.fetchone()
         conn.close()
 
         if result:
             store_id, hashed_pw = result
             if check_password_hash(hashed_pw, password):
+                session_store.regenerate()  # ログイン前のセッションIDを引き継がない
                 session['store_id'] = store_id
                 session['store_name'] = store_name  # ← ★ここを追加！
                 flash("ログインに成功しました")
@@ -1,24 +1,26 @@
 # --- 必要なライブラリのインポート ---
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, send_file
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, send_file, jsonify, current_app, Response, stream_with_context
 import sqlite3
-import csv
 from werkzeug.utils import secure_filename
 import os
 from functools import wraps
 import io
 import json
-import pandas as pd
 from datetime import datetime, date
 
+from services import menu_import, order_status, order_status_log, prep_items, sales_rollup, store_orders
+from services.database import get_db_connection
+from services.menu_cache import menu_cache, bump_version
+from services.menu_import_jobs import menu_import_jobs
+from services.order_events import order_events, format_sse
+from services.wait_times import wait_times
+
 # --- Blueprint の定義（URLのプレフィックス /stores を付与）---
 stores_detail_bp = Blueprint('stores_detail', __name__, url_prefix='/stores')
 
-# --- DB接続関数（共通処理）---
-def get_db_connection():
-    db_path = os.path.join(os.path.dirname(__file__), '..', '..', 'app.db')
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row  # 行を辞書形式で取得
-    return conn
+# ルートで実行するクエリ（services/query_plans.py でも同じものの実行計画を確認する）
+MENU_REGISTRATION_SQL = "SELECT menu_id, menu_name, category, price, soldout FROM menus WHERE store_id = ? ORDER BY menu_id DESC"
+STORE_INFO_SQL = "SELECT store_name, email, location, representative, description, created_at FROM store WHERE store_id = ?"
 
 # --- 店舗用ホーム画面（ログイン必須）---
 @stores_detail_bp.route('/store_home')
@@ -30,52 +32,22 @@ def store_home():
     store_id = session['store_id']
     store_name = session.get('store_name', 'ゲスト')
 
+    # 売上は注文確定・キャンセル時に更新される集計テーブルから取得
     conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # 商品ごとの売上金額合計を取得
-    cursor.execute("""
-        SELECT m.menu_name, m.category, oi.price_at_order, quantity,
-               SUM(oi.quantity * oi.price_at_order) AS total_sales
-        FROM order_items oi
-        JOIN orders o ON oi.order_id = o.order_id
-        JOIN menus m ON oi.menu_id = m.menu_id
-        WHERE o.store_id = ? AND o.status != 'canceled'
-        GROUP BY m.menu_name, m.category
-        ORDER BY total_sales DESC
-    """, (store_id,))
-    product_sales = cursor.fetchall()
-
-    # 本日の売上と注文数
-    today_str = date.today().isoformat()
-    cursor.execute("""
-        SELECT COALESCE(SUM(total_amount), 0) AS daily_sales,
-               COUNT(*) AS daily_orders
-        FROM orders
-        WHERE store_id = ? AND DATE(datetime) = ? AND status != 'canceled'
-    """, (store_id, today_str))
-    today_stats = cursor.fetchone()
-    daily_sales = today_stats['daily_sales']
-    daily_orders = today_stats['daily_orders']
-
-    # 今月の売上
-    first_day_of_month = date.today().replace(day=1).isoformat()
-    cursor.execute("""
-        SELECT COALESCE(SUM(total_amount), 0) AS monthly_sales
-        FROM orders
-        WHERE store_id = ? AND DATE(datetime) >= ? AND status != 'canceled'
-    """, (store_id, first_day_of_month))
-    monthly_sales = cursor.fetchone()['monthly_sales']
-
+    dashboard = sales_rollup.get_dashboard(conn, store_id)
+    stage_stats = order_status_log.get_stage_stats(conn, store_id, hour=datetime.now().hour)
     conn.close()
 
     return render_template(
         'stores_detail/store_home.html',
         store_name=store_name,
-        product_sales=product_sales,
-        daily_sales=f"{daily_sales:,}",
-        daily_orders=f"{daily_orders:,}",
-        monthly_sales=f"{monthly_sales:,}"
+        product_sales=dashboard['product_sales'],
+        daily_sales=f"{dashboard['daily_sales']:,}",
+        daily_orders=f"{dashboard['daily_orders']:,}",
+        monthly_sales=f"{dashboard['monthly_sales']:,}",
+        stage_stats=stage_stats,
+        current_hour=datetime.now().hour,
+        wait=wait_times.estimate_store(store_id)
     )
 
 # --- 店舗メニュー一覧表示 ---
@@ -88,93 +60,11 @@ def store_home_menu():
     store_name = session.get('store_name', 'ゲスト')
     store_id = session.get('store_id')
 
-    # DBからメニューを取得
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT menu_name, price, category, soldout FROM menus WHERE store_id = ?", (store_id,))
-    menus = cur.fetchall()
-    menu_items = conn.execute("SELECT menu_id, menu_name, category, price FROM menus WHERE store_id = ? AND soldout = 0", (store_id,)).fetchall()
-    categories = conn.execute("""SELECT DISTINCT category FROM menus WHERE store_id = ? AND soldout = 0""", (store_id,)).fetchall()
-    categories = [row['category'] for row in categories if row['category']]  # Noneを除外
-
-    conn.close()
-
-    return render_template('stores_detail/store_home_menu.html', store_name=store_name, menus=menus,menu_items=menu_items, categories=categories)
+    # メニューはキャッシュから取得
+    cached = menu_cache.get(store_id) or {'menus': [], 'menu_items': [], 'categories': []}
 
+    return render_template('stores_detail/store_home_menu.html', store_name=store_name, menus=cached['menus'], menu_items=cached['menu_items'], categories=cached['categories'])
 
-# --- ヘルパー関数（CSV/Excelファイルを読み込む）---
-def parse_menu_file(file):
-    filename = file.filename
-    menus = []
-    
-    try:
-        # CSVファイル処理
-        if filename.endswith('.csv'):
-            stream = io.StringIO(file.stream.read().decode("utf-8-sig"))
-            csv_data = csv.DictReader(stream)
-            required_headers = {'menu_name', 'price'}
-            if not required_headers.issubset(set(csv_data.fieldnames or [])):
-                return None, f'CSVヘッダーが無効です。必須ヘッダー({", ".join(required_headers)})がありません。'
-            menus = list(csv_data)
-
-        # Excelファイル処理
-        elif filename.endswith(('.xlsx', '.xls')):
-            df = pd.read_excel(file.stream, dtype=str)
-            required_headers = {'menu_name', 'price'}
-            if not required_headers.issubset(set(df.columns)):
-                return None, f'Excelヘッダーが無効です。必須ヘッダー({", ".join(required_headers)})がありません。'
-            df['category'] = df['category'].fillna('')
-            df['soldout'] = df['soldout'].fillna('0')
-            menus = df.to_dict('records')
-        else:
-            return None, '対応していないファイル形式です。.csvまたは.xlsxファイルをアップロードしてください。'
-        
-        return menus, None
-    except Exception as e:
-        return None, f"ファイルの読み込み中にエラーが発生しました: {e}"
-
-# --- メニューデータのバリデーション ---
-def validate_menu_data(menus_data):
-    validated_menus = []
-    errors = []
-    for i, row in enumerate(menus_data):
-        row_num_str = f"行 {i+2}" if len(menus_data) > 1 else "手動入力"
-        
-        menu_name = row.get('menu_name')
-        price_str = str(row.get('price', '')).strip()
-        soldout_str = str(row.get('soldout', '0')).strip()
-        category = row.get('category', '')
-
-        # 必須項目チェック
-        if not menu_name or not price_str:
-            errors.append(f"{row_num_str}: 必須項目 (menu_name, price) が空です。")
-            continue
-
-        # 価格チェック
-        try:
-            price = int(float(price_str))
-            if price < 0:
-                raise ValueError
-        except (ValueError, TypeError):
-            errors.append(f"{row_num_str}: 価格の値 ('{price_str}') が不正です。0以上の数値を入力してください。")
-            continue
-
-        # 売り切れフラグチェック
-        try:
-            soldout = int(float(soldout_str))
-            if soldout not in [0, 1]:
-                raise ValueError
-        except (ValueError, TypeError):
-            errors.append(f"{row_num_str}: 在庫の値 ('{soldout_str}') が不正です。0 (販売中) か 1 (売り切れ) で入力してください。")
-            continue
-
-        validated_menus.append({
-            'menu_name': menu_name,
-            'category': category,
-            'price': price,
-            'soldout': soldout
-        })
-    return validated_menus, errors
 
 # --- Excelテンプレートをダウンロードさせるルート ---
 @stores_detail_bp.route('/download-template')
@@ -187,6 +77,7 @@ def download_template():
             'price': [800, 350, 150],
             'soldout': [0, 0, 1]
         }
+        import pandas as pd  # pandas は読み込みに時間がかかるため、テンプレート作成時にだけ読み込む
         df = pd.DataFrame(template_data)
 
         # Excelファイルをメモリに生成
@@ -217,10 +108,7 @@ def menu_registration():
     # 既存メニューをDBから取得
     conn = get_db_connection()
     try:
-        existing_menus = conn.execute(
-            "SELECT menu_id, menu_name, category, price, soldout FROM menus WHERE store_id = ? ORDER BY menu_id DESC",
-            (store_id,)
-        ).fetchall()
+        existing_menus = conn.execute(MENU_REGISTRATION_SQL, (store_id,)).fetchall()
     except sqlite3.Error as e:
         flash(f"メニューの読み込み中にエラーが発生しました: {e}", "error")
         existing_menus = []
@@ -236,109 +124,117 @@ def menu_preview():
         flash("ログインしてください", "warning")
         return redirect(url_for('store.store_login'))
 
-    menus_to_check = []
-    errors = []
+    store_id = session['store_id']
+    mode = 'upsert' if request.form.get('upsert') else 'insert'
     file = request.files.get('product_csv')
 
-    # ファイルアップロードされた場合
+    # ファイルアップロードされた場合（保存してジョブを作り、読み込み・検証はバックグラウンドで行う）
     if file and file.filename:
-        menus_data, file_error = parse_menu_file(file)
-        if file_error:
-            flash(file_error, 'error')
+        if not file.filename.endswith(('.csv', '.xlsx', '.xls')):
+            flash('対応していないファイル形式です。.csvまたは.xlsxファイルをアップロードしてください。', 'error')
             return redirect(url_for('stores_detail.menu_registration'))
-        menus_to_check, errors = validate_menu_data(menus_data)
+        conn = get_db_connection()
+        try:
+            job_id = menu_import_jobs.create_from_upload(conn, store_id, file, mode=mode)
+        finally:
+            conn.close()
+        return redirect(url_for('stores_detail.menu_check', job_id=job_id))
 
     # 手動入力の場合
-    else:
-        product_name = request.form.get('product_name')
-        product_price_str = request.form.get('product_price')
-
-        if product_name or product_price_str:
-            if not product_name or not product_price_str:
-                flash('手動で入力する場合、商品名と値段の両方が必須です。', 'error')
-                return redirect(url_for('stores_detail.menu_registration'))
-            
-            manual_data = [{
-                'menu_name': product_name,
-                'price': product_price_str,
-                'category': request.form.get('product_description', ''),
-                'soldout': '0'
-            }]
-            menus_to_check, errors = validate_menu_data(manual_data)
-        else:
-            flash('登録するデータをアップロードするか、フォームに入力してください。', 'error')
-            return redirect(url_for('stores_detail.menu_registration'))
+    product_name = request.form.get('product_name')
+    product_price_str = request.form.get('product_price')
 
-    if errors:
-        for error in errors:
-            flash(error, 'warning')
-        if not menus_to_check:
-            flash('有効なデータがなかったため、プレビューできませんでした。', 'error')
-            return redirect(url_for('stores_detail.menu_registration'))
+    if not product_name and not product_price_str:
+        flash('登録するデータをアップロードするか、フォームに入力してください。', 'error')
+        return redirect(url_for('stores_detail.menu_registration'))
+    if not product_name or not product_price_str:
+        flash('手動で入力する場合、商品名と値段の両方が必須です。', 'error')
+        return redirect(url_for('stores_detail.menu_registration'))
 
-    if not menus_to_check:
-        flash('登録するデータがありません。', 'info')
+    manual_data = {
+        'menu_name': product_name,
+        'price': product_price_str,
+        'category': request.form.get('product_description', ''),
+        'soldout': '0'
+    }
+    menu, error = menu_import.validate_row(None, manual_data)
+    if error:
+        flash(error, 'warning')
+        flash('有効なデータがなかったため、プレビューできませんでした。', 'error')
         return redirect(url_for('stores_detail.menu_registration'))
 
-    # 一時的にセッションに保存して次画面へ
-    session['menus_to_confirm'] = menus_to_check
-    return redirect(url_for('stores_detail.menu_check'))
+    conn = get_db_connection()
+    try:
+        job_id = menu_import_jobs.create_from_rows(conn, store_id, [menu], mode=mode)
+    finally:
+        conn.close()
+    return redirect(url_for('stores_detail.menu_check', job_id=job_id))
 
-# --- メニュー確認画面 ---
-@stores_detail_bp.route('/menu-check', methods=['GET'])
-def menu_check():
+# --- メニュー確認画面（検証済みの行をページ単位で表示） ---
+@stores_detail_bp.route('/menu-check/<int:job_id>', methods=['GET'])
+def menu_check(job_id):
     if 'store_id' not in session:
         flash("ログインしてください", "warning")
         return redirect(url_for('store.store_login'))
 
-    menus_to_check = session.get('menus_to_confirm', [])
-    if not menus_to_check:
+    conn = get_db_connection()
+    job = menu_import_jobs.status(conn, job_id, session['store_id'])
+    if job is None:
+        conn.close()
         flash('確認するメニューがありません。登録画面からやり直してください。', 'info')
         return redirect(url_for('stores_detail.menu_registration'))
 
+    menus_to_check, next_after = [], None
+    after = request.args.get('after', 0, type=int)
+    if job['status'] == 'ready':
+        menus_to_check, next_after = menu_import_jobs.fetch_rows(conn, job_id, after=after)
+    conn.close()
+
     store_name = session.get('store_name', 'ゲスト')
-    return render_template('stores_detail/menu_check.html', store_name=store_name, menus_to_check=menus_to_check)
+    return render_template('stores_detail/menu_check.html', store_name=store_name, job=job,
+                           menus_to_check=menus_to_check, after=after, next_after=next_after)
 
-# --- メニュー最終登録処理 ---
-@stores_detail_bp.route('/menu-finalize', methods=['POST'])
-def menu_finalize():
+# --- 取り込みジョブの進捗（確認画面のJSから呼ぶ） ---
+@stores_detail_bp.route('/menu-import/<int:job_id>/status')
+def menu_import_status(job_id):
     if 'store_id' not in session:
-        flash("ログインしてください", "warning")
-        return redirect(url_for('store.store_login'))
+        return jsonify({'error': 'ログインしてください'}), 401
 
-    store_id = session['store_id']
-    menus_data_str = request.form.get('menus_data')
+    conn = get_db_connection()
+    job = menu_import_jobs.status(conn, job_id, session['store_id'])
+    conn.close()
+    if job is None:
+        return jsonify({'error': 'ジョブが見つかりません'}), 404
+    return jsonify(job)
 
-    if not menus_data_str:
-        flash('登録データが見つかりませんでした。', 'error')
-        return redirect(url_for('stores_detail.menu_registration'))
+# --- メニュー最終登録処理（登録はバックグラウンドで行う） ---
+@stores_detail_bp.route('/menu-finalize/<int:job_id>', methods=['POST'])
+def menu_finalize(job_id):
+    if 'store_id' not in session:
+        flash("ログインしてください", "warning")
+        return redirect(url_for('store.store_login'))
 
+    conn = get_db_connection()
     try:
-        menus_to_insert = json.loads(menus_data_str)
-    except json.JSONDecodeError:
-        flash('登録データの形式が不正です。', 'error')
-        return redirect(url_for('stores_detail.menu_registration'))
+        started = menu_import_jobs.start_import(conn, job_id, session['store_id'])
+    finally:
+        conn.close()
+    if not started:
+        flash('このデータはすでに登録済みか、登録できる状態ではありません。', 'error')
+    return redirect(url_for('stores_detail.menu_check', job_id=job_id))
+
+# --- 取り込みの取り消し ---
+@stores_detail_bp.route('/menu-import/<int:job_id>/cancel', methods=['POST'])
+def menu_import_cancel(job_id):
+    if 'store_id' not in session:
+        flash("ログインしてください", "warning")
+        return redirect(url_for('store.store_login'))
 
-    # DBにデータ挿入
     conn = get_db_connection()
-    cursor = conn.cursor()
-    inserted_count = 0
     try:
-        for menu in menus_to_insert:
-            cursor.execute(
-                "INSERT INTO menus (store_id, menu_name, category, price, soldout) VALUES (?, ?, ?, ?, ?)",
-                (store_id, menu['menu_name'], menu['category'], menu['price'], menu['soldout'])
-            )
-            inserted_count += 1
-        conn.commit()
-        flash(f'{inserted_count}件のメニューを登録しました。', 'success')
-    except sqlite3.Error as e:
-        conn.rollback()
-        flash(f"データベースへの登録中にエラーが発生しました: {e}", "error")
+        menu_import_jobs.cancel(conn, job_id, session['store_id'])
     finally:
         conn.close()
-        session.pop('menus_to_confirm', None)
-
     return redirect(url_for('stores_detail.menu_registration'))
 
 # --- メニュー削除処理 ---
@@ -353,8 +249,12 @@ def menu_delete(menu_id):
     try:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM menus WHERE menu_id = ? AND store_id = ?", (menu_id, store_id))
+        deleted = cursor.rowcount  # バージョンの更新で上書きされる前に取っておく
+        if deleted > 0:
+            bump_version(conn, store_id)
         conn.commit()
-        if cursor.rowcount > 0:
+        menu_cache.invalidate(store_id)
+        if deleted > 0:
             flash("メニューを削除しました。", "success")
         else:
             flash("削除対象のメニューが見つからないか、権限がありません。", "error")
@@ -370,56 +270,188 @@ def menu_delete(menu_id):
 def order_list():
     store_id = session.get('store_id')
     store_name = session.get('store_name', 'ゲスト')
-    
+    status = request.args.get('status', 'active')  # 既定は対応中の注文のみ
+
     conn = get_db_connection()
-    query = """
-        SELECT
-            o.order_id, o.datetime, o.total_amount, o.status,
-            u.u_name, m.menu_name, oi.quantity, oi.price_at_order
-        FROM orders AS o
-        JOIN order_items AS oi ON o.order_id = oi.order_id
-        JOIN menus AS m ON oi.menu_id = m.menu_id
-        JOIN users_table AS u ON o.user_id = u.id
-        WHERE o.store_id = ?
-        ORDER BY o.datetime DESC;
-    """
-    orders_raw = conn.execute(query, (store_id,)).fetchall()
+    orders_list, next_cursor = store_orders.fetch_order_page(
+        conn, store_id, status=status,
+        page_size=current_app.config.get('ORDER_LIST_PAGE_SIZE', store_orders.DEFAULT_PAGE_SIZE))
+    conn.close()
+
+    return render_template('stores_detail/order_list.html', orders=orders_list, store_name=store_name,
+                           status=status, next_cursor=next_cursor)
+
+# --- 注文一覧の続きをJSONで返す（「もっと見る」用）---
+@stores_detail_bp.route('/order-list/page')
+def order_list_page():
+    if 'store_id' not in session:
+        return jsonify({'error': 'ログインしてください'}), 401
+
+    conn = get_db_connection()
+    orders_list, next_cursor = store_orders.fetch_order_page(
+        conn, session['store_id'],
+        status=request.args.get('status', 'active'),
+        cursor=request.args.get('cursor'),
+        page_size=current_app.config.get('ORDER_LIST_PAGE_SIZE', store_orders.DEFAULT_PAGE_SIZE))
     conn.close()
 
-    orders_dict = {}
-    for row in orders_raw:
-        order_id = row['order_id']
-        if order_id not in orders_dict:
-            orders_dict[order_id] = {
-                'id': order_id, 'datetime': row['datetime'], 'status': row['status'],
-                'user_name': row['u_name'], 'total_amount': row['total_amount'],
-                'items_list': [] # ★★★ キー名を'items'から'items_list'に変更 ★★★
-            }
-        orders_dict[order_id]['items_list'].append({
-            'name': row['menu_name'], 'quantity': row['quantity'], 'price': row['price_at_order']
-        })
-    
-    orders_list = list(orders_dict.values())
-    return render_template('stores_detail/order_list.html', orders=orders_list, store_name=store_name)
+    return jsonify({'orders': orders_list, 'next_cursor': next_cursor})
 
 @stores_detail_bp.route('/update-order-status/<int:order_id>', methods=['POST'])
 def update_order_status(order_id):
-    new_status = request.form.get('status')
-    valid_statuses = ['注文受付中', '受付完了', '商品作成中', '作成直前', '受け取り待ち', 'completed', 'canceled']
+    if 'store_id' not in session:
+        flash("ログインしてください")
+        return redirect(url_for('store.store_login'))
 
-    if new_status not in valid_statuses:
+    new_status = request.form.get('status')
+    if new_status not in order_status.VALID_STATUSES:
         flash("無効なステータスです")
         return redirect(url_for('stores_detail.order_list'))
 
+    result = _change_order_status(session['store_id'], [order_id], new_status)
+    if result is None:
+        flash("注文ステータスの更新に失敗しました", "error")
+        return redirect(url_for('stores_detail.order_list'))
+
+    _, _, not_found = result
+    if not_found:
+        flash("注文が見つかりません")
+    else:
+        flash("注文ステータスを更新しました")
+    return redirect(url_for('stores_detail.order_list'))
+
+
+# --- 注文ステータスの一括変更（JSON） ---
+# {"order_ids": [1, 2, ...], "status": "受け取り待ち"} を受け取り、ログイン中の店舗の注文だけを
+# 1つのトランザクションで変更する。注文リストはページを読み直さず、返した内容で行を書き換える。
+@stores_detail_bp.route('/update-order-status/batch', methods=['POST'])
+def update_order_status_batch():
+    if 'store_id' not in session:
+        return jsonify({'error': 'ログインしてください'}), 401
+
+    payload = request.get_json(silent=True) or {}
+    new_status = payload.get('status')
+    if new_status not in order_status.VALID_STATUSES:
+        return jsonify({'error': '無効なステータスです'}), 400
+    try:
+        order_ids = [int(order_id) for order_id in payload.get('order_ids') or []]
+    except (TypeError, ValueError):
+        return jsonify({'error': '注文IDが正しくありません'}), 400
+    if not order_ids:
+        return jsonify({'error': '注文を選択してください'}), 400
+    if len(order_ids) > order_status.MAX_BATCH_SIZE:
+        return jsonify({'error': f'一度に変更できる注文は {order_status.MAX_BATCH_SIZE} 件までです'}), 400
+
+    result = _change_order_status(session['store_id'], order_ids, new_status)
+    if result is None:
+        return jsonify({'error': '注文ステータスの更新に失敗しました'}), 500
+
+    changed, unchanged, not_found = result
+    return jsonify({'status': new_status, 'changed': changed, 'unchanged': unchanged, 'not_found': not_found})
+
+
+def _change_order_status(store_id, order_ids, new_status):
+    """ステータスを変更してコミットし、変更を店舗の画面へ通知する。
+
+    戻り値は order_status.change_status と同じ。DB の更新に失敗した場合は巻き戻して None を返す。
+    """
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE orders SET status = ? WHERE order_id = ?", (new_status, order_id))
-    conn.commit()
+    try:
+        changed, unchanged, not_found = order_status.change_status(conn, store_id, order_ids, new_status)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        current_app.logger.exception("注文ステータスの更新に失敗しました")
+        return None
+    finally:
+        conn.close()
+
+    for change in changed:
+        order_events.publish(store_id, 'status_changed', {'id': change['id'], 'status': change['status']})
+    return changed, unchanged, not_found
+
+
+# --- 注文ステータスの履歴 ---
+@stores_detail_bp.route('/order-timeline/<int:order_id>')
+def order_timeline(order_id):
+    if 'store_id' not in session:
+        flash("ログインしてください")
+        return redirect(url_for('store.store_login'))
+
+    conn = get_db_connection()
+    order = conn.execute("SELECT order_id, datetime, status, total_amount FROM orders WHERE order_id = ? AND store_id = ?",
+                         (order_id, session['store_id'])).fetchone()
+    timeline = order_status_log.get_timeline(conn, order_id) if order else []
     conn.close()
+    if order is None:
+        flash("注文が見つかりません")
+        return redirect(url_for('stores_detail.order_list'))
 
-    flash("注文ステータスを更新しました")
-    return redirect(url_for('stores_detail.order_list'))
+    return render_template('stores_detail/order_timeline.html', store_name=session.get('store_name', 'ゲスト'),
+                           order=order, timeline=timeline)
+
+
+# --- キッチン表示（作る商品の数） ---
+# 対応中の注文の商品数をメニューごとに合計したもの。注文イベントで更新されるカウンタを読むだけなので、
+# 注文の一覧は検索しない。画面は注文イベント（SSE）を受けたら JSON を取り直す。
+@stores_detail_bp.route('/kitchen')
+def kitchen():
+    if 'store_id' not in session:
+        flash("ログインしてください")
+        return redirect(url_for('store.store_login'))
 
+    store_id = session['store_id']
+    store_name = session.get('store_name', 'ゲスト')
+    cached = menu_cache.get(store_id) or {'by_id': {}}
+    board = prep_items.get_board(store_id, cached['by_id'])
+    return render_template('stores_detail/kitchen.html', store_name=store_name, board=board)
+
+
+@stores_detail_bp.route('/kitchen/data')
+def kitchen_data():
+    if 'store_id' not in session:
+        return jsonify({'error': 'ログインしてください'}), 401
+
+    store_id = session['store_id']
+    cached = menu_cache.get(store_id) or {'by_id': {}}
+    return jsonify(prep_items.get_board(store_id, cached['by_id']))
+
+
+# --- 注文のリアルタイム配信（Server-Sent Events）---
+@stores_detail_bp.route('/order-events')
+def order_events_stream():
+    if 'store_id' not in session:
+        return jsonify({'error': 'ログインしてください'}), 401
+
+    store_id = session['store_id']
+    heartbeat = current_app.config['ORDER_EVENTS_HEARTBEAT_SECONDS']
+    # ブラウザは再接続時に Last-Event-ID ヘッダーで最後に受け取ったIDを送ってくる
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+
+    def generate():
+        sub, replay = order_events.subscribe(store_id, last_event_id)
+        with sub:
+            yield "retry: 3000\n\n"
+            if replay is None:
+                # 取りこぼしがあるので画面ごと読み直してもらう
+                yield "event: resync\ndata: {}\n\n"
+                return
+            for event in replay:
+                yield format_sse(event)
+            while not sub.overflowed:
+                event = sub.get(timeout=heartbeat)
+                if event is None:
+                    yield ": heartbeat\n\n"
+                else:
+                    yield format_sse(event)
+            # 送信が追いつかずバッファがあふれた場合は切断し、Last-Event-ID からの再接続に任せる
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 # --- 操作手順ページ表示 ---
 @stores_detail_bp.route('/procedure')
@@ -452,7 +484,7 @@ def store_info():
 
     conn = get_db_connection()
     cur = conn.cursor()
-    cur.execute("SELECT store_name, email, location, representative, description, created_at FROM store WHERE store_id = ?", (session['store_id'],))
+    cur.execute(STORE_INFO_SQL, (session['store_id'],))
     store_data = cur.fetchone()
     conn.close()
 
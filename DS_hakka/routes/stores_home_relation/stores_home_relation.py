@@ -1,17 +1,13 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, current_app
 from werkzeug.security import generate_password_hash
 import sqlite3
-from geopy.geocoders import Nominatim
-import os
-
-stores_home_relation_bp = Blueprint('stores_home_relation', __name__, url_prefix='/stores_home_relation')
 
+from services import store_customers
+from services.database import get_db_connection
+from services.menu_cache import menu_cache
+from services.sales_analytics import sales_analytics
 
-def get_db_connection():
-    db_path = os.path.join(os.path.dirname(__file__), '..', '..', 'app.db')
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row  # 行を辞書形式で取得
-    return conn
+stores_home_relation_bp = Blueprint('stores_home_relation', __name__, url_prefix='/stores_home_relation')
 
 
 @stores_home_relation_bp.route('/store_home_menu')
@@ -23,18 +19,10 @@ def store_home_menu():
     store_name = session.get('store_name', 'ゲスト')
     store_id = session.get('store_id')
 
-    # DBからメニューを取得
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT menu_name, price, category, soldout FROM menus WHERE store_id = ?", (store_id,))
-    menus = cur.fetchall()
-    menu_items = conn.execute("SELECT menu_id, menu_name, category, price FROM menus WHERE store_id = ? AND soldout = 0", (store_id,)).fetchall()
-    categories = conn.execute("""SELECT DISTINCT category FROM menus WHERE store_id = ? AND soldout = 0""", (store_id,)).fetchall()
-    categories = [row['category'] for row in categories if row['category']]  # Noneを除外
-
-    conn.close()
+    # メニューはキャッシュから取得
+    cached = menu_cache.get(store_id) or {'menus': [], 'menu_items': [], 'categories': []}
 
-    return render_template('stores_home_relation/store_home_menu.html', store_name=store_name, menus=menus,menu_items=menu_items, categories=categories)
+    return render_template('stores_home_relation/store_home_menu.html', store_name=store_name, menus=cached['menus'], menu_items=cached['menu_items'], categories=cached['categories'])
 
 
 
@@ -48,6 +36,15 @@ def store_analysis():
     return render_template('stores_home_relation/store_analysis.html', store_name=store_name)
 
 
+@stores_home_relation_bp.route('/store_analysis/data')
+def store_analysis_data():
+    # グラフ描画用の集計結果（注文が入るまではキャッシュを返す）
+    if 'store_id' not in session:
+        return jsonify({'error': 'ログインしてください'}), 401
+
+    return jsonify(sales_analytics.get(session['store_id']))
+
+
 @stores_home_relation_bp.route('/store_customer_history')
 def store_customer_history():
     if 'store_id' not in session:
@@ -55,7 +52,38 @@ def store_customer_history():
         return redirect(url_for('store.store_login'))
 
     store_name = session.get('store_name', 'ゲスト')
-    return render_template('stores_home_relation/store_customer_history.html', store_name=store_name)
+    sort = request.args.get('sort', 'last')
+    if sort not in store_customers.SORT_COLUMNS:
+        sort = 'last'
+
+    conn = get_db_connection()
+    customers, next_cursor = store_customers.fetch_customer_page(
+        conn, session['store_id'], sort=sort, cursor=request.args.get('cursor'),
+        page_size=current_app.config.get('CUSTOMER_LIST_PAGE_SIZE', store_customers.DEFAULT_PAGE_SIZE))
+    summary = store_customers.get_summary(conn, session['store_id'])
+    conn.close()
+
+    return render_template('stores_home_relation/store_customer_history.html', store_name=store_name,
+                           customers=customers, summary=summary, sort=sort, next_cursor=next_cursor)
+
+
+@stores_home_relation_bp.route('/store_customer_history/<int:user_id>')
+def store_customer_detail(user_id):
+    if 'store_id' not in session:
+        flash("ログインしてください")
+        return redirect(url_for('store.store_login'))
+
+    store_name = session.get('store_name', 'ゲスト')
+    conn = get_db_connection()
+    result = store_customers.get_customer(conn, session['store_id'], user_id)
+    conn.close()
+    if result is None:
+        flash("この顧客の注文履歴はありません")
+        return redirect(url_for('stores_home_relation.store_customer_history'))
+
+    customer, orders = result
+    return render_template('stores_home_relation/store_customer_detail.html', store_name=store_name,
+                           customer=customer, orders=orders)
 
 
 @stores_home_relation_bp.route('/store_memo')
@@ -1,14 +1,41 @@
-from flask import Blueprint, render_template, session, redirect, url_for, flash
-import sqlite3
-import os
+from flask import Blueprint, render_template, session, redirect, url_for, flash, request, jsonify, current_app
+
+from services import store_locator, user_orders
+from services.database import get_db_connection
 
 users_home_bp = Blueprint('users_home', __name__, url_prefix='/users_home')
 
-def get_db_connection():
-    db_path = os.path.join(os.path.dirname(__file__), '..', '..', 'app.db')
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
+# ルートで実行するクエリ（services/query_plans.py でも同じものの実行計画を確認する）
+STORES_SQL = """
+    SELECT
+        store_id AS id,
+        store_name AS name,
+        description
+    FROM store
+    ORDER BY store_id
+"""
+PAYMENT_DETAILS_SQL = """
+    SELECT
+        o.order_id,
+        o.datetime,
+        o.total_amount,
+        o.status,
+        s.store_name,
+        m.menu_name,
+        oi.quantity,
+        oi.price_at_order
+    FROM orders AS o
+    JOIN store AS s ON o.store_id = s.store_id
+    JOIN order_items AS oi ON o.order_id = oi.order_id
+    JOIN menus AS m ON oi.menu_id = m.menu_id
+    WHERE o.user_id = ? AND o.order_id = ?
+    ORDER BY oi.order_item_id ASC
+"""
+USER_DATA_SQL = """
+    SELECT u_name, email, created_at
+    FROM users_table
+    WHERE id = ?
+"""
 
 @users_home_bp.route('/logout')
 def logout():
@@ -22,18 +49,10 @@ def home():
         flash("ログインしてください")
         return redirect(url_for('users_login.login'))
 
-    conn = sqlite3.connect('app.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_db_connection()
     cursor = conn.cursor()
 
-    cursor.execute("""
-        SELECT
-            store_id AS id,
-            store_name AS name,
-            description
-        FROM store
-        ORDER BY store_id
-    """)
+    cursor.execute(STORES_SQL)
     stores = cursor.fetchall()
     conn.close()
 
@@ -45,38 +64,51 @@ def map_shop():
         flash("ログインしてください")
         return redirect(url_for('users_login.login'))
 
-    conn = sqlite3.connect('app.db')
-    cursor = conn.cursor()
+    # 店舗はJSが表示範囲ごとに /map_shop/stores から読み込む
+    u_name = session.get('u_name', 'ゲスト')
+
+    return render_template('users_home/map_shop.html', u_name=u_name)
+
+
+# --- 地図の表示範囲内の店舗をJSONで返す ---
+@users_home_bp.route('/map_shop/stores')
+def map_shop_stores():
+    if 'id' not in session:
+        return jsonify({'error': 'ログインしてください'}), 401
 
-    cursor.execute("""
-        SELECT s.store_id, s.store_name, s.description,
-               s.email, s.representative,
-               l.latitude, l.longitude
-        FROM store s
-        JOIN locations l ON s.store_id = l.store_id
-        ORDER BY s.store_id
-    """)
-
-    stores = [
-        {
-            'id': row[0],
-            'store_name': row[1],  # ★ 変更点: 'name' から 'store_name' に変更
-            'description': row[2],
-            'email': row[3],
-            'representative': row[4],
-            'lat': row[5],
-            'lng': row[6]
-        } for row in cursor.fetchall()
-    ]
+    try:
+        south, west, north, east = store_locator.parse_bbox(request.args.get('bbox'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
+    conn = get_db_connection()
+    stores, truncated = store_locator.stores_in_bbox(
+        conn, south, west, north, east,
+        limit=current_app.config.get('MAP_BBOX_LIMIT', store_locator.DEFAULT_BBOX_LIMIT))
     conn.close()
 
-    u_name = session.get('u_name', 'ゲスト')
+    return jsonify({'stores': stores, 'truncated': truncated})
 
-    return render_template('users_home/map_shop.html', stores=stores, u_name=u_name)
 
+# --- 指定地点から近い順の店舗をJSONで返す ---
+@users_home_bp.route('/map_shop/nearest')
+def map_shop_nearest():
+    if 'id' not in session:
+        return jsonify({'error': 'ログインしてください'}), 401
+
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    if lat is None or lng is None or not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return jsonify({'error': 'lat と lng を正しく指定してください'}), 400
+    limit = request.args.get('limit', store_locator.DEFAULT_NEAREST_LIMIT, type=int)
+    limit = max(1, min(limit, store_locator.MAX_NEAREST_LIMIT))
+
+    conn = get_db_connection()
+    stores = store_locator.nearest_stores(conn, lat, lng, limit=limit)
+    conn.close()
+
+    return jsonify({'stores': stores})
 
-from collections import defaultdict
 
 @users_home_bp.route('/payment_history')
 def payment_history():
@@ -84,46 +116,38 @@ def payment_history():
         flash("ログインしてください")
         return redirect(url_for('users_login.login'))
 
-    user_id = session['id']
-
+    # 最初のページだけ表示し、続きは「もっと見る」でJSONから読み込む
     conn = get_db_connection()
-    cursor = conn.cursor()
-
-    query = """
-        SELECT
-            o.order_id, o.datetime, o.status,
-            s.store_name, m.menu_name,
-            oi.quantity, oi.price_at_order
-        FROM orders AS o
-        JOIN order_items AS oi ON o.order_id = oi.order_id
-        JOIN menus AS m ON oi.menu_id = m.menu_id
-        JOIN store AS s ON o.store_id = s.store_id
-        WHERE o.user_id = ?
-        ORDER BY o.datetime DESC;
-    """
-    rows = cursor.execute(query, (user_id,)).fetchall()
+    orders, next_cursor = user_orders.fetch_history_page(
+        conn, session['id'],
+        page_size=current_app.config.get('PAYMENT_HISTORY_PAGE_SIZE', user_orders.DEFAULT_PAGE_SIZE))
     conn.close()
 
-    # grouped by order_id
-    grouped_history = {}
-    for row in rows:
-        order_id = row['order_id']
-        if order_id not in grouped_history:
-            grouped_history[order_id] = []
-        grouped_history[order_id].append({
-            'datetime': row['datetime'],
-            'status': row['status'],
-            'store_name': row['store_name'],
-            'menu_name': row['menu_name'],
-            'quantity': row['quantity'],
-            'price_at_order': row['price_at_order']
-        })
-
     return render_template('users_home/payment_history.html',
-                           grouped_history=grouped_history,
+                           orders=orders,
+                           next_cursor=next_cursor,
                            u_name=session.get('u_name'))
 
 
+# --- 決済履歴の続きをJSONで返す ---
+@users_home_bp.route('/payment_history/page')
+def payment_history_page():
+    if 'id' not in session:
+        return jsonify({'error': 'ログインしてください'}), 401
+
+    conn = get_db_connection()
+    orders, next_cursor = user_orders.fetch_history_page(
+        conn, session['id'],
+        cursor=request.args.get('cursor'),
+        page_size=current_app.config.get('PAYMENT_HISTORY_PAGE_SIZE', user_orders.DEFAULT_PAGE_SIZE))
+    conn.close()
+
+    # 詳細ページへのリンクはJS側で組み立てられるようにURLも返す
+    for order in orders:
+        order['detail_url'] = url_for('users_home.details_payment_history', order_id=order['id'])
+    return jsonify({'orders': orders, 'next_cursor': next_cursor})
+
+
 @users_home_bp.route('/details_payment_history/<int:order_id>')
 def details_payment_history(order_id):
     if 'id' not in session:
@@ -134,24 +158,7 @@ def details_payment_history(order_id):
     u_name = session.get('u_name', 'ゲスト')
 
     conn = get_db_connection()
-    query = """
-        SELECT
-            o.order_id,
-            o.datetime,
-            o.total_amount,
-            o.status,
-            s.store_name,
-            m.menu_name,
-            oi.quantity,
-            oi.price_at_order
-        FROM orders AS o
-        JOIN store AS s ON o.store_id = s.store_id
-        JOIN order_items AS oi ON o.order_id = oi.order_id
-        JOIN menus AS m ON oi.menu_id = m.menu_id
-        WHERE o.user_id = ? AND o.order_id = ?
-        ORDER BY oi.order_item_id ASC;
-    """
-    payment_details = conn.execute(query, (user_id, order_id)).fetchall()
+    payment_details = conn.execute(PAYMENT_DETAILS_SQL, (user_id, order_id)).fetchall()
     conn.close()
 
     return render_template(
@@ -168,13 +175,9 @@ def users_data():
 
     u_name = session.get('u_name', 'ゲスト')
 
-    conn = sqlite3.connect('app.db')
+    conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("""
-        SELECT u_name, email, created_at
-        FROM users_table
-        WHERE id = ?
-    """, (session['id'],))
+    cursor.execute(USER_DATA_SQL, (session['id'],))
     user_data = cursor.fetchone()
     conn.close()
 
@@ -5,19 +5,16 @@ import os
 import logging
 from functools import wraps
 
+from services import session_store
+from services.database import get_db_connection
+
 users_login_bp = Blueprint('users_login', __name__,
                            template_folder='../../templates/users_login', # template_folderを指定
                            url_prefix='/users_login')
 
-# --- データベース接続ヘルパー ---
-def get_db_connection():
-    """データベース接続を取得します。カラム名でアクセスできるように設定します。"""
-    # このファイルの場所から2階層上のディレクトリにあるapp.dbへのパスを構築
-    db_path = os.path.join(os.path.dirname(__file__), '..', '..', 'app.db')
-    conn = sqlite3.connect(db_path)
-    # カラム名でアクセスできるようにする
-    conn.row_factory = sqlite3.Row
-    return conn
+# ルートで実行するクエリ（services/query_plans.py でも同じものの実行計画を確認する）
+LOGIN_SQL = "SELECT * FROM users_table WHERE u_name = ?"
+USER_BY_EMAIL_SQL = "SELECT * FROM users_table WHERE email = ?"
 
 # --- ログインページ ---
 @users_login_bp.route('/login', methods=['GET', 'POST'])
@@ -28,12 +25,13 @@ def login():
 
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users_table WHERE u_name = ?", (username,))
+        cursor.execute(LOGIN_SQL, (username,))
         user = cursor.fetchone()
         conn.close()
 
         # get_db_connection()でrow_factoryを設定したため、カラム名でアクセス可能
         if user and check_password_hash(user['password_hash'], password):
+            session_store.regenerate()  # ログイン前のセッションIDを引き継がない
             session['id'] = user['id']
             session['u_name'] = user['u_name']
             flash("ログインに成功しました", "success")
@@ -99,7 +97,7 @@ def re_enrollment():
         try:
             conn = get_db_connection()
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM users_table WHERE email = ?", (email,))
+            cursor.execute(USER_BY_EMAIL_SQL, (email,))
             user = cursor.fetchone()
             conn.close()
 
@@ -6,41 +6,42 @@ import datetime
 from functools import wraps
 
 # --- PayPay関連のインポート ---
-import paypayopa
-import polling
+# （paypayopa は services/paypay_gateway.py で初回の呼び出し時に読み込む）
 import uuid
 import os
 import json
 import logging
 import time
-from dotenv import load_dotenv # .envから環境変数を読み込むため
 
-# --- .envファイルの読み込みとPayPay設定 ---
-load_dotenv() # ファイルの先頭、またはPayPay関連コードの直前で一度だけ呼び出す
+from services import carts
+from services.menu_cache import menu_cache
+from services.order_events import order_events
+from services.order_writer import order_writer, NewOrder
+from services.paypay_poller import payment_poller
+from services.paypay_gateway import paypay_gateway, PaymentGatewayError
+from services.wait_times import wait_times
+from services.database import get_db_connection
 
-# ロギング設定 (既存のものがあればそのまま、なければここに追加)
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# ロギング設定は create_app() で行う
 logger = logging.getLogger(__name__)
 
 # 環境変数の取得と検証
+# （API_KEY / API_SECRET / MERCHANT_ID は services/paypay_gateway.py で読み込む）
 _DEBUG = os.environ.get("_DEBUG", "False").lower() == "true"
-API_KEY = os.environ.get("API_KEY")
-API_SECRET = os.environ.get("API_SECRET")
-MERCHANT_ID = os.environ.get("MERCHANT_ID")
 FRONTEND_BASE_URL_FOR_API = os.environ.get("FLASK_APP_BASE_URL", default="http://127.0.0.1:5003")
 
-# PayPay OPA クライアントの初期化
-client = paypayopa.Client(
-    auth=(API_KEY, API_SECRET),
-    production_mode=False) # production_modeをFalseに設定し、サンドボックス環境を使用
-client.set_assume_merchant(MERCHANT_ID)
-
 users_order_bp = Blueprint('users_order', __name__, url_prefix='/users_order')
 
-def get_db_connection():
-    conn = sqlite3.connect('app.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+def publish_new_order(order_id, store_id, order_datetime, status, total_price, cart):
+    """店舗の注文画面（SSE）へ新しい注文を通知する"""
+    order_events.publish(store_id, 'order_created', {
+        'id': order_id, 'datetime': str(order_datetime), 'status': status,
+        'user_name': session.get('u_name'), 'total_amount': total_price,
+        'items_list': [
+            {'menu_id': item['menu_id'], 'name': item['name'], 'quantity': item['quantity'], 'price': item['price']}
+            for item in cart.values()
+        ],
+    })
 
 def login_required(f):
     @wraps(f)
@@ -59,29 +60,21 @@ def menu(store_id):
     """選択された店舗のメニューページを表示する"""
     session['current_store_id'] = store_id
     
-    conn = get_db_connection()
-    store = conn.execute("SELECT * FROM store WHERE store_id = ?", (store_id,)).fetchone()
-    if store is None:
+    # 店舗情報・メニューはキャッシュから取得（メニュー変更時に破棄される）
+    cached = menu_cache.get(store_id)
+    if cached is None:
         flash("指定された店舗は存在しません。")
-        conn.close()
         return redirect(url_for('users_home.home'))
-    
-    menu_items = conn.execute("SELECT menu_id, menu_name, category, price FROM menus WHERE store_id = ? AND soldout = 0", (store_id,)).fetchall()
-    categories = conn.execute("""SELECT DISTINCT category FROM menus WHERE store_id = ? AND soldout = 0""", (store_id,)).fetchall()
-    categories = [row['category'] for row in categories if row['category']]  # Noneを除外
 
-    conn.close()
-
-    carts = session.get('carts', {})
-    current_cart = carts.get(str(store_id), {})
+    current_cart = carts.get_cart(store_id)
 
     return render_template(
         'users_order/menu.html',
-        store=store,
-        menu_items=menu_items,
+        store=cached['store'],
+        menu_items=cached['menu_items'],
         cart=current_cart,
         u_name=session.get('u_name', 'ゲスト'),
-        categories=categories
+        categories=cached['categories']
     )
 
 @users_order_bp.route('/add_to_cart', methods=['POST'])
@@ -96,25 +89,12 @@ def add_to_cart():
     except (TypeError, ValueError, KeyError):
         return jsonify({'error': '不正なデータ形式です'}), 400
     store_id = session['current_store_id']
-    conn = get_db_connection()
-    menu_item = conn.execute("SELECT menu_name, price, store_id FROM menus WHERE menu_id = ?", (menu_id,)).fetchone()
-    conn.close()
-    if not menu_item or menu_item['store_id'] != store_id:
+    cached = menu_cache.get(store_id)
+    menu_item = cached['by_id'].get(menu_id) if cached else None
+    if not menu_item:
         return jsonify({'error': '無効な商品です'}), 400
-    carts = session.get('carts', {})
-    store_id_str, menu_id_str = str(store_id), str(menu_id)
-    current_cart = carts.get(store_id_str, {})
-    if menu_id_str in current_cart:
-        current_cart[menu_id_str]['quantity'] += quantity
-    else:
-        current_cart[menu_id_str] = {
-            'menu_id': menu_id, 'name': menu_item['menu_name'],
-            'price': menu_item['price'], 'quantity': quantity
-        }
-    carts[store_id_str] = current_cart
-    session['carts'] = carts
-    session.modified = True
-    total_items = sum(item['quantity'] for item in current_cart.values())
+    # カートは商品1件単位で更新する（セッション全体を書き直さない）
+    total_items = carts.add_item(store_id, menu_item, quantity)
     return jsonify({'message': 'カートに追加しました', 'cart_count': total_items})
 
 @users_order_bp.route('/cart_confirmation')
@@ -123,17 +103,15 @@ def cart_confirmation():
     if 'current_store_id' not in session:
         return redirect(url_for('users_home.home'))
     store_id = session['current_store_id']
-    carts = session.get('carts', {})
-    current_cart = carts.get(str(store_id), {})
+    current_cart = carts.get_cart(store_id)
 
     total_quantity = sum(item['quantity'] for item in current_cart.values())
     total_price = sum(item['quantity'] * item['price'] for item in current_cart.values())
     
-    conn = get_db_connection()
-    store = conn.execute("SELECT store_name FROM store WHERE store_id = ?", (store_id,)).fetchone()
-    conn.close()
-    if not store:
+    cached = menu_cache.get(store_id)
+    if not cached:
         return redirect(url_for('users_home.home'))
+    store = cached['store']
         
     return render_template(
         'users_order/cart_confirmation.html',
@@ -154,8 +132,7 @@ def payment_selection():
         return redirect(url_for('users_home.home'))
 
     store_id = session['current_store_id']
-    carts = session.get('carts', {})
-    current_cart = carts.get(str(store_id), {})
+    current_cart = carts.get_cart(store_id)
 
     if not current_cart:
         flash("カートが空です。")
@@ -163,9 +140,7 @@ def payment_selection():
 
     total_price = sum(item['quantity'] * item['price'] for item in current_cart.values())
     
-    conn = get_db_connection()
-    store = conn.execute("SELECT store_name FROM store WHERE store_id = ?", (store_id,)).fetchone()
-    conn.close()
+    store = menu_cache.get(store_id)['store']
 
     # BlueprintのURLプレフィックスとPayPay APIのベースURLを結合して渡す
     paypay_api_base_url = f"{FRONTEND_BASE_URL_FOR_API}{users_order_bp.url_prefix}/paypay"
@@ -192,67 +167,47 @@ def create_order():
 
     user_id = session['id']
     store_id = session['current_store_id']
-    carts = session.get('carts', {})
-    current_cart = carts.get(str(store_id), {})
+    current_cart = carts.get_cart(store_id)
 
     if not current_cart:
         return jsonify({"error": "カートが空です。"}), 400
 
     total_price = sum(item['quantity'] * item['price'] for item in current_cart.values())
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
         current_time = datetime.datetime.now()
-        cursor.execute("""
-            INSERT INTO orders (user_id, store_id, status, datetime, payment_method, total_amount)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (user_id, store_id, 'pending', current_time, 'Unknown', total_price)) # ステータスと決済方法を汎用的に
-        
-        order_id = cursor.lastrowid
-
-        order_items_data = [
-            (order_id, item['menu_id'], item['quantity'], item['price'])
-            for item in current_cart.values()
-        ]
-        
-        cursor.executemany("""
-            INSERT INTO order_items (order_id, menu_id, quantity, price_at_order)
-            VALUES (?, ?, ?, ?)
-        """, order_items_data)
+        # ステータスと決済方法を汎用的に。書き込みは注文の書き込みスレッドがまとめて行う
+        order_id = order_writer.submit(NewOrder(
+            user_id, store_id, 'pending', 'Unknown', total_price,
+            [(item['menu_id'], item['quantity'], item['price']) for item in current_cart.values()],
+            current_time))
 
-        conn.commit()
+        publish_new_order(order_id, store_id, current_time, 'pending', total_price, current_cart)
 
         # ここで`last_order_id`を設定するのは、このルートを直接呼ぶ場合のため。
         # PayPay決済の場合は後述の`finalize_paypay_order`で設定します。
         session['last_order_id'] = order_id
         session.modified = True
         
-        # 注文が完了したので、セッションから現在の店舗のカート情報を削除
-        if str(store_id) in session['carts']:
-            del session['carts'][str(store_id)]
-            session.modified = True
+        # 注文が完了したので、現在の店舗のカート情報を削除
+        carts.clear_cart(store_id)
             
         logger.info(f"汎用注文 {order_id} が作成されました。")
         return jsonify({"message": "注文が作成されました。", "order_id": order_id}), 200
 
     except sqlite3.Error as e:
-        conn.rollback()
         logger.exception(f"汎用注文作成中にエラーが発生しました: {e}")
         return jsonify({"error": f"注文処理中にエラーが発生しました: {e}"}), 500
-    finally:
-        conn.close()
 
 @users_order_bp.route('/clear_cart')
 @login_required
 def clear_cart():
     """現在選択中の店舗のカートを空にする"""
-    if 'current_store_id' in session and 'carts' in session:
-        store_id_str = str(session['current_store_id'])
-        
-        if store_id_str in session['carts']:
-            del session['carts'][store_id_str]
-            session.modified = True
+    if 'current_store_id' in session:
+        store_id = session['current_store_id']
+
+        if carts.get_cart(store_id):
+            carts.clear_cart(store_id)
             flash('現在のカートを空にしました。')
     
     if 'current_store_id' in session:
@@ -267,11 +222,7 @@ def back_to_home_and_clear_cart():
     現在の店舗のカート情報をクリアし、ホーム画面に戻るためのルート
     """
     if 'current_store_id' in session:
-        store_id_str = str(session['current_store_id'])
-        
-        if 'carts' in session and store_id_str in session['carts']:
-            del session['carts'][store_id_str]
-            session.modified = True
+        carts.clear_cart(session['current_store_id'])
     
     session.pop('current_store_id', None)
     
@@ -285,25 +236,17 @@ def update_cart_item():
         return redirect(url_for('users_home.home'))
 
     try:
-        menu_id_str = request.form['menu_id']
+        menu_id = int(request.form['menu_id'])
         new_quantity = int(request.form['quantity'])
     except (KeyError, ValueError):
         flash("不正なリクエストです。")
         return redirect(url_for('users_order.cart_confirmation'))
 
-    store_id_str = str(session['current_store_id'])
-    carts = session.get('carts', {})
-
-    if store_id_str in carts and menu_id_str in carts[store_id_str]:
+    if carts.set_quantity(session['current_store_id'], menu_id, new_quantity):
         if new_quantity > 0:
-            carts[store_id_str][menu_id_str]['quantity'] = new_quantity
             flash("数量を更新しました。")
         else:
-            del carts[store_id_str][menu_id_str]
             flash("商品をカートから削除しました。")
-        
-        session['carts'] = carts
-        session.modified = True
     
     return redirect(url_for('users_order.cart_confirmation'))
 
@@ -315,18 +258,12 @@ def delete_cart_item():
         return redirect(url_for('users_home.home'))
 
     try:
-        menu_id_str = request.form['menu_id']
-    except KeyError:
+        menu_id = int(request.form['menu_id'])
+    except (KeyError, ValueError):
         flash("不正なリクエストです。")
         return redirect(url_for('users_order.cart_confirmation'))
 
-    store_id_str = str(session['current_store_id'])
-    carts = session.get('carts', {})
-
-    if store_id_str in carts and menu_id_str in carts[store_id_str]:
-        del carts[store_id_str][menu_id_str]
-        session['carts'] = carts
-        session.modified = True
+    if carts.remove_item(session['current_store_id'], menu_id):
         flash("商品をカートから削除しました。")
 
     return redirect(url_for('users_order.cart_confirmation'))
@@ -362,7 +299,7 @@ def create_qr():
     }
     
     try:
-        resp = client.Code.create_qr_code(data=payment_details)
+        resp = paypay_gateway.create_qr_code(payment_details)
         
         logger.info(f"QR code creation response from PayPay: {resp}")
 
@@ -377,49 +314,29 @@ def create_qr():
         session['paypay_merchant_payment_id'] = merchant_payment_id
         session.modified = True
 
+        # 支払いステータスはサーバー側のポーリングで取得する
+        payment_poller.track(merchant_payment_id)
+
         return jsonify(resp)
+    except PaymentGatewayError as e:
+        # PayPay が不調・混雑しているときは待たせずにすぐ返す
+        logger.warning(f"QRコード作成をスキップしました: {e}")
+        return jsonify({"error": "現在PayPayが混み合っています。しばらくしてからお試しください。", "details": str(e)}), 503
     except Exception as e:
         logger.exception(f"QRコード作成エラー: {e}")
         return jsonify({"error": "QRコードの作成に失敗しました", "details": str(e)}), 500
 
-def fetch_payment_details(merchant_id):
-    """指定されたマーチャントIDの支払い詳細をPayPayから取得するヘルパー関数"""
-    try:
-        resp = client.Code.get_payment_details(merchant_id)
-        logger.debug(f"Fetched payment details for {merchant_id}: {resp}")
-
-        if resp.get('resultInfo', {}).get('code') == 'RATE_LIMIT':
-            logger.warning(f"RATE_LIMIT エラー {merchant_id}。リトライします。")
-            return 'RATE_LIMIT_ERROR'
-        
-        if resp.get('data') is None:
-            error_code = resp.get('resultInfo', {}).get('code')
-            error_message = resp.get('resultInfo', {}).get('message')
-            if error_code:
-                logger.warning(f"PayPay APIが {merchant_id} にエラーを返しました: {error_code} - {error_message}。保留または一時的な問題と見なします。")
-            else:
-                logger.warning(f"{merchant_id} の支払い詳細が 'None' データとして返されました。保留または見つからないと見なします。")
-            return 'PENDING_NO_DATA'
-            
-        return resp['data']['status']
-    except Exception as e:
-        logger.exception(f"{merchant_id} の支払い詳細の取得中にエラーが発生しました: {e}")
-        return 'FETCH_ERROR'
-
 @users_order_bp.route('/paypay/order-status/<merch_id>', methods=['GET'])
 def order_status(merch_id):
     """
-    指定されたマーチャントIDの支払いステータスをポーリングし、結果を返すエンドポイント。
+    指定されたマーチャントIDの支払いステータスを返すエンドポイント。
+    PayPayへは直接問い合わせず、バックグラウンドのポーラーがキャッシュした結果を返す。
     """
-    logger.info(f"注文ステータスを確認中 (マーチャントID: {merch_id})")
-    
-    status = fetch_payment_details(merch_id)
-    if status == 'FETCH_ERROR':
-        return jsonify({"error": "支払い詳細の取得に失敗しました。", "status": "FAILED"}), 500
-    elif status == 'RATE_LIMIT_ERROR' or status == 'PENDING_NO_DATA':
+    status = payment_poller.get_status(merch_id)
+    if status is None:
+        # まだ取得できていない（またはキャッシュが古い）場合は保留中として扱う
         return jsonify({"data": {"status": "PENDING"}}), 200
-    else:
-        return jsonify({"data": {"status": status}}), 200
+    return jsonify({"data": {"status": status}}), 200
     
 @users_order_bp.route('/finalize_paypay_order', methods=['POST'])
 @login_required
@@ -436,8 +353,7 @@ def finalize_paypay_order():
         logger.error("finalize_paypay_order: セッションにユーザーIDまたは店舗IDがありません。")
         return jsonify({"error": "セッション情報が見つかりません。再ログインしてください。"}), 401
 
-    carts = session.get('carts', {})
-    current_cart = carts.get(str(store_id), {})
+    current_cart = carts.get_cart(store_id)
 
     if not current_cart:
         logger.error(f"finalize_paypay_order: 店舗ID {store_id} とユーザー {user_id} のカートが空です。")
@@ -445,33 +361,18 @@ def finalize_paypay_order():
 
     total_price = sum(item['quantity'] * item['price'] for item in current_cart.values())
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
         current_time = datetime.datetime.now()
-        cursor.execute("""
-            INSERT INTO orders (user_id, store_id, status, datetime, payment_method, total_amount)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (user_id, store_id, '注文受付中', current_time, 'PayPay', total_price))
-        
-        order_id = cursor.lastrowid
-
-        order_items_data = [
-            (order_id, item['menu_id'], item['quantity'], item['price'])
-            for item in current_cart.values()
-        ]
-        
-        cursor.executemany("""
-            INSERT INTO order_items (order_id, menu_id, quantity, price_at_order)
-            VALUES (?, ?, ?, ?)
-        """, order_items_data)
+        # 書き込みは注文の書き込みスレッドがまとめて行い、注文IDが返るまで待つ
+        order_id = order_writer.submit(NewOrder(
+            user_id, store_id, '注文受付中', 'PayPay', total_price,
+            [(item['menu_id'], item['quantity'], item['price']) for item in current_cart.values()],
+            current_time))
 
-        conn.commit()
+        publish_new_order(order_id, store_id, current_time, '注文受付中', total_price, current_cart)
 
-        # 注文が完了したので、セッションから現在の店舗のカート情報を削除
-        if str(store_id) in session['carts']:
-            del session['carts'][str(store_id)]
-            session.modified = True
+        # 注文が完了したので、現在の店舗のカート情報を削除
+        carts.clear_cart(store_id)
             
         # 取得した注文IDをセッションに保存
         session['last_order_id'] = order_id
@@ -481,11 +382,8 @@ def finalize_paypay_order():
         return jsonify({"message": "注文が確定されました。", "order_id": order_id}), 200
 
     except sqlite3.Error as e:
-        conn.rollback()
         logger.exception(f"ユーザー {user_id} の注文確定中にエラーが発生しました: {e}")
         return jsonify({"error": f"注文処理中にエラーが発生しました: {e}"}), 500
-    finally:
-        conn.close()
 
 @users_order_bp.route('/reservation_number')
 @login_required
@@ -504,8 +402,49 @@ def reservation_number():
     # session.pop('last_order_id', None)
     # session.pop('paypay_merchant_payment_id', None)
 
+    # 受け取りまでの目安（対応が終わっていれば表示しない）
+    store_id = session.get('current_store_id')
+    wait = None
+    if store_id and isinstance(order_id, int):
+        wait = wait_times.estimate_order(store_id, order_id)
+
     return render_template(
         'users_order/reservation_number.html',
         order_id=order_id,
-        merchant_payment_id=merchant_payment_id
+        merchant_payment_id=merchant_payment_id,
+        wait=wait
     )
+
+
+@users_order_bp.route('/wait_time/<int:order_id>')
+@login_required
+def order_wait_time(order_id):
+    """注文の受け取りまでの目安（予約番号ページから定期的に呼ぶ）"""
+    conn = get_db_connection()
+    order = conn.execute("SELECT store_id, user_id, status FROM orders WHERE order_id = ?", (order_id,)).fetchone()
+    conn.close()
+    if order is None or order['user_id'] != session['id']:
+        return jsonify({'error': '注文が見つかりません'}), 404
+
+    status = order['status']
+    if status == 'canceled':
+        return jsonify({'order_id': order_id, 'status': status, 'ready': False, 'canceled': True,
+                        'seconds': None, 'minutes': None, 'queue_ahead': 0})
+    if status in ('受け取り待ち', 'completed'):
+        return jsonify({'order_id': order_id, 'status': status, 'ready': True, 'canceled': False,
+                        'seconds': 0, 'minutes': 0, 'queue_ahead': 0})
+
+    # 対応中なのに列にない注文（他のワーカーで受けた直後など）は、店舗の列を読み直してから見積もる
+    wait = wait_times.estimate_order(order['store_id'], order_id, resync_missing=True)
+    if wait is None:
+        # 読み直しの間にステータスが変わった。目安は出さず、次の問い合わせで改めて確認させる
+        return jsonify({'order_id': order_id, 'status': status, 'ready': False, 'canceled': False,
+                        'seconds': None, 'minutes': None, 'queue_ahead': 0})
+    wait['canceled'] = False
+    return jsonify(wait)
+
+
+@users_order_bp.route('/wait_time/store/<int:store_id>')
+def store_wait_time(store_id):
+    """今注文した場合の受け取りまでの目安"""
+    return jsonify(wait_times.estimate_store(store_id))
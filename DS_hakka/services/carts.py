@@ -0,0 +1,76 @@
+# services/carts.py
+# --- カートの操作 ---
+# カートは店舗ごとに {menu_id(文字列): {'menu_id', 'name', 'price', 'quantity'}} の形で返す。
+# サーバー側セッション（services/session_store.py）では商品1件ごとに保存・更新し、
+# クッキーセッションの場合は従来どおり session['carts'] に入れる。
+from flask import current_app, session
+
+
+class CookieCarts:
+    """session['carts'] を使う従来の方式（SESSION_BACKEND = 'cookie' のとき）"""
+
+    def _carts(self):
+        session.modified = True
+        return session.setdefault('carts', {})
+
+    def get_cart(self, sid, store_id):
+        return session.get('carts', {}).get(str(store_id), {})
+
+    def add_item(self, sid, store_id, item, quantity):
+        cart = self._carts().setdefault(str(store_id), {})
+        key = str(item['menu_id'])
+        if key in cart:
+            cart[key]['quantity'] += quantity
+        else:
+            cart[key] = dict(item, quantity=quantity)
+        return sum(i['quantity'] for i in cart.values())
+
+    def set_quantity(self, sid, store_id, menu_id, quantity):
+        cart = self._carts().get(str(store_id), {})
+        if str(menu_id) not in cart:
+            return False
+        if quantity > 0:
+            cart[str(menu_id)]['quantity'] = quantity
+        else:
+            del cart[str(menu_id)]
+        return True
+
+    def clear_cart(self, sid, store_id):
+        self._carts().pop(str(store_id), None)
+
+
+_cookie_carts = CookieCarts()
+
+
+def _backend():
+    return getattr(current_app.session_interface, 'backend', None) or _cookie_carts
+
+
+def _sid():
+    sid = getattr(session, 'sid', None)
+    if sid is not None and session.new:
+        session.modified = True  # 新しいセッションでもクッキーを発行してカートと結びつける
+    return sid
+
+
+def get_cart(store_id):
+    return _backend().get_cart(_sid(), store_id)
+
+
+def add_item(store_id, menu_item, quantity):
+    """商品を追加し（すでにあれば数量を加算）、そのカートの合計数量を返す"""
+    item = {'menu_id': menu_item['menu_id'], 'name': menu_item['menu_name'], 'price': menu_item['price']}
+    return _backend().add_item(_sid(), store_id, item, quantity)
+
+
+def set_quantity(store_id, menu_id, quantity):
+    """数量を変更する（0以下なら削除）。カートにない商品なら False。"""
+    return _backend().set_quantity(_sid(), store_id, int(menu_id), quantity)
+
+
+def remove_item(store_id, menu_id):
+    return set_quantity(store_id, menu_id, 0)
+
+
+def clear_cart(store_id):
+    _backend().clear_cart(_sid(), store_id)
@@ -0,0 +1,157 @@
+# services/database.py
+# --- SQLite 接続の共通モジュール ---
+# 各Blueprintで個別に定義していた get_db_connection() をここに集約する。
+# 接続はスレッド（ワーカー）ごとに1本だけ作成して使い回し、
+# WAL・busy_timeout・各種PRAGMAは接続作成時に一度だけ設定する。
+import os
+import sqlite3
+import threading
+import time
+
+from flask import current_app, g, has_app_context
+
+# app.config に値がない場合の既定値
+DEFAULT_SETTINGS = {
+    'DATABASE': None,                  # None の場合は create_app() 側のディレクトリの app.db
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_SYNCHRONOUS': 'NORMAL',    # WALならNORMALでもコミット済みデータは壊れない
+    'SQLITE_BUSY_TIMEOUT_MS': 5000,    # ロック中は最大5秒待つ
+    'SQLITE_CACHE_SIZE': -16000,       # 負の値はKiB指定（約16MB）
+    'SQLITE_MMAP_SIZE': 128 * 1024 * 1024,
+    'SQLITE_CACHED_STATEMENTS': 256,   # プリペアドステートメントのキャッシュ数
+}
+
+# アプリコンテキスト外（バックグラウンドスレッドなど）から使う設定
+_settings = dict(DEFAULT_SETTINGS)
+_local = threading.local()
+
+# 実行したSQLの通知先（services/metrics.py など）。func(接続, sql, params, 秒数) の形で呼ぶ。
+# 通知先がなければ計測自体を行わない。
+_query_observers = []
+
+
+def add_query_observer(func):
+    if func not in _query_observers:
+        _query_observers.append(func)
+
+
+def _observed(conn, method, sql, params):
+    if not _query_observers:
+        return method(sql, params)
+    start = time.perf_counter()
+    try:
+        return method(sql, params)
+    finally:
+        # SELECT は最初の1行を取り出すところまでの時間（残りの fetch は含まない）
+        elapsed = time.perf_counter() - start
+        for func in _query_observers:
+            func(conn, sql, params, elapsed)
+
+
+class ObservedCursor(sqlite3.Cursor):
+    def execute(self, sql, params=()):
+        return _observed(self.connection, super().execute, sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return _observed(self.connection, super().executemany, sql, seq_of_params)
+
+
+class PooledConnection(sqlite3.Connection):
+    """スレッド内で使い回す接続。
+
+    既存のルートは使用後に conn.close() を呼ぶため、close() では実際には閉じず
+    未確定のトランザクションを巻き戻すだけにしておく。
+    """
+
+    def cursor(self, factory=ObservedCursor):
+        return super().cursor(factory)
+
+    # sqlite3.Connection.execute は内部でカーソルを直接実行するため、ここでも計測を通す
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def force_close(self):
+        super().close()
+
+
+def init_app(app):
+    """create_app() から呼ばれ、設定の既定値と teardown を登録する"""
+    for key, value in DEFAULT_SETTINGS.items():
+        app.config.setdefault(key, value)
+    if not app.config['DATABASE']:
+        app.config['DATABASE'] = os.environ.get('DATABASE_PATH') or os.path.join(app.root_path, 'app.db')
+
+    _settings.update({key: app.config[key] for key in DEFAULT_SETTINGS})
+    app.teardown_appcontext(release_connection)
+
+
+def _current_settings():
+    if has_app_context():
+        return current_app.config
+    return _settings
+
+
+def _pool():
+    # fork後の子プロセスでは親の接続を引き継がない
+    pid = os.getpid()
+    if getattr(_local, 'pid', None) != pid:
+        _local.pid = pid
+        _local.connections = {}
+    return _local.connections
+
+
+def connect(settings=None):
+    """PRAGMAを設定した新しい接続を作成する（プールを通さない）"""
+    settings = settings or _current_settings()
+    conn = sqlite3.connect(
+        settings['DATABASE'],
+        timeout=settings['SQLITE_BUSY_TIMEOUT_MS'] / 1000,
+        cached_statements=settings['SQLITE_CACHED_STATEMENTS'],
+        factory=PooledConnection,
+    )
+    conn.row_factory = sqlite3.Row  # 行を辞書形式で取得
+    conn.execute(f"PRAGMA journal_mode = {settings['SQLITE_JOURNAL_MODE']}")
+    conn.execute(f"PRAGMA synchronous = {settings['SQLITE_SYNCHRONOUS']}")
+    conn.execute(f"PRAGMA busy_timeout = {int(settings['SQLITE_BUSY_TIMEOUT_MS'])}")
+    conn.execute(f"PRAGMA cache_size = {int(settings['SQLITE_CACHE_SIZE'])}")
+    conn.execute(f"PRAGMA mmap_size = {int(settings['SQLITE_MMAP_SIZE'])}")
+    return conn
+
+
+def get_db_connection():
+    """現在のスレッド用の接続を返す。なければ作成してプールに入れる。"""
+    settings = _current_settings()
+    pool = _pool()
+    path = settings['DATABASE']
+    conn = pool.get(path)
+    if conn is None:
+        conn = connect(settings)
+        pool[path] = conn
+    if has_app_context():
+        g._db_path = path
+    return conn
+
+
+def release_connection(exc=None):
+    """アプリコンテキスト終了時に呼ばれ、確定されなかった変更を巻き戻す"""
+    path = g.pop('_db_path', None)
+    if path is None:
+        return
+    conn = _pool().get(path)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+
+def close_all():
+    """現在のスレッドが持つ接続をすべて閉じる（テストやベンチマーク用）"""
+    pool = _pool()
+    for conn in pool.values():
+        conn.force_close()
+    pool.clear()
@@ -0,0 +1,109 @@
+# services/fake_paypay.py
+# --- ローカル用の PayPay 代替サーバー ---
+# paypayopa.Client が呼ぶ QRコード作成・支払い詳細取得・QRコード削除だけを真似する。
+# PAYPAY_BASE_URL をこのサーバーに向けると、サンドボックスなしで決済の流れや負荷を確認できる。
+#   python cli.py fake-paypay --port 8999 --complete-after 5
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakePayPayState:
+    def __init__(self, complete_after=5.0, latency=0.0, rate_limit_every=0):
+        self.complete_after = complete_after      # QR作成から COMPLETED になるまでの秒数
+        self.latency = latency                    # 各レスポンスに加える遅延（秒）
+        self.rate_limit_every = rate_limit_every  # N回に1回 RATE_LIMIT を返す（0なら返さない）
+        self.payments = {}                        # merchantPaymentId -> 作成時刻
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+def _result(code, message='', code_id='00000000'):
+    return {'resultInfo': {'code': code, 'message': message, 'codeId': code_id}}
+
+
+class FakePayPayHandler(BaseHTTPRequestHandler):
+    state = None  # make_server() でサブクラスごとに設定する
+
+    def log_message(self, format, *args):
+        pass  # アクセスログは出さない
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _begin(self):
+        """遅延とレート制限の再現。RATE_LIMIT を返した場合は True。"""
+        state = self.state
+        if state.latency:
+            time.sleep(state.latency)
+        with state.lock:
+            state.requests += 1
+            limited = state.rate_limit_every and state.requests % state.rate_limit_every == 0
+        if limited:
+            self._send(429, _result('RATE_LIMIT', 'Too many requests', '08100998'))
+        return limited
+
+    def do_POST(self):
+        if self._begin():
+            return
+        if self.path != '/v2/codes':
+            return self._send(404, _result('NOT_FOUND'))
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        merchant_payment_id = body.get('merchantPaymentId') or uuid.uuid4().hex
+        with self.state.lock:
+            self.state.payments[merchant_payment_id] = time.monotonic()
+        response = _result('SUCCESS', 'Success')
+        response['data'] = {
+            'codeId': uuid.uuid4().hex,
+            'merchantPaymentId': merchant_payment_id,
+            'amount': body.get('amount'),
+            'url': f"http://{self.headers.get('Host')}/pay/{merchant_payment_id}",
+            'deeplink': f"paypay://payment?link={merchant_payment_id}",
+        }
+        self._send(201, response)
+
+    def do_GET(self):
+        if self._begin():
+            return
+        prefix = '/v2/codes/payments/'
+        if not self.path.startswith(prefix):
+            return self._send(404, _result('NOT_FOUND'))
+        merchant_payment_id = self.path[len(prefix):]
+        with self.state.lock:
+            created_at = self.state.payments.get(merchant_payment_id)
+        if created_at is None:
+            return self._send(404, _result('DYNAMIC_QR_PAYMENT_NOT_FOUND', 'Payment not found', '01652073'))
+        completed = time.monotonic() - created_at >= self.state.complete_after
+        response = _result('SUCCESS', 'Success')
+        response['data'] = {
+            'merchantPaymentId': merchant_payment_id,
+            'status': 'COMPLETED' if completed else 'CREATED',
+        }
+        self._send(200, response)
+
+    def do_DELETE(self):
+        if self._begin():
+            return
+        self._send(200, _result('SUCCESS', 'Success'))
+
+
+def make_server(host='127.0.0.1', port=0, **options):
+    """サーバーを作成する（port=0 なら空いているポート）。serve_forever() は呼び出し側で。"""
+    handler = type('Handler', (FakePayPayHandler,), {'state': FakePayPayState(**options)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def start_in_thread(**options):
+    """バックグラウンドスレッドで起動し、(server, base_url) を返す"""
+    server = make_server(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
@@ -0,0 +1,227 @@
+# services/geocoding.py
+# --- 店舗住所の非同期ジオコーディング ---
+# 店舗登録のリクエスト内では Nominatim を呼ばず、geocode_jobs にジョブを積むだけにする。
+# バックグラウンドのワーカーがレート制限・リトライつきで緯度経度を取得して locations に書き込む。
+# 結果は geocode_cache に住所ごとに保存し、同じ住所では二度とジオコーダーを呼ばない。
+# ジオコーダーは差し替え可能（set_geocoder）なので、テストではスタブを使える。
+import logging
+import threading
+import time
+import unicodedata
+
+from services.database import get_db_connection
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'GEOCODER_MIN_INTERVAL': 1.0,     # ジオコーダー呼び出しの最小間隔（Nominatim の利用規約は1秒に1回）
+    'GEOCODER_TIMEOUT': 10,
+    'GEOCODER_MAX_ATTEMPTS': 5,
+    'GEOCODER_RETRY_BASE': 5.0,       # リトライ間隔（秒）。失敗するたびに倍にする
+    'GEOCODER_LEASE_SECONDS': 60.0,   # ワーカーが取得したジョブを他のワーカーに渡さない時間
+    'GEOCODER_USER_AGENT': 'store_locator',
+}
+
+
+CACHE_SQL = "SELECT latitude, longitude, found FROM geocode_cache WHERE address = ?"
+
+NEXT_JOB_SQL = """
+    SELECT job_id, store_id, address, attempts FROM geocode_jobs
+    WHERE status = 'pending' AND next_attempt_at <= ?
+    ORDER BY next_attempt_at LIMIT 1
+"""
+
+
+def normalize_address(address):
+    """キャッシュのキー用に住所を正規化する（全角英数・空白の揺れをそろえる）"""
+    return ' '.join(unicodedata.normalize('NFKC', address or '').split())
+
+
+class NominatimGeocoder:
+    """geopy の Nominatim を使うジオコーダー（geopy は初回呼び出し時に読み込む）"""
+
+    def __init__(self, user_agent, timeout):
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self._geolocator = None
+
+    def __call__(self, address):
+        if self._geolocator is None:
+            from geopy.geocoders import Nominatim
+            self._geolocator = Nominatim(user_agent=self.user_agent)
+        location = self._geolocator.geocode(address, timeout=self.timeout)
+        if location:
+            return location.latitude, location.longitude
+        return None
+
+
+def lookup_cache(conn, address):
+    """キャッシュを引く。戻り値は (ヒットしたか, (lat, lng) or None)。"""
+    row = conn.execute(CACHE_SQL, (normalize_address(address),)).fetchone()
+    if row is None:
+        return False, None
+    return True, (row['latitude'], row['longitude']) if row['found'] else None
+
+
+def save_location(conn, store_id, location_title, latitude, longitude):
+    conn.execute("""
+        INSERT INTO locations (location_title, store_id, latitude, longitude)
+        VALUES (?, ?, ?, ?)
+    """, (location_title, store_id, latitude, longitude))
+
+
+class GeocodeWorker:
+    def __init__(self):
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.geocoder = None
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._last_call = 0.0
+        self.geocoder_calls = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def configure(self, **settings):
+        self.settings.update(settings)
+
+    def set_geocoder(self, geocoder):
+        """address -> (lat, lng) or None を返す関数に差し替える（失敗時は例外を送出）"""
+        self.geocoder = geocoder
+
+    def enqueue(self, conn, store_id, address):
+        """店舗の住所のジオコーディングを予約する。コミットは呼び出し側で行う。
+
+        キャッシュにある住所はその場で locations に書き込み、(lat, lng) を返す。
+        ジョブを積んだ場合や、見つからなかった住所の場合は None。
+        """
+        hit, coords = lookup_cache(conn, address)
+        if hit:
+            self.cache_hits += 1
+            if coords:
+                save_location(conn, store_id, address, *coords)
+            return coords
+        self.cache_misses += 1
+        conn.execute("INSERT INTO geocode_jobs (store_id, address) VALUES (?, ?)", (store_id, address))
+        return None
+
+    def wake(self):
+        """commit 後に呼び、ワーカーにジョブの処理を始めさせる"""
+        self._ensure_started()
+        self._wakeup.set()
+
+    def run_pending(self, limit=None):
+        """期限の来たジョブを処理する。処理したジョブ数を返す（ワーカーやコマンドから呼ぶ）。"""
+        done = 0
+        while limit is None or done < limit:
+            job = self._claim_next()
+            if job is None:
+                break
+            self._process(job)
+            done += 1
+        return done
+
+    def stats(self):
+        rows = get_db_connection().execute(
+            "SELECT status, COUNT(*) AS n FROM geocode_jobs GROUP BY status").fetchall()
+        jobs = {row['status']: row['n'] for row in rows}
+        return {'geocoder_calls': self.geocoder_calls, 'cache_hits': self.cache_hits,
+                'cache_misses': self.cache_misses, 'jobs': jobs}
+
+    # --- 内部処理 ---
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='geocode-worker', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.run_pending()
+            except Exception:
+                logger.exception("ジオコーディングのワーカーでエラーが発生しました")
+            self._wakeup.wait(timeout=self.settings['GEOCODER_RETRY_BASE'])
+            self._wakeup.clear()
+
+    def _claim_next(self):
+        """期限の来た pending ジョブを1件取り、リース時間だけ他のワーカーから見えなくする"""
+        conn = get_db_connection()
+        now = time.time()
+        job = conn.execute(NEXT_JOB_SQL, (now,)).fetchone()
+        if job is None:
+            return None
+        cursor = conn.execute("""
+            UPDATE geocode_jobs SET next_attempt_at = ?
+            WHERE job_id = ? AND status = 'pending' AND next_attempt_at <= ?
+        """, (now + self.settings['GEOCODER_LEASE_SECONDS'], job['job_id'], now))
+        conn.commit()
+        return dict(job) if cursor.rowcount == 1 else self._claim_next()
+
+    def _geocode(self, address):
+        # 呼び出し間隔を空ける（レート制限）
+        wait = self._last_call + self.settings['GEOCODER_MIN_INTERVAL'] - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self.geocoder_calls += 1
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            coords = self.geocoder(address)
+            outcome = 'ok' if coords else 'not_found'
+            return coords
+        finally:
+            self._last_call = time.monotonic()
+            metrics.observe_outbound('geocoder', 'geocode', outcome, time.perf_counter() - start)
+
+    def _process(self, job):
+        conn = get_db_connection()
+        hit, coords = lookup_cache(conn, job['address'])
+        if not hit:
+            try:
+                coords = self._geocode(job['address'])
+            except Exception as e:
+                self._retry_later(conn, job, e)
+                return
+            conn.execute("""
+                INSERT OR REPLACE INTO geocode_cache (address, latitude, longitude, found)
+                VALUES (?, ?, ?, ?)
+            """, (normalize_address(job['address']),
+                  coords[0] if coords else None, coords[1] if coords else None, 1 if coords else 0))
+        if coords:
+            save_location(conn, job['store_id'], job['address'], *coords)
+        conn.execute("UPDATE geocode_jobs SET status = 'done', attempts = attempts + 1 WHERE job_id = ?",
+                     (job['job_id'],))
+        conn.commit()
+
+    def _retry_later(self, conn, job, error):
+        attempts = job['attempts'] + 1
+        if attempts >= self.settings['GEOCODER_MAX_ATTEMPTS']:
+            logger.error(f"住所 '{job['address']}' のジオコーディングを諦めました: {error}")
+            conn.execute("UPDATE geocode_jobs SET status = 'failed', attempts = ?, last_error = ? WHERE job_id = ?",
+                         (attempts, str(error), job['job_id']))
+        else:
+            delay = self.settings['GEOCODER_RETRY_BASE'] * (2 ** (attempts - 1))
+            logger.warning(f"住所 '{job['address']}' のジオコーディングに失敗しました（{delay:.0f}秒後に再試行）: {error}")
+            conn.execute("""
+                UPDATE geocode_jobs SET attempts = ?, last_error = ?, next_attempt_at = ?
+                WHERE job_id = ?
+            """, (attempts, str(error), time.time() + delay, job['job_id']))
+        conn.commit()
+
+
+geocode_worker = GeocodeWorker()
+
+
+def init_app(app):
+    for key, value in DEFAULT_SETTINGS.items():
+        app.config.setdefault(key, value)
+    geocode_worker.configure(**{key: app.config[key] for key in DEFAULT_SETTINGS})
+    geocoder = app.config.get('GEOCODER')  # テストなどでスタブを渡す場合
+    geocode_worker.set_geocoder(geocoder or NominatimGeocoder(app.config['GEOCODER_USER_AGENT'],
+                                                              app.config['GEOCODER_TIMEOUT']))
+    # 前回の起動で処理しきれなかったジョブは、ワーカーの最初の run_pending で拾う
+    # （create_app() の中では DB を読まず、ワーカーのスレッドを動かすだけにする）
+    geocode_worker.wake()
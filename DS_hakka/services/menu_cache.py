@@ -0,0 +1,120 @@
+# services/menu_cache.py
+# --- 店舗ごとのメニューキャッシュ ---
+# 店舗情報・メニュー一覧・カテゴリは閲覧に比べて変更がまれなので、プロセス内にキャッシュする。
+# メニューを変更したら同じトランザクションで menu_versions を加算し、commit 後に invalidate() を呼ぶ。
+# 他のワーカーで変更された場合も、一定間隔でバージョン番号を確認して読み直す。
+import threading
+import time
+from collections import OrderedDict
+
+from services.database import get_db_connection
+
+STORE_SQL = "SELECT * FROM store WHERE store_id = ?"
+VERSION_SQL = "SELECT version FROM menu_versions WHERE store_id = ?"
+MENUS_SQL = "SELECT menu_id, menu_name, category, price, soldout FROM menus WHERE store_id = ? ORDER BY menu_id"
+
+DEFAULT_MAX_SIZE = 256
+DEFAULT_VERSION_CHECK_SECONDS = 2.0
+
+
+class MenuCache:
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, version_check_seconds=DEFAULT_VERSION_CHECK_SECONDS):
+        self.max_size = max_size
+        self.version_check_seconds = version_check_seconds
+        self._entries = OrderedDict()  # store_id -> エントリ（LRU順）
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, store_id):
+        """店舗のメニュー情報を返す。店舗が存在しない場合は None。"""
+        now = time.monotonic()
+        # 件数の加算も複数スレッドから呼ばれるので、エントリと同じロックの中で行う
+        with self._lock:
+            entry = self._entries.get(store_id)
+            if entry is not None:
+                self._entries.move_to_end(store_id)
+                if now - entry['checked_at'] < self.version_check_seconds:
+                    self.hits += 1
+                    return entry
+        if entry is not None:
+            # 他のワーカーでメニューが変更されていないか確認
+            if _read_version(get_db_connection(), store_id) == entry['version']:
+                with self._lock:
+                    entry['checked_at'] = now
+                    self.hits += 1
+                return entry
+
+        with self._lock:
+            self.misses += 1
+        entry = _load(get_db_connection(), store_id)
+        if entry is None:
+            return None
+        entry['checked_at'] = now
+        with self._lock:
+            self._entries[store_id] = entry
+            self._entries.move_to_end(store_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def invalidate(self, store_id):
+        with self._lock:
+            self._entries.pop(store_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+menu_cache = MenuCache()
+
+
+def init_app(app):
+    app.config.setdefault('MENU_CACHE_SIZE', DEFAULT_MAX_SIZE)
+    app.config.setdefault('MENU_CACHE_VERSION_CHECK_SECONDS', DEFAULT_VERSION_CHECK_SECONDS)
+    menu_cache.max_size = app.config['MENU_CACHE_SIZE']
+    menu_cache.version_check_seconds = app.config['MENU_CACHE_VERSION_CHECK_SECONDS']
+
+
+def bump_version(conn, store_id):
+    """メニュー変更時に呼ぶ。コミットは呼び出し側で行う。"""
+    conn.execute("""
+        INSERT INTO menu_versions (store_id, version) VALUES (?, 1)
+        ON CONFLICT (store_id) DO UPDATE SET version = version + 1
+    """, (store_id,))
+
+
+def _read_version(conn, store_id):
+    row = conn.execute(VERSION_SQL, (store_id,)).fetchone()
+    return row['version'] if row else 0
+
+
+def _load(conn, store_id):
+    store = conn.execute(STORE_SQL, (store_id,)).fetchone()
+    if store is None:
+        return None
+    version = _read_version(conn, store_id)
+    menus = [dict(row) for row in conn.execute(MENUS_SQL, (store_id,))]
+    menu_items = [menu for menu in menus if menu['soldout'] == 0]
+    return {
+        'version': version,
+        'store': dict(store),
+        'menus': menus,                  # 売り切れを含む全メニュー
+        'menu_items': menu_items,        # 販売中のメニュー
+        'categories': list(dict.fromkeys(m['category'] for m in menu_items if m['category'])),
+        'by_id': {menu['menu_id']: menu for menu in menus},
+    }
@@ -0,0 +1,220 @@
+# services/menu_import.py
+# --- メニューの一括登録（ストリーミング処理） ---
+# アップロードされた CSV / Excel を1行ずつ読み（読み込み）、1行ずつ検証し（検証）、
+# 一定件数ごとに executemany でまとめて書き込む（登録）。
+# どの段階もファイル全体をメモリに載せないので、数万行のファイルでもメモリ使用量は一定。
+#   python cli.py bench-menu-import --rows 100000
+import codecs
+import csv
+import itertools
+
+REQUIRED_HEADERS = ('menu_name', 'price')
+DEFAULT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 20   # 画面に表示するエラーの最大件数（残りは件数だけ表示）
+
+
+class MenuImportError(Exception):
+    """ファイルの形式・ヘッダーが不正で読み込めない場合の例外"""
+
+
+# --- 読み込み ---
+
+def _check_headers(headers, kind):
+    if not set(REQUIRED_HEADERS).issubset(set(headers or [])):
+        raise MenuImportError(
+            f'{kind}ヘッダーが無効です。必須ヘッダー({", ".join(REQUIRED_HEADERS)})がありません。')
+
+
+def _iter_csv(stream):
+    # バイト列を1行ずつデコードしながら読む（BOM 付き UTF-8 にも対応）
+    reader = csv.DictReader(codecs.iterdecode(stream, 'utf-8-sig'))
+    _check_headers(reader.fieldnames, 'CSV')
+    return enumerate(reader, start=2)
+
+
+def _iter_xlsx(stream):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    rows = workbook.active.iter_rows(values_only=True)
+    headers = [str(h).strip() if h is not None else '' for h in next(rows, ())]
+    try:
+        _check_headers(headers, 'Excel')
+    except MenuImportError:
+        workbook.close()
+        raise
+
+    def generate():
+        try:
+            for row_num, values in enumerate(rows, start=2):
+                if all(v is None for v in values):
+                    continue  # 空行は読み飛ばす
+                yield row_num, dict(zip(headers, values))
+        finally:
+            workbook.close()
+    return generate()
+
+
+def _iter_xls(stream):
+    # 旧形式の .xls は openpyxl で読めないため pandas で読み込む（全体を読み込む）
+    import pandas as pd
+
+    df = pd.read_excel(stream, dtype=str)
+    _check_headers(df.columns, 'Excel')
+    df = df.astype(object).where(df.notna(), None)
+    return enumerate(df.to_dict('records'), start=2)
+
+
+def iter_menu_rows(filename, stream):
+    """アップロードファイルを (行番号, 行の辞書) のイテレーターにする。
+
+    ヘッダーが不正な場合や対応していない形式の場合は MenuImportError を送出する。
+    """
+    try:
+        if filename.endswith('.csv'):
+            return _iter_csv(stream)
+        if filename.endswith('.xlsx'):
+            return _iter_xlsx(stream)
+        if filename.endswith('.xls'):
+            return _iter_xls(stream)
+    except MenuImportError:
+        raise
+    except Exception as e:
+        raise MenuImportError(f"ファイルの読み込み中にエラーが発生しました: {e}") from e
+    raise MenuImportError('対応していないファイル形式です。.csvまたは.xlsxファイルをアップロードしてください。')
+
+
+# --- 検証 ---
+
+def _text(value):
+    return '' if value is None else str(value).strip()
+
+
+def validate_row(row_num, row):
+    """1行を検証する。戻り値は (メニューの辞書, None) か (None, エラーメッセージ)。"""
+    row_num_str = f"行 {row_num}" if row_num is not None else "手動入力"
+
+    menu_name = _text(row.get('menu_name'))
+    price_str = _text(row.get('price'))
+    soldout_str = _text(row.get('soldout')) or '0'
+    category = _text(row.get('category'))
+
+    # 必須項目チェック
+    if not menu_name or not price_str:
+        return None, f"{row_num_str}: 必須項目 (menu_name, price) が空です。"
+
+    # 価格チェック
+    try:
+        price = int(float(price_str))
+        if price < 0:
+            raise ValueError
+    except (ValueError, TypeError, OverflowError):
+        return None, f"{row_num_str}: 価格の値 ('{price_str}') が不正です。0以上の数値を入力してください。"
+
+    # 売り切れフラグチェック
+    try:
+        soldout = int(float(soldout_str))
+        if soldout not in [0, 1]:
+            raise ValueError
+    except (ValueError, TypeError, OverflowError):
+        return None, f"{row_num_str}: 在庫の値 ('{soldout_str}') が不正です。0 (販売中) か 1 (売り切れ) で入力してください。"
+
+    return {'menu_name': menu_name, 'category': category, 'price': price, 'soldout': soldout}, None
+
+
+class ImportErrors:
+    """エラーを先頭の MAX_REPORTED_ERRORS 件だけ保持し、残りは件数だけ数える"""
+
+    def __init__(self, limit=MAX_REPORTED_ERRORS):
+        self.limit = limit
+        self.messages = []
+        self.count = 0
+
+    def add(self, message):
+        self.count += 1
+        if self.limit is None or len(self.messages) < self.limit:
+            self.messages.append(message)
+
+    @property
+    def omitted(self):
+        return self.count - len(self.messages)
+
+    def __bool__(self):
+        return self.count > 0
+
+
+def validate_rows(rows, errors):
+    """(行番号, 行) のイテレーターを検証し、正しい行だけを順に返すジェネレーター。
+
+    エラーは errors（ImportErrors）に記録される。
+    """
+    for row_num, row in rows:
+        menu, error = validate_row(row_num, row)
+        if error:
+            errors.add(error)
+        else:
+            yield menu
+
+
+# --- 登録 ---
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def import_menus(conn, store_id, menus, mode='insert', chunk_size=DEFAULT_CHUNK_SIZE):
+    """メニューを chunk_size 件ずつ executemany で登録する。コミットは呼び出し側で行う。
+
+    mode='insert' はすべて新規登録、mode='upsert' は同じ商品名のメニューがあれば上書きする。
+    戻り値は {'inserted': 件数, 'updated': 件数}。
+    """
+    if mode == 'upsert':
+        return _upsert_menus(conn, store_id, menus, chunk_size)
+
+    inserted = 0
+    for chunk in _chunks(menus, chunk_size):
+        conn.executemany(
+            "INSERT INTO menus (store_id, menu_name, category, price, soldout) VALUES (?, ?, ?, ?, ?)",
+            [(store_id, m['menu_name'], m['category'], m['price'], m['soldout']) for m in chunk])
+        inserted += len(chunk)
+    return {'inserted': inserted, 'updated': 0}
+
+
+def _upsert_menus(conn, store_id, menus, chunk_size):
+    # 一時テーブルにまとめて入れてから、既存分の更新と新規分の追加をそれぞれ1文で行う
+    conn.execute("DROP TABLE IF EXISTS temp.menu_import_staging")
+    conn.execute("""
+        CREATE TEMP TABLE menu_import_staging (
+            seq INTEGER PRIMARY KEY,
+            menu_name TEXT NOT NULL UNIQUE ON CONFLICT REPLACE,  -- ファイル内で重複した商品名は後の行を採用
+            category TEXT NOT NULL,
+            price INTEGER NOT NULL,
+            soldout INTEGER NOT NULL
+        )
+    """)
+    for chunk in _chunks(menus, chunk_size):
+        conn.executemany(
+            "INSERT INTO menu_import_staging (menu_name, category, price, soldout) VALUES (?, ?, ?, ?)",
+            [(m['menu_name'], m['category'], m['price'], m['soldout']) for m in chunk])
+
+    updated = conn.execute("""
+        UPDATE menus
+        SET (category, price, soldout) = (
+            SELECT st.category, st.price, st.soldout FROM menu_import_staging AS st
+            WHERE st.menu_name = menus.menu_name)
+        WHERE store_id = ? AND menu_name IN (SELECT menu_name FROM menu_import_staging)
+    """, (store_id,)).rowcount
+    inserted = conn.execute("""
+        INSERT INTO menus (store_id, menu_name, category, price, soldout)
+        SELECT ?, st.menu_name, st.category, st.price, st.soldout
+        FROM menu_import_staging AS st
+        WHERE NOT EXISTS (SELECT 1 FROM menus AS m WHERE m.store_id = ? AND m.menu_name = st.menu_name)
+        ORDER BY st.seq
+    """, (store_id, store_id)).rowcount
+    conn.execute("DROP TABLE temp.menu_import_staging")
+    return {'inserted': inserted, 'updated': updated}
@@ -0,0 +1,267 @@
+# services/menu_import_jobs.py
+# --- メニュー一括登録のバックグラウンドジョブ ---
+# アップロードされたファイルはディスクに保存してジョブを作るだけにし、
+# 読み込み・検証（menu_import_rows への書き込み）と menus への登録はワーカースレッドで行う。
+# 確認画面は menu_import_rows をページ単位で表示し、進捗は status() で取得する。
+# ファイルの大きさに関係なく、リクエストの処理時間は一定になる。
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from services import menu_import
+from services.database import get_db_connection
+from services.menu_cache import bump_version, menu_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'MENU_IMPORT_DIR': os.path.join(tempfile.gettempdir(), 'ds_hakka_menu_imports'),
+    'MENU_IMPORT_WORKERS': 1,
+    'MENU_IMPORT_CHUNK_SIZE': menu_import.DEFAULT_CHUNK_SIZE,
+    'MENU_IMPORT_PREVIEW_PAGE_SIZE': 100,
+    'MENU_IMPORT_EXPIRE_SECONDS': 24 * 3600,  # 確定されなかったジョブの検証済みデータを残す時間
+    'MENU_IMPORT_STALE_SECONDS': 600,         # 起動時、これより長く更新のない処理中ジョブは中断扱い
+}
+
+# 処理中（ワーカーが動いている）のステータス
+RUNNING_STATUSES = ('validating', 'importing')
+
+STAGED_ROWS_SQL = """
+    SELECT row_num, menu_name, category, price, soldout
+    FROM menu_import_rows
+    WHERE job_id = ? AND row_num > ?
+    ORDER BY row_num
+    LIMIT ?
+"""
+
+JOB_SQL = "SELECT * FROM menu_import_jobs WHERE job_id = ? AND store_id = ?"
+
+
+class MenuImportJobs:
+    def __init__(self):
+        self.settings = dict(DEFAULT_SETTINGS)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def configure(self, **settings):
+        self.settings.update(settings)
+
+    # --- ジョブの作成 ---
+
+    def create_from_upload(self, conn, store_id, file, mode='insert'):
+        """アップロードファイルを保存してジョブを作り、検証をワーカーに任せる。job_id を返す。"""
+        self._expire_old_jobs(conn, store_id)
+        job_id = self._create_job(conn, store_id, file.filename, mode)
+        os.makedirs(self.settings['MENU_IMPORT_DIR'], exist_ok=True)
+        path = os.path.join(self.settings['MENU_IMPORT_DIR'], f"{job_id}{os.path.splitext(file.filename)[1].lower()}")
+        file.save(path)  # 少しずつディスクに書き出す
+        conn.commit()
+        self._submit(self._validate, job_id, path, file.filename)
+        return job_id
+
+    def create_from_rows(self, conn, store_id, menus, mode='insert'):
+        """手動入力など検証済みの少量のデータから、確認待ちのジョブを作る。job_id を返す。"""
+        self._expire_old_jobs(conn, store_id)
+        job_id = self._create_job(conn, store_id, '手動入力', mode)
+        conn.executemany(
+            "INSERT INTO menu_import_rows (job_id, row_num, menu_name, category, price, soldout) VALUES (?, ?, ?, ?, ?, ?)",
+            [(job_id, i, m['menu_name'], m['category'], m['price'], m['soldout']) for i, m in enumerate(menus, start=1)])
+        conn.execute("""
+            UPDATE menu_import_jobs SET status = 'ready', processed_rows = ?, valid_rows = ?, progress = 1, updated_at = ?
+            WHERE job_id = ?
+        """, (len(menus), len(menus), time.time(), job_id))
+        conn.commit()
+        return job_id
+
+    # --- 確定・取り消し ---
+
+    def start_import(self, conn, job_id, store_id):
+        """確認済みのジョブの登録を開始する。開始できなかった（確認待ちでない）場合は False。"""
+        cursor = conn.execute("""
+            UPDATE menu_import_jobs SET status = 'importing', progress = 0, updated_at = ?
+            WHERE job_id = ? AND store_id = ? AND status = 'ready'
+        """, (time.time(), job_id, store_id))
+        conn.commit()
+        if cursor.rowcount != 1:
+            return False
+        self._submit(self._import, job_id)
+        return True
+
+    def cancel(self, conn, job_id, store_id):
+        cursor = conn.execute("""
+            UPDATE menu_import_jobs SET status = 'canceled', updated_at = ?
+            WHERE job_id = ? AND store_id = ? AND status = 'ready'
+        """, (time.time(), job_id, store_id))
+        if cursor.rowcount == 1:
+            conn.execute("DELETE FROM menu_import_rows WHERE job_id = ?", (job_id,))
+        conn.commit()
+        return cursor.rowcount == 1
+
+    # --- 参照 ---
+
+    def status(self, conn, job_id, store_id):
+        """ジョブの状態を辞書で返す（他の店舗のジョブや存在しないジョブは None）"""
+        row = conn.execute(JOB_SQL, (job_id, store_id)).fetchone()
+        if row is None:
+            return None
+        job = {key: row[key] for key in (
+            'job_id', 'filename', 'mode', 'status', 'processed_rows', 'valid_rows', 'error_count',
+            'progress', 'inserted', 'updated', 'message')}
+        job['errors'] = json.loads(row['errors']) if row['errors'] else []
+        return job
+
+    def fetch_rows(self, conn, job_id, after=0, limit=None):
+        """検証済みの行を行番号順に1ページ分返す。戻り値は (行のリスト, 次ページの after or None)。"""
+        limit = limit or self.settings['MENU_IMPORT_PREVIEW_PAGE_SIZE']
+        rows = conn.execute(STAGED_ROWS_SQL, (job_id, after, limit + 1)).fetchall()
+        has_next = len(rows) > limit
+        rows = [dict(row) for row in rows[:limit]]
+        return rows, (rows[-1]['row_num'] if has_next else None)
+
+    # --- ワーカー ---
+
+    def _submit(self, func, *args):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.settings['MENU_IMPORT_WORKERS'],
+                                                    thread_name_prefix='menu-import')
+        self._executor.submit(func, *args)
+
+    def _create_job(self, conn, store_id, filename, mode):
+        cursor = conn.execute(
+            "INSERT INTO menu_import_jobs (store_id, filename, mode, updated_at) VALUES (?, ?, ?, ?)",
+            (store_id, filename, mode, time.time()))
+        return cursor.lastrowid
+
+    def _expire_old_jobs(self, conn, store_id):
+        """確定されずに放置されたジョブの検証済みデータを削除する"""
+        expired = [row['job_id'] for row in conn.execute("""
+            SELECT job_id FROM menu_import_jobs
+            WHERE store_id = ? AND status = 'ready' AND updated_at < ?
+        """, (store_id, time.time() - self.settings['MENU_IMPORT_EXPIRE_SECONDS']))]
+        for job_id in expired:
+            conn.execute("DELETE FROM menu_import_rows WHERE job_id = ?", (job_id,))
+            conn.execute("UPDATE menu_import_jobs SET status = 'canceled', message = ? WHERE job_id = ?",
+                         ('期限切れのため取り消しました', job_id))
+
+    def _update(self, conn, job_id, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f"{key} = ?" for key in fields)
+        conn.execute(f"UPDATE menu_import_jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+        conn.commit()
+
+    def _validate(self, job_id, path, filename):
+        conn = get_db_connection()
+        errors = menu_import.ImportErrors()
+        counts = {'processed': 0, 'valid': 0}
+        try:
+            with open(path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size or 1
+                rows = menu_import.iter_menu_rows(filename, f)
+                staged = []
+                for row_num, row in rows:
+                    counts['processed'] += 1
+                    menu, error = menu_import.validate_row(row_num, row)
+                    if error:
+                        errors.add(error)
+                        continue
+                    staged.append((job_id, row_num, menu['menu_name'], menu['category'], menu['price'], menu['soldout']))
+                    if len(staged) >= self.settings['MENU_IMPORT_CHUNK_SIZE']:
+                        self._stage(conn, job_id, staged, counts, errors, min(f.tell() / size, 0.99))
+                        staged = []
+                self._stage(conn, job_id, staged, counts, errors, 1.0)
+
+            if counts['valid'] == 0:
+                self._update(conn, job_id, status='failed', message='有効なデータがなかったため、プレビューできませんでした。')
+            else:
+                self._update(conn, job_id, status='ready')
+        except menu_import.MenuImportError as e:
+            conn.rollback()
+            self._update(conn, job_id, status='failed', message=str(e))
+        except Exception as e:
+            logger.exception(f"メニュー取り込みジョブ {job_id} の検証中にエラーが発生しました")
+            conn.rollback()
+            self._update(conn, job_id, status='failed', message=f"ファイルの読み込み中にエラーが発生しました: {e}")
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _stage(self, conn, job_id, staged, counts, errors, progress):
+        if staged:
+            conn.executemany(
+                "INSERT INTO menu_import_rows (job_id, row_num, menu_name, category, price, soldout) VALUES (?, ?, ?, ?, ?, ?)",
+                staged)
+            counts['valid'] += len(staged)
+        self._update(conn, job_id, processed_rows=counts['processed'], valid_rows=counts['valid'],
+                     error_count=errors.count, errors=json.dumps(errors.messages, ensure_ascii=False),
+                     progress=progress)
+
+    def _import(self, job_id):
+        """検証済みの行を chunk 単位で menus へ登録する。
+
+        SQLite の書き込みロックをファイル全体の登録の間持ち続けると、注文の書き込みなど他の書き込みが
+        待たされて失敗するので、chunk ごとにコミットする。登録した行は同じトランザクションで
+        menu_import_rows から削除するので、残っている行がそのまま未登録の行になる
+        （途中で失敗・中断しても、もう一度確定すれば続きから登録する）。
+        """
+        conn = get_db_connection()
+        job = conn.execute("SELECT store_id, mode, valid_rows, inserted, updated FROM menu_import_jobs WHERE job_id = ?",
+                           (job_id,)).fetchone()
+        store_id = job['store_id']
+        inserted, updated = job['inserted'], job['updated']
+        remaining = conn.execute("SELECT COUNT(*) FROM menu_import_rows WHERE job_id = ?", (job_id,)).fetchone()[0]
+        done = job['valid_rows'] - remaining  # 前回までに登録した件数
+        try:
+            while True:
+                rows = conn.execute(STAGED_ROWS_SQL, (job_id, 0, self.settings['MENU_IMPORT_CHUNK_SIZE'])).fetchall()
+                if not rows:
+                    break
+                result = menu_import.import_menus(conn, store_id, rows, mode=job['mode'],
+                                                  chunk_size=self.settings['MENU_IMPORT_CHUNK_SIZE'])
+                conn.execute("DELETE FROM menu_import_rows WHERE job_id = ? AND row_num <= ?",
+                             (job_id, rows[-1]['row_num']))
+                bump_version(conn, store_id)
+                inserted += result['inserted']
+                updated += result['updated']
+                done += len(rows)
+                self._update(conn, job_id, inserted=inserted, updated=updated,
+                             progress=min(done / job['valid_rows'], 1.0) if job['valid_rows'] else 1.0)
+                menu_cache.invalidate(store_id)
+            self._update(conn, job_id, status='done', progress=1.0, message=None)
+        except Exception as e:
+            logger.exception(f"メニュー取り込みジョブ {job_id} の登録中にエラーが発生しました")
+            conn.rollback()
+            # 登録済みの chunk はコミット済みで、残りの検証済みデータは残っているので、もう一度確定すれば続きから登録する
+            self._update(conn, job_id, status='ready',
+                         message=f"データベースへの登録中にエラーが発生しました（{done}件まで登録済み。もう一度確定すると続きから登録します）: {e}")
+            menu_cache.invalidate(store_id)
+
+    def recover_stale_jobs(self, conn):
+        """前回の起動で処理が途中で止まったジョブを片付ける"""
+        cutoff = time.time() - self.settings['MENU_IMPORT_STALE_SECONDS']
+        # 登録は chunk ごとにコミットされ、未登録の行は残っているので、確認待ちに戻せば続きから確定し直せる
+        conn.execute("""
+            UPDATE menu_import_jobs SET status = 'ready', message = '登録が中断されました。もう一度確定すると続きから登録します。'
+            WHERE status = 'importing' AND updated_at < ?
+        """, (cutoff,))
+        conn.execute("""
+            UPDATE menu_import_jobs SET status = 'failed', message = 'ファイルの読み込みが中断されました。もう一度アップロードしてください。'
+            WHERE status = 'validating' AND updated_at < ?
+        """, (cutoff,))
+        conn.commit()
+
+
+menu_import_jobs = MenuImportJobs()
+
+
+def init_app(app):
+    for key, value in DEFAULT_SETTINGS.items():
+        app.config.setdefault(key, value)
+    menu_import_jobs.configure(**{key: app.config[key] for key in DEFAULT_SETTINGS})
+    menu_import_jobs.recover_stale_jobs(get_db_connection())
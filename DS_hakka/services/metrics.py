@@ -0,0 +1,250 @@
+# services/metrics.py
+# --- リクエストごとの性能計測と /metrics ---
+# エンドポイントごとの応答時間、1リクエストあたりのSQLの回数・時間、
+# PayPay・ジオコーダーなど外部呼び出しの時間、各キャッシュのヒット数を集計し、
+# Prometheus のテキスト形式で /metrics から返す。
+# 値はプロセス内に持つだけなので、ワーカーが複数ある場合はワーカーごとの値になる。
+import bisect
+import os
+import threading
+import time
+
+from flask import Response, current_app, g, request
+
+from services import database
+
+DEFAULT_SETTINGS = {
+    'METRICS_ENABLED': True,
+    'METRICS_TOKEN': None,    # 設定すると /metrics に Authorization: Bearer <token> が必要（None なら環境変数 METRICS_TOKEN）
+}
+
+# 応答時間・外部呼び出し・SQL時間のバケット（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 1リクエストあたりのSQL回数のバケット
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最後は +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._histograms = {}  # 名前 -> (help, ラベル名, バケット, {ラベル値: Histogram})
+        self._counters = {}    # 名前 -> (help, ラベル名, {ラベル値: 数値})
+        self._collectors = []  # /metrics の出力時に呼ぶ関数（キャッシュの stats() など）
+
+    # --- 記録 ---
+
+    def observe(self, name, help_text, label_names, label_values, value, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            family = self._histograms.get(name)
+            if family is None:
+                family = self._histograms[name] = (help_text, label_names, buckets, {})
+            histogram = family[3].get(label_values)
+            if histogram is None:
+                histogram = family[3][label_values] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, help_text, label_names, label_values, amount=1):
+        with self._lock:
+            family = self._counters.get(name)
+            if family is None:
+                family = self._counters[name] = (help_text, label_names, {})
+            family[2][label_values] = family[2].get(label_values, 0) + amount
+
+    def observe_outbound(self, service, operation, outcome, seconds):
+        """外部サービス呼び出しの時間を記録する（PayPay・ジオコーダー）"""
+        self.observe('hakka_outbound_request_duration_seconds', '外部サービス呼び出しの所要時間',
+                     ('service', 'operation', 'outcome'), (service, operation, outcome), seconds)
+
+    def register_collector(self, func):
+        """func() は [(名前, 'counter'|'gauge', help, {ラベル名: 値}, 数値), ...] を返す"""
+        if func not in self._collectors:  # create_app() が複数回呼ばれても重複させない
+            self._collectors.append(func)
+
+    # --- リクエスト単位の計測 ---
+
+    def start_request(self):
+        self._local.sql = [0, 0.0]
+        g._metrics_start = time.perf_counter()
+
+    def finish_request(self, response):
+        start = g.pop('_metrics_start', None)
+        sql = getattr(self._local, 'sql', None)
+        self._local.sql = None
+        if start is None:
+            return response
+        endpoint = request.url_rule.endpoint if request.url_rule else 'unmatched'
+        self.observe('hakka_request_duration_seconds', 'エンドポイントごとの応答時間（レスポンス本体のストリーミングは含まない）',
+                     ('endpoint', 'method'), (endpoint, request.method), time.perf_counter() - start)
+        self.inc('hakka_responses_total', 'ステータスコードごとのレスポンス数',
+                 ('endpoint', 'status'), (endpoint, str(response.status_code)))
+        if sql is not None:
+            self.observe('hakka_request_sql_queries', '1リクエストで実行したSQLの回数',
+                         ('endpoint',), (endpoint,), sql[0], buckets=QUERY_COUNT_BUCKETS)
+            self.observe('hakka_request_sql_seconds', '1リクエストでSQLの実行にかかった合計時間',
+                         ('endpoint',), (endpoint,), sql[1])
+        return response
+
+    def end_request(self, exc=None):
+        self._local.sql = None
+
+    def observe_query(self, conn, sql, params, seconds):
+        """database の接続から実行のたびに呼ばれる"""
+        current = getattr(self._local, 'sql', None)
+        if current is not None:
+            current[0] += 1
+            current[1] += seconds
+        else:
+            # リクエスト外（バックグラウンドのワーカーなど）のSQL
+            self.inc('hakka_background_sql_queries_total', 'リクエスト外で実行したSQLの回数', (), ())
+            self.inc('hakka_background_sql_seconds_total', 'リクエスト外でSQLの実行にかかった合計時間', (), (), seconds)
+
+    # --- 出力 ---
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (help_text, label_names, buckets, series) in sorted(self._histograms.items()):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for label_values, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(buckets + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        le = f'le="{bound}"'
+                        lines.append(f'{name}_bucket{_labels(label_names, label_values, le)} {cumulative}')
+                    lines.append(f'{name}_sum{_labels(label_names, label_values)} {_number(histogram.sum)}')
+                    lines.append(f'{name}_count{_labels(label_names, label_values)} {histogram.count}')
+            for name, (help_text, label_names, series) in sorted(self._counters.items()):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} counter')
+                for label_values, value in sorted(series.items()):
+                    lines.append(f'{name}{_labels(label_names, label_values)} {_number(value)}')
+
+        # 同じ名前のサンプルはまとめて出力する（Prometheus の形式の決まり）
+        families = {}
+        for collector in self._collectors:
+            for name, kind, help_text, labels, value in collector():
+                families.setdefault(name, (kind, help_text, []))[2].append((labels, value))
+        for name, (kind, help_text, samples) in families.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{_labels(labels.keys(), labels.values())} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def _cache_samples(cache, hits, misses, size=None):
+    samples = [
+        ('hakka_cache_hits_total', 'counter', 'キャッシュのヒット数', {'cache': cache}, hits),
+        ('hakka_cache_misses_total', 'counter', 'キャッシュのミス数', {'cache': cache}, misses),
+    ]
+    if size is not None:
+        samples.append(('hakka_cache_entries', 'gauge', 'キャッシュの件数', {'cache': cache}, size))
+    return samples
+
+
+def _collect_caches():
+    from services.geocoding import geocode_worker
+    from services.menu_cache import menu_cache
+    from services.paypay_poller import payment_poller
+    from services.sales_analytics import sales_analytics
+
+    menu = menu_cache.stats()
+    poller = payment_poller.stats()
+    analytics = sales_analytics.stats()
+    return (_cache_samples('menu', menu['hits'], menu['misses'], menu['size'])
+            + _cache_samples('sales_analytics', analytics['hits'], analytics['misses'], analytics['size'])
+            + _cache_samples('paypay_status', poller['cache_hits'], poller['cache_misses'], poller['tracked'])
+            + _cache_samples('geocode', geocode_worker.cache_hits, geocode_worker.cache_misses))
+
+
+def _collect_gateway():
+    from services.paypay_gateway import paypay_gateway
+
+    state = paypay_gateway.breaker.state
+    return [('hakka_paypay_breaker_open', 'gauge', 'PayPay のサーキットブレーカーが開いているか（half_open も 1）', {},
+             0 if state == 'closed' else 1)]
+
+
+def _collect_open_orders():
+    from services.open_orders import open_orders
+
+    stats = open_orders.stats()
+    return [
+        ('hakka_open_orders_tracked', 'gauge', '待ち時間の目安・キッチン表示のために追跡している対応中の注文数', {},
+         stats['open_orders']),
+        ('hakka_open_orders_events_total', 'counter', '対応中の注文の投影に反映した注文イベント数', {}, stats['events']),
+        ('hakka_open_orders_syncs_total', 'counter', '対応中の注文の投影のために DB から読み直した回数', {}, stats['syncs']),
+    ]
+
+
+def _collect_order_writer():
+    from services.order_writer import order_writer
+
+    stats = order_writer.stats()
+    return [
+        ('hakka_order_writer_queue_depth', 'gauge', '書き込みを待っている注文の数', {}, stats['queue_depth']),
+        ('hakka_order_writer_batches_total', 'counter', '注文を書き込んだトランザクションの数', {}, stats['batches']),
+        ('hakka_order_writer_orders_total', 'counter', '書き込んだ注文の数', {}, stats['orders']),
+        ('hakka_order_writer_failed_total', 'counter', '書き込めなかった注文の数', {}, stats['failed']),
+        ('hakka_order_writer_timeouts_total', 'counter', '書き込みを待ちきれなかった注文の数', {}, stats['timeouts']),
+    ]
+
+
+def metrics_view():
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return Response('forbidden\n', status=403, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+def init_app(app):
+    for key, value in DEFAULT_SETTINGS.items():
+        app.config.setdefault(key, value)
+    if not app.config['METRICS_TOKEN']:
+        app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    app.before_request(metrics.start_request)
+    app.after_request(metrics.finish_request)
+    app.teardown_request(metrics.end_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+    database.add_query_observer(metrics.observe_query)
+    metrics.register_collector(_collect_caches)
+    metrics.register_collector(_collect_gateway)
+    metrics.register_collector(_collect_open_orders)
+    metrics.register_collector(_collect_order_writer)
@@ -0,0 +1,74 @@
+# services/migrations.py
+# --- スキーマのバージョン管理 ---
+# psql/migrations/ に置いた「番号_名前.sql」を番号順に適用する。
+# 適用済みのバージョンは SQLite の PRAGMA user_version に記録する。
+import os
+import re
+import sqlite3
+
+from services.database import get_db_connection
+
+_FILENAME = re.compile(r'^(\d+)_.+\.sql$')
+
+
+def init_app(app):
+    """create_app() から呼ばれ、起動時に未適用のマイグレーションを適用する"""
+    app.config.setdefault('MIGRATIONS_DIR', os.path.join(app.root_path, 'psql', 'migrations'))
+    with app.app_context():
+        apply_migrations(app.config['MIGRATIONS_DIR'])
+
+
+def load_migrations(migrations_dir):
+    """(バージョン番号, ファイルパス) のリストを番号順で返す"""
+    migrations = []
+    for filename in os.listdir(migrations_dir):
+        match = _FILENAME.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), os.path.join(migrations_dir, filename)))
+    return sorted(migrations)
+
+
+def split_statements(sql):
+    """SQLファイルの内容を1文ずつに分割する"""
+    statements = []
+    buffer = ''
+    for line in sql.splitlines(keepends=True):
+        buffer += line
+        if sqlite3.complete_statement(buffer):
+            statements.append(buffer.strip())
+            buffer = ''
+    rest = '\n'.join(l for l in buffer.splitlines() if not l.strip().startswith('--')).strip()
+    if rest:
+        raise ValueError(f"セミコロンで終わっていない文があります: {rest[:80]}")
+    return statements
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_migrations(migrations_dir):
+    """未適用のマイグレーションを1バージョンずつトランザクション内で適用する"""
+    conn = get_db_connection()
+    applied = []
+    for version, path in load_migrations(migrations_dir):
+        if version <= current_version(conn):
+            continue
+        with open(path, encoding='utf-8') as f:
+            statements = split_statements(f.read())
+
+        # 複数ワーカーが同時に起動しても二重に適用しないよう書き込みロックを取ってから再確認する
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= current_version(conn):
+                conn.rollback()
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
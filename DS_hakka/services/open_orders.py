@@ -0,0 +1,225 @@
+# services/open_orders.py
+# --- 対応中の注文（店舗ごとのプロセス内の投影） ---
+# 完了・キャンセル前の注文を店舗ごとにプロセス内に持ち、order_events に流れる注文作成・ステータス変更の
+# イベントで更新する。待ち時間の目安（wait_times）とキッチン表示（prep_items）はどちらもここを読む。
+# 注文ごとに「ステータス・そのステータスになった時刻・明細」を作成順に持ち、あわせて
+# メニュー×ステータス の数量を加減算で持つ（キッチン表示は対応中の注文数ではなくメニュー数に比例する）。
+# ステータスが変わったときは add_transition_listener で登録した関数を
+# (store_id, 前のステータス, そのステータスだった秒数, 新しいステータス) で呼ぶ（待ち時間の移動平均の更新用）。
+# 起動時に対応中の注文をまとめて読み込み、他のワーカーで受けた注文・変更は
+# OPEN_ORDERS_RESYNC_SECONDS ごとに店舗単位で DB から読み直して反映する。
+import datetime
+import logging
+import sqlite3
+import threading
+import time
+
+from services.database import get_db_connection
+from services.order_events import order_events
+from services.store_orders import ACTIVE_STATUSES, CLOSED_STATUSES
+
+DEFAULT_SETTINGS = {
+    'OPEN_ORDERS_RESYNC_SECONDS': 30.0,  # 他のワーカーでの変更を取り込むために DB から読み直す間隔
+}
+
+# store_filter は全店舗なら ""、1店舗なら "o.store_id = ? AND"（どちらも idx_orders_store_active を使う）
+# 明細のない注文も列には並べるので LEFT JOIN にする（orders が外側になる）
+OPEN_ORDERS_SQL = """
+    SELECT o.store_id, o.order_id, o.status, o.datetime,
+           (SELECT l.updated_at FROM order_status_log AS l
+            WHERE l.order_id = o.order_id ORDER BY l.status_id DESC LIMIT 1) AS entered_at,
+           oi.menu_id, oi.quantity
+    FROM orders AS o
+    LEFT JOIN order_items AS oi ON oi.order_id = o.order_id
+    WHERE {store_filter} o.status NOT IN ('completed', 'canceled')
+    ORDER BY o.datetime, o.order_id
+"""
+
+_STATUS_INDEX = {status: index for index, status in enumerate(ACTIVE_STATUSES)}
+
+logger = logging.getLogger(__name__)
+
+
+def _timestamp(value):
+    if value is None:
+        return time.time()
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    return datetime.datetime.fromisoformat(str(value)).timestamp()
+
+
+class StoreOrders:
+    def __init__(self):
+        self.orders = {}  # order_id -> [status, ステータスになった時刻(UNIX秒), ((menu_id, 数量), ...)]（作成順）
+        self.counts = {}  # menu_id -> ACTIVE_STATUSES の順の数量
+        self.synced_at = time.monotonic()
+
+    def count(self, status, items, sign):
+        index = _STATUS_INDEX.get(status)
+        if index is None:
+            return  # 決済待ちなど、まだ店舗が対応する前のステータス
+        for menu_id, quantity in items:
+            row = self.counts.get(menu_id)
+            if row is None:
+                row = self.counts[menu_id] = [0] * len(ACTIVE_STATUSES)
+            row[index] += sign * quantity
+            if sign < 0 and not any(row):
+                del self.counts[menu_id]
+
+
+class OpenOrders:
+    def __init__(self):
+        self.resync_seconds = DEFAULT_SETTINGS['OPEN_ORDERS_RESYNC_SECONDS']
+        self._stores = {}  # store_id -> StoreOrders
+        self._lock = threading.Lock()
+        self._transition_listeners = []
+        self.events = 0
+        self.syncs = 0
+
+    def add_transition_listener(self, func):
+        self._transition_listeners.append(func)
+
+    # --- イベントでの更新 ---
+
+    def handle_event(self, store_id, event_type, data):
+        """order_events のリスナー。読み込み済みの店舗だけを更新する。"""
+        try:
+            transition = self._apply(store_id, event_type, data)
+        except Exception:
+            # 途中まで反映したかもしれないので、次に読むときに DB から読み直させる
+            self.invalidate(store_id)
+            raise
+        if transition is not None:
+            for func in self._transition_listeners:
+                try:
+                    func(store_id, *transition)
+                except Exception:
+                    logger.exception(f"注文のステータス変更のリスナーでエラーが発生しました (店舗 {store_id})")
+
+    def invalidate(self, store_id):
+        """店舗を次に読むときに DB から読み直させる"""
+        with self._lock:
+            store = self._stores.get(store_id)
+            if store is not None:
+                store.synced_at = float('-inf')
+
+    def _apply(self, store_id, event_type, data):
+        """イベントを反映し、ステータスが変わった場合は (前のステータス, その秒数, 新しいステータス) を返す"""
+        transition = None
+        with self._lock:
+            store = self._stores.get(store_id)
+            if store is None:
+                return None  # 読み込んでいない店舗は、最初に読むときに DB から読み込む
+            self.events += 1
+            if event_type == 'order_created':
+                if data['id'] in store.orders:
+                    return None
+                items = tuple((item['menu_id'], item['quantity'])
+                              for item in data.get('items_list', []) if 'menu_id' in item)
+                store.orders[data['id']] = [data['status'], _timestamp(data.get('datetime')), items]
+                store.count(data['status'], items, 1)
+            elif event_type == 'status_changed':
+                entry = store.orders.get(data['id'])
+                if entry is None:
+                    if data['status'] not in CLOSED_STATUSES:
+                        # キャンセルの取り消しなど、明細を持っていない注文が戻ってきたので次に読むときに読み直す
+                        store.synced_at = float('-inf')
+                    return None
+                now = time.time()
+                transition = (entry[0], now - entry[1], data['status'])
+                store.count(entry[0], entry[2], -1)
+                if data['status'] in CLOSED_STATUSES:
+                    del store.orders[data['id']]
+                else:
+                    entry[0], entry[1] = data['status'], now
+                    store.count(entry[0], entry[2], 1)
+        return transition
+
+    # --- 読み取り ---
+
+    def queue(self, store_id, resync=False):
+        """対応中の注文を作成順に [(order_id, status, ステータスになった時刻), ...] で返す"""
+        store = self._get_store(store_id, resync)
+        with self._lock:
+            return [(order_id, status, entered_at) for order_id, (status, entered_at, _) in store.orders.items()]
+
+    def item_counts(self, store_id):
+        """({menu_id: ACTIVE_STATUSES の順の数量}, 店舗が対応中の注文数) を返す"""
+        store = self._get_store(store_id)
+        with self._lock:
+            counts = {menu_id: list(row) for menu_id, row in store.counts.items()}
+            open_orders = sum(1 for status, _, _ in store.orders.values() if status in _STATUS_INDEX)
+        return counts, open_orders
+
+    # --- 読み込み ---
+
+    def _get_store(self, store_id, resync=False):
+        with self._lock:
+            store = self._stores.get(store_id)
+        if store is not None and not resync and time.monotonic() - store.synced_at < self.resync_seconds:
+            return store
+        conn = get_db_connection()
+        rows = conn.execute(OPEN_ORDERS_SQL.format(store_filter="o.store_id = ? AND"), (store_id,)).fetchall()
+        return self._load(rows, [store_id])[store_id]
+
+    def rebuild(self, conn=None):
+        """全店舗の対応中の注文を読み込み直す（起動時）"""
+        conn = conn or get_db_connection()
+        rows = conn.execute(OPEN_ORDERS_SQL.format(store_filter=""), ()).fetchall()
+        with self._lock:
+            self._stores.clear()
+        loaded = self._load(rows, [])
+        return sum(len(store.orders) for store in loaded.values())
+
+    def _load(self, rows, store_ids):
+        """注文（明細ごと）の行から店舗ごとの投影を作って差し替える"""
+        loaded = {store_id: StoreOrders() for store_id in store_ids}
+        for row in rows:
+            store = loaded.get(row['store_id'])
+            if store is None:
+                store = loaded[row['store_id']] = StoreOrders()
+            entry = store.orders.get(row['order_id'])
+            if entry is None:
+                entry = store.orders[row['order_id']] = [
+                    row['status'], _timestamp(row['entered_at'] or row['datetime']), []]
+            if row['menu_id'] is not None:
+                entry[2].append((row['menu_id'], row['quantity']))
+        for store in loaded.values():
+            for entry in store.orders.values():
+                entry[2] = tuple(entry[2])
+                store.count(entry[0], entry[2], 1)
+        with self._lock:
+            self._stores.update(loaded)
+            self.syncs += 1
+        return loaded
+
+    def clear(self):
+        with self._lock:
+            self._stores.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'stores': len(self._stores),
+                'open_orders': sum(len(store.orders) for store in self._stores.values()),
+                'menus': sum(len(store.counts) for store in self._stores.values()),
+                'events': self.events,
+                'syncs': self.syncs,
+            }
+
+
+open_orders = OpenOrders()
+
+
+def init_app(app):
+    for key, value in DEFAULT_SETTINGS.items():
+        app.config.setdefault(key, value)
+    open_orders.resync_seconds = app.config['OPEN_ORDERS_RESYNC_SECONDS']
+    order_events.add_listener(open_orders.handle_event)
+    try:
+        with app.app_context():
+            orders = open_orders.rebuild()
+    except sqlite3.Error:
+        logger.exception("対応中の注文を読み込めませんでした（店舗ごとに最初に読むときに読み込みます）")
+    else:
+        logger.info("対応中の注文を読み込みました（%d 件）", orders)
@@ -0,0 +1,127 @@
+# services/order_events.py
+# --- 店舗向けの注文イベント（プロセス内 publish/subscribe） ---
+# 注文確定・ステータス変更のたびに差分だけを publish し、
+# SSE でつながっている店舗の注文画面へ届ける。
+# 再接続時は Last-Event-ID 以降のイベントを店舗ごとのリングバッファから再送する。
+# ※ プロセス内のバスなので、複数ワーカー構成では同じワーカーに届いたイベントのみ配信される。
+import itertools
+import json
+import logging
+import queue
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SUBSCRIBER_BUFFER = 100   # 購読者ごとの未送信イベントの上限
+DEFAULT_REPLAY_SIZE = 200         # 店舗ごとに再送用に保持するイベント数
+DEFAULT_HEARTBEAT_SECONDS = 15.0
+
+
+class Subscription:
+    def __init__(self, bus, store_id, max_buffer):
+        self.bus = bus
+        self.store_id = store_id
+        self.queue = queue.Queue(maxsize=max_buffer)
+        self.overflowed = False  # バッファがあふれた購読者は切断して再接続させる
+
+    def get(self, timeout):
+        """次のイベントを返す。timeout 秒以内になければ None。"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.bus._unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class OrderEventBus:
+    def __init__(self, subscriber_buffer=DEFAULT_SUBSCRIBER_BUFFER, replay_size=DEFAULT_REPLAY_SIZE):
+        self.subscriber_buffer = subscriber_buffer
+        self.replay_size = replay_size
+        self._ids = itertools.count(1)
+        self._last_id = 0
+        self._lock = threading.Lock()
+        self._subscribers = {}  # store_id -> set(Subscription)
+        self._history = {}      # store_id -> deque(イベント)
+        self._listeners = []    # publish のたびに同期で呼ぶ関数（待ち時間の見積もりなど）
+
+    def publish(self, store_id, event_type, data):
+        with self._lock:
+            event = {'id': next(self._ids), 'type': event_type, 'data': data}
+            self._last_id = event['id']
+            history = self._history.setdefault(store_id, deque(maxlen=self.replay_size))
+            history.append(event)
+            subscribers = list(self._subscribers.get(store_id, ()))
+        for sub in subscribers:
+            try:
+                sub.queue.put_nowait(event)
+            except queue.Full:
+                sub.overflowed = True
+        # publish はコミット後に呼ばれるので、リスナーの失敗で注文・ステータス変更のリクエストを失敗させない
+        # （他のリスナーにも届ける。リスナー側の状態は各自で読み直す）
+        for listener in self._listeners:
+            try:
+                listener(store_id, event_type, data)
+            except Exception:
+                logger.exception(f"注文イベントのリスナーでエラーが発生しました: {event_type} (店舗 {store_id})")
+        return event
+
+    def add_listener(self, func):
+        """func(store_id, event_type, data) を publish のたびに呼ぶ"""
+        if func not in self._listeners:  # create_app() が複数回呼ばれても重複させない
+            self._listeners.append(func)
+
+    def subscribe(self, store_id, last_event_id=None):
+        """購読を開始する。戻り値は (Subscription, 再送するイベントのリスト or None)。
+
+        再送に必要なイベントがすでにバッファから消えている場合は None を返すので、
+        呼び出し側は画面全体を読み直させる。
+        """
+        sub = Subscription(self, store_id, self.subscriber_buffer)
+        with self._lock:
+            self._subscribers.setdefault(store_id, set()).add(sub)
+            history = list(self._history.get(store_id, ()))
+            last_id = self._last_id
+        if last_event_id is None:
+            return sub, []
+        if last_event_id > last_id:
+            return sub, None  # サーバーが再起動してIDが振り直された
+        if len(history) == self.replay_size and history[0]['id'] > last_event_id:
+            return sub, None  # 取りこぼしたイベントがバッファから消えている
+        return sub, [event for event in history if event['id'] > last_event_id]
+
+    def _unsubscribe(self, sub):
+        with self._lock:
+            subscribers = self._subscribers.get(sub.store_id)
+            if subscribers:
+                subscribers.discard(sub)
+                if not subscribers:
+                    del self._subscribers[sub.store_id]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
+
+
+order_events = OrderEventBus()
+
+
+def init_app(app):
+    app.config.setdefault('ORDER_EVENTS_SUBSCRIBER_BUFFER', DEFAULT_SUBSCRIBER_BUFFER)
+    app.config.setdefault('ORDER_EVENTS_REPLAY_SIZE', DEFAULT_REPLAY_SIZE)
+    app.config.setdefault('ORDER_EVENTS_HEARTBEAT_SECONDS', DEFAULT_HEARTBEAT_SECONDS)
+    order_events.subscriber_buffer = app.config['ORDER_EVENTS_SUBSCRIBER_BUFFER']
+    order_events.replay_size = app.config['ORDER_EVENTS_REPLAY_SIZE']
+
+
+def format_sse(event):
+    """イベントを text/event-stream の1メッセージにする"""
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
@@ -0,0 +1,63 @@
+# services/order_status.py
+# --- 注文ステータスの変更 ---
+# 店舗の注文のステータスを1件または複数件まとめて変更する。
+# 対象の注文は店舗の ID で絞り込んでから読み、UPDATE は executemany 1回で行い、
+# 履歴・所要時間の集計・売上集計・顧客履歴への反映も同じトランザクションで行う（コミットは呼び出し側）。
+from services import order_status_log, sales_rollup, store_customers
+from services.store_orders import ACTIVE_STATUSES, CLOSED_STATUSES
+
+VALID_STATUSES = ACTIVE_STATUSES + CLOSED_STATUSES
+
+# 1回で変更できる注文の数（SQLite のプレースホルダ数の上限より十分小さくする）
+MAX_BATCH_SIZE = 200
+
+ORDERS_SQL = """
+    SELECT order_id, status, datetime
+    FROM orders
+    WHERE store_id = ? AND order_id IN ({placeholders})
+"""
+
+
+def change_status(conn, store_id, order_ids, new_status):
+    """店舗の注文のステータスを new_status に変更し、変更した注文を返す。
+
+    戻り値は (変更した注文 [{'id', 'status', 'previous_status'}], すでに new_status だった注文の ID,
+    見つからない（他の店舗のものを含む）注文の ID)。
+    """
+    if new_status not in VALID_STATUSES:
+        raise ValueError(f"無効なステータスです: {new_status}")
+    order_ids = list(dict.fromkeys(order_ids))  # 重複を除く（順序は保つ）
+    if not order_ids:
+        return [], [], []
+    if len(order_ids) > MAX_BATCH_SIZE:
+        raise ValueError(f"一度に変更できる注文は {MAX_BATCH_SIZE} 件までです")
+
+    placeholders = ', '.join('?' * len(order_ids))
+    rows = {row['order_id']: row
+            for row in conn.execute(ORDERS_SQL.format(placeholders=placeholders), [store_id] + order_ids)}
+    changes = []
+    unchanged = []
+    not_found = []
+    for order_id in order_ids:
+        row = rows.get(order_id)
+        if row is None:
+            not_found.append(order_id)
+        elif row['status'] == new_status:
+            unchanged.append(order_id)
+        else:
+            changes.append((order_id, store_id, row['status'], new_status, row['datetime']))
+    if not changes:
+        return [], unchanged, not_found
+
+    conn.executemany("UPDATE orders SET status = ? WHERE order_id = ? AND store_id = ?",
+                     [(new_status, order_id, store_id) for order_id, *_ in changes])
+    # ステータスの履歴と段階ごとの所要時間
+    order_status_log.record_transitions(conn, changes)
+    # キャンセル（またはその取り消し）を売上集計・顧客履歴に反映（キャンセルが絡まない変更では何もしない）
+    for order_id, _, old_status, _, _ in changes:
+        sales_rollup.apply_status_change(conn, order_id, old_status, new_status)
+        store_customers.apply_status_change(conn, order_id, old_status, new_status)
+
+    changed = [{'id': order_id, 'status': new_status, 'previous_status': old_status}
+               for order_id, _, old_status, _, _ in changes]
+    return changed, unchanged, not_found
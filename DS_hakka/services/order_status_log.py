@@ -0,0 +1,183 @@
+# services/order_status_log.py
+# --- 注文ステータスの履歴と段階ごとの所要時間 ---
+# 注文の作成・ステータス変更を order_status_log に追記し、同じトランザクション内で
+# 抜けた段階の所要時間を 店舗×時間帯×段階 の集計（件数・合計・ヒストグラム）に加算する。
+# 店舗ホームは注文数によらず、この集計の決まった行数だけを読んで平均とパーセンタイルを出す。
+import datetime
+
+# 所要時間を数える段階（完了・キャンセルは終点なので数えない）
+STAGES = ['注文受付中', '受付完了', '商品作成中', '作成直前', '受け取り待ち']
+
+# ヒストグラムの上限（秒）。最後のバケットはそれより長いもの
+DURATION_BUCKETS = (30, 60, 120, 180, 300, 450, 600, 900, 1200, 1800, 2700, 3600, 5400, 7200, 10800)
+
+TIMELINE_SQL = """
+    SELECT status, updated_at
+    FROM order_status_log
+    WHERE order_id = ?
+    ORDER BY status_id
+"""
+
+LAST_STATUS_SQL = """
+    SELECT status, updated_at
+    FROM order_status_log
+    WHERE order_id = ?
+    ORDER BY status_id DESC
+    LIMIT 1
+"""
+
+STATS_SQL = """
+    SELECT hour, stage, sample_count, total_seconds
+    FROM stage_duration_stats
+    WHERE store_id = ?
+"""
+
+BUCKETS_SQL = """
+    SELECT hour, stage, bucket, sample_count
+    FROM stage_duration_buckets
+    WHERE store_id = ?
+"""
+
+
+def _parse(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(str(value))
+
+
+def _bucket(seconds):
+    for index, bound in enumerate(DURATION_BUCKETS):
+        if seconds <= bound:
+            return index
+    return len(DURATION_BUCKETS)
+
+
+def record_created(conn, order_id, status, created_at):
+    """注文の作成時に最初のステータスを記録する。コミットは呼び出し側で行う。"""
+    conn.execute("INSERT INTO order_status_log (order_id, status, updated_at) VALUES (?, ?, ?)",
+                 (order_id, status, str(created_at)))
+
+
+def record_transitions(conn, changes, changed_at=None):
+    """ステータス変更をまとめて記録する。コミットは呼び出し側で行う。
+
+    changes は (order_id, store_id, 変更前のステータス, 変更後のステータス, 注文日時) の並び。
+    ログの追記と所要時間の集計はそれぞれ executemany 1回で書き込む。
+    """
+    changed_at = changed_at or datetime.datetime.now()
+    log_rows = []
+    stats = {}    # (store_id, hour, stage) -> [件数, 合計秒]
+    buckets = {}  # (store_id, hour, stage, bucket) -> 件数
+    pending = {}  # order_id -> この呼び出しで追記する最後の行（同じ注文が2回含まれる場合用）
+    for order_id, store_id, old_status, new_status, order_datetime in changes:
+        if old_status == new_status:
+            continue
+        log_rows.append((order_id, new_status, str(changed_at)))
+        last = pending.get(order_id)
+        pending[order_id] = {'status': new_status, 'updated_at': changed_at}
+        if old_status not in STAGES or new_status == 'canceled':
+            continue  # キャンセルで打ち切られた段階は所要時間に含めない
+
+        if last is None:
+            last = conn.execute(LAST_STATUS_SQL, (order_id,)).fetchone()
+        if last is not None and last['status'] == old_status:
+            entered_at = _parse(last['updated_at'])
+        elif last is None and old_status == STAGES[0]:
+            entered_at = _parse(order_datetime)  # 履歴を記録する前に作成された注文
+        else:
+            continue  # 段階に入った時刻がわからない
+        seconds = max((changed_at - entered_at).total_seconds(), 0.0)
+        key = (store_id, entered_at.hour, old_status)
+        entry = stats.setdefault(key, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        bucket_key = key + (_bucket(seconds),)
+        buckets[bucket_key] = buckets.get(bucket_key, 0) + 1
+
+    if log_rows:
+        conn.executemany("INSERT INTO order_status_log (order_id, status, updated_at) VALUES (?, ?, ?)", log_rows)
+    if stats:
+        conn.executemany("""
+            INSERT INTO stage_duration_stats (store_id, hour, stage, sample_count, total_seconds)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (store_id, hour, stage) DO UPDATE SET
+                sample_count = sample_count + excluded.sample_count,
+                total_seconds = total_seconds + excluded.total_seconds
+        """, [key + tuple(value) for key, value in stats.items()])
+        conn.executemany("""
+            INSERT INTO stage_duration_buckets (store_id, hour, stage, bucket, sample_count)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (store_id, hour, stage, bucket) DO UPDATE SET
+                sample_count = sample_count + excluded.sample_count
+        """, [key + (count,) for key, count in buckets.items()])
+
+
+def get_timeline(conn, order_id):
+    """注文のステータス履歴を、各段階に留まった時間つきで返す"""
+    rows = conn.execute(TIMELINE_SQL, (order_id,)).fetchall()
+    timeline = []
+    for index, row in enumerate(rows):
+        entry = {'status': row['status'], 'at': row['updated_at'], 'seconds': None}
+        if index + 1 < len(rows):
+            entry['seconds'] = (_parse(rows[index + 1]['updated_at']) - _parse(row['updated_at'])).total_seconds()
+        timeline.append(entry)
+    return timeline
+
+
+def _percentile(counts, total, fraction):
+    """ヒストグラムからパーセンタイルを推定する（バケット内は一様とみなして補間）"""
+    target = total * fraction
+    cumulative = 0
+    lower = 0
+    for index, count in enumerate(counts):
+        upper = DURATION_BUCKETS[index] if index < len(DURATION_BUCKETS) else None
+        if count and cumulative + count >= target:
+            if upper is None:
+                return float(lower)  # 最後のバケットは上限がないため下限を返す
+            return lower + (upper - lower) * (target - cumulative) / count
+        cumulative += count
+        lower = upper if upper is not None else lower
+    return float(lower)
+
+
+def _summarize(stats, counts):
+    count, total_seconds = stats
+    if not count:
+        return None
+    return {
+        'count': count,
+        'mean': total_seconds / count,
+        'p50': _percentile(counts, count, 0.5),
+        'p90': _percentile(counts, count, 0.9),
+    }
+
+
+def get_stage_stats(conn, store_id, hour=None):
+    """段階ごとの所要時間（秒）の件数・平均・p50・p90 を返す
+
+    戻り値は [{'stage', 'all_day', 'hour'}, ...]。all_day は全時間帯、hour は指定した時間帯の値（なければ None）。
+    読む行数は 時間帯×段階×バケット の数で決まり、注文数によらない。
+    """
+    n_buckets = len(DURATION_BUCKETS) + 1
+    all_day = {stage: [0, 0.0] for stage in STAGES}
+    all_day_counts = {stage: [0] * n_buckets for stage in STAGES}
+    by_hour = {stage: [0, 0.0] for stage in STAGES}
+    by_hour_counts = {stage: [0] * n_buckets for stage in STAGES}
+    for row in conn.execute(STATS_SQL, (store_id,)):
+        if row['stage'] not in all_day:
+            continue
+        all_day[row['stage']][0] += row['sample_count']
+        all_day[row['stage']][1] += row['total_seconds']
+        if row['hour'] == hour:
+            by_hour[row['stage']] = [row['sample_count'], row['total_seconds']]
+    for row in conn.execute(BUCKETS_SQL, (store_id,)):
+        if row['stage'] not in all_day:
+            continue
+        all_day_counts[row['stage']][row['bucket']] += row['sample_count']
+        if row['hour'] == hour:
+            by_hour_counts[row['stage']][row['bucket']] = row['sample_count']
+    return [{
+        'stage': stage,
+        'all_day': _summarize(all_day[stage], all_day_counts[stage]),
+        'hour': _summarize(by_hour[stage], by_hour_counts[stage]),
+    } for stage in STAGES]
@@ -0,0 +1,236 @@
+# services/order_writer.py
+# --- 注文の書き込み（単一ライター・グループコミット） ---
+# 注文確定のリクエストは注文を自分でコミットせず、このキューに渡して注文IDが返るのを待つ。
+# プロセスに1つの書き込みスレッドが、たまった注文をまとめて1つのトランザクション（BEGIN IMMEDIATE）で書き込み、
+# コミットしてから各リクエストに注文IDを返す。
+#   ・リクエストのスレッド同士が SQLite の書き込みロックを取り合わない（ロックを取るのはこのスレッドだけ）
+#   ・コミット（WAL への書き出し）が注文ごとではなくまとめて1回になる
+# まとめる件数は ORDER_WRITER_MAX_BATCH 件まで、最初の注文が来てから待つのは ORDER_WRITER_MAX_DELAY_MS まで。
+# 既定（0ms）では待たず、前のトランザクションを書いている間にたまった注文をまとめる
+# （同時に注文が多いほど1回の件数が増える。synchronous = FULL などでコミットが重い環境では少し待たせるとよい）。
+# 1件の注文の失敗（制約違反など）で同じ回の他の注文が巻き戻らないよう、注文ごとに SAVEPOINT を使う。
+# ORDER_WRITER_ENABLED = False ならキューを使わず、呼び出したスレッドでそのまま書き込む。
+import collections
+import logging
+import sqlite3
+import threading
+import time
+
+from services import order_status_log, sales_rollup, store_customers
+from services.database import get_db_connection
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'ORDER_WRITER_ENABLED': True,
+    'ORDER_WRITER_MAX_BATCH': 64,          # 1回のトランザクションで書き込む注文の最大数
+    'ORDER_WRITER_MAX_DELAY_MS': 0.0,      # 最初の注文が来てから、ほかの注文を待ってまとめる最大時間
+    'ORDER_WRITER_TIMEOUT_SECONDS': 10.0,  # リクエストが書き込みを待つ最大時間
+}
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class OrderWriteTimeout(sqlite3.OperationalError):
+    """書き込みを待ちきれなかった（注文は書き込まれていない）"""
+
+
+class NewOrder:
+    """書き込む注文。items は [(menu_id, 数量, 単価), ...]。"""
+
+    def __init__(self, user_id, store_id, status, payment_method, total_amount, items, created_at):
+        self.user_id = user_id
+        self.store_id = store_id
+        self.status = status
+        self.payment_method = payment_method
+        self.total_amount = total_amount
+        self.items = items
+        self.created_at = created_at
+        self.order_id = None
+        self.error = None
+        self.enqueued_at = None
+        self.done = threading.Event()
+
+
+def insert_order(conn, order):
+    """注文・明細・ステータス履歴・売上集計・顧客履歴を書き込み、注文IDを返す。コミットは呼び出し側で行う。"""
+    cursor = conn.execute("""
+        INSERT INTO orders (user_id, store_id, status, datetime, payment_method, total_amount)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (order.user_id, order.store_id, order.status, order.created_at, order.payment_method, order.total_amount))
+    order_id = cursor.lastrowid
+    # ステータスの履歴（段階ごとの所要時間の起点）
+    order_status_log.record_created(conn, order_id, order.status, order.created_at)
+    conn.executemany("""
+        INSERT INTO order_items (order_id, menu_id, quantity, price_at_order)
+        VALUES (?, ?, ?, ?)
+    """, [(order_id,) + tuple(item) for item in order.items])
+    # 店舗ホーム用の売上集計・顧客履歴も同じトランザクションで更新
+    sales_rollup.record_order(conn, order.store_id, order.created_at, order.total_amount,
+                              [tuple(item) for item in order.items])
+    store_customers.record_order(conn, order.store_id, order.user_id, order.created_at, order.total_amount)
+    return order_id
+
+
+def write_batch(conn, orders):
+    """注文をまとめて1つのトランザクションで書き込む。結果は各注文の order_id / error に入れる。"""
+    start = time.perf_counter()
+    try:
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")  # 書き込みロックを最初に取る（途中でロック待ちの失敗をしない）
+        for order in orders:
+            conn.execute("SAVEPOINT new_order")
+            try:
+                order.order_id = insert_order(conn, order)
+            except sqlite3.Error as e:
+                conn.execute("ROLLBACK TO new_order")
+                order.error = e
+            conn.execute("RELEASE new_order")
+        conn.commit()
+    except Exception as e:
+        # ロックを取れない・コミットできない・想定外の例外など、まとめて失敗した。
+        # どの例外でも巻き戻し、書きかけの注文と書き込みロックを次の回に持ち越さない
+        if conn.in_transaction:
+            conn.rollback()
+        if not isinstance(e, sqlite3.Error):
+            logger.exception("注文の書き込み中に想定外のエラーが発生しました")
+            e = sqlite3.OperationalError(str(e))
+        for order in orders:
+            order.order_id = None
+            order.error = order.error or e
+    return time.perf_counter() - start
+
+
+class OrderWriter:
+    def __init__(self):
+        self.settings = dict(DEFAULT_SETTINGS)
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self.batches = 0
+        self.orders = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.largest_batch = 0
+        self.last_commit_seconds = 0.0
+
+    def configure(self, **settings):
+        self.settings.update(settings)
+
+    def submit(self, order):
+        """注文を書き込み、注文IDを返す。書き込めなかった場合は sqlite3.Error を送出する。"""
+        if not self.settings['ORDER_WRITER_ENABLED']:
+            self._record([order], write_batch(get_db_connection(), [order]))
+            return self._result(order)
+
+        self._ensure_started()
+        with self._cond:
+            order.enqueued_at = time.perf_counter()
+            self._queue.append(order)
+            self._cond.notify()
+        if not order.done.wait(self.settings['ORDER_WRITER_TIMEOUT_SECONDS']):
+            with self._cond:
+                waiting = order in self._queue
+                if waiting:
+                    self._queue.remove(order)
+                    self.timeouts += 1
+            if waiting:
+                raise OrderWriteTimeout("注文の書き込みを待ちきれませんでした")
+            order.done.wait()  # 書き込み中なので、終わるのを待つ（二重に注文させない）
+        return self._result(order)
+
+    def stats(self):
+        with self._cond:
+            depth = len(self._queue)
+        return {
+            'queue_depth': depth,
+            'batches': self.batches,
+            'orders': self.orders,
+            'failed': self.failed,
+            'timeouts': self.timeouts,
+            'largest_batch': self.largest_batch,
+            'average_batch': (self.orders + self.failed) / self.batches if self.batches else 0.0,
+            'last_commit_ms': round(self.last_commit_seconds * 1000, 2),
+        }
+
+    # --- 内部処理 ---
+
+    def _result(self, order):
+        if order.error is not None:
+            raise order.error
+        return order.order_id
+
+    def _ensure_started(self):
+        # fork 後の子プロセスで初めて注文を受けたときに、そのプロセスのスレッドを立ち上げる
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='order-writer', daemon=True)
+                self._thread.start()
+
+    def _next_batch(self):
+        """注文がたまるまで待ち、MAX_BATCH 件そろうか最初の注文から MAX_DELAY_MS 経ったら取り出す"""
+        max_batch = self.settings['ORDER_WRITER_MAX_BATCH']
+        max_delay = self.settings['ORDER_WRITER_MAX_DELAY_MS'] / 1000
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            deadline = self._queue[0].enqueued_at + max_delay
+            while len(self._queue) < max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 or not self._queue:
+                    break
+                self._cond.wait(remaining)
+            return [self._queue.popleft() for _ in range(min(max_batch, len(self._queue)))]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue  # 待っている間にすべてタイムアウトした
+            try:
+                seconds = write_batch(get_db_connection(), batch)
+                self._record(batch, seconds)
+            except Exception as e:
+                logger.exception("注文の書き込みスレッドでエラーが発生しました")
+                self._rollback()
+                for order in batch:
+                    order.order_id, order.error = None, order.error or sqlite3.OperationalError(str(e))
+            finally:
+                for order in batch:
+                    order.done.set()
+
+    def _rollback(self):
+        # 書きかけのトランザクションが残ると、次の回は BEGIN を飛ばしてそれごとコミットしてしまう
+        try:
+            conn = get_db_connection()
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            logger.exception("注文の書き込みスレッドの巻き戻しに失敗しました")
+
+    def _record(self, batch, seconds):
+        failed = sum(1 for order in batch if order.error is not None)
+        self.batches += 1
+        self.orders += len(batch) - failed
+        self.failed += failed
+        self.largest_batch = max(self.largest_batch, len(batch))
+        self.last_commit_seconds = seconds
+        metrics.observe('hakka_order_writer_commit_duration_seconds', '注文をまとめて書き込むトランザクションの所要時間',
+                        (), (), seconds)
+        metrics.observe('hakka_order_writer_batch_size', '1回のトランザクションで書き込んだ注文の数',
+                        (), (), len(batch), buckets=BATCH_SIZE_BUCKETS)
+        now = time.perf_counter()
+        for order in batch:
+            if order.enqueued_at is not None:
+                metrics.observe('hakka_order_writer_wait_duration_seconds', '注文をキューに入れてから書き込まれるまでの時間',
+                                (), (), now - order.enqueued_at)
+
+
+order_writer = OrderWriter()
+
+
+def init_app(app):
+    for key, value in DEFAULT_SETTINGS.items():
+        app.config.setdefault(key, value)
+    order_writer.configure(**{key: app.config[key] for key in DEFAULT_SETTINGS})
@@ -0,0 +1,224 @@
+# services/paypay_gateway.py
+# --- PayPay API 呼び出しの共通窓口 ---
+# paypayopa.Client の呼び出しを上限つきのスレッドプールで実行し、
+# 呼び出しごとの期限（デッドライン）・サーキットブレーカー・レイテンシ計測をまとめて行う。
+# PayPay が遅い／落ちているときも Flask のワーカーが長時間ふさがらないようにする。
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'PAYPAY_MAX_CONCURRENCY': 8,          # 同時に実行する PayPay 呼び出しの数
+    'PAYPAY_MAX_PENDING': 32,             # 実行待ちを含めた呼び出し数の上限（超えたら即エラー）
+    'PAYPAY_CONNECT_TIMEOUT': 3.0,        # HTTP 接続のタイムアウト（秒）
+    'PAYPAY_READ_TIMEOUT': 8.0,           # HTTP 応答待ちのタイムアウト（秒）
+    'PAYPAY_CALL_DEADLINE': 10.0,         # 呼び出し元が待つ最大時間（秒）
+    'PAYPAY_POOL_SIZE': 16,               # keep-alive 接続のプールサイズ
+    'PAYPAY_BREAKER_THRESHOLD': 5,        # 連続失敗がこの回数に達したら遮断
+    'PAYPAY_BREAKER_RESET_SECONDS': 30.0, # 遮断後、試行を再開するまでの秒数
+}
+
+
+class PaymentGatewayError(Exception):
+    """PayPay 呼び出しが完了しなかった場合の例外"""
+
+
+class GatewayUnavailable(PaymentGatewayError):
+    """サーキットブレーカーが開いている（PayPay が不調）"""
+
+
+class GatewayBusy(PaymentGatewayError):
+    """実行待ちの呼び出しが多すぎる"""
+
+
+class GatewayTimeout(PaymentGatewayError):
+    """デッドラインまでに応答がなかった"""
+
+
+def _result_code(response):
+    """PayPay の応答の resultInfo.code（取れなければ None）"""
+    if not isinstance(response, dict):
+        return None
+    return (response.get('resultInfo') or {}).get('code')
+
+
+class CircuitBreaker:
+    """連続失敗で開き、一定時間後に1回だけ試行（half-open）して閉じるか判断する"""
+
+    def __init__(self, threshold, reset_seconds):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+                return True  # 試行は1回だけ通す
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.threshold:
+                if self.state != 'open':
+                    logger.warning("PayPay への呼び出しを一時的に遮断します")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+
+class PaymentGateway:
+    def __init__(self):
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.credentials = {}
+        self._client = None
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self.breaker = CircuitBreaker(self.settings['PAYPAY_BREAKER_THRESHOLD'],
+                                      self.settings['PAYPAY_BREAKER_RESET_SECONDS'])
+        self.metrics = {}  # 操作名 -> 計測値
+
+    def configure(self, credentials=None, **settings):
+        self.settings.update(settings)
+        if credentials is not None:
+            self.credentials = credentials
+        self.breaker.threshold = self.settings['PAYPAY_BREAKER_THRESHOLD']
+        self.breaker.reset_seconds = self.settings['PAYPAY_BREAKER_RESET_SECONDS']
+        self._client = None  # 次の呼び出しで作り直す
+
+    # --- PayPay API ---
+
+    def create_qr_code(self, payload):
+        return self._call('create_qr_code', lambda client, timeout: client.Code.create_qr_code(data=payload, timeout=timeout))
+
+    def get_payment_details(self, merchant_payment_id):
+        return self._call('get_payment_details', lambda client, timeout: client.Code.get_payment_details(merchant_payment_id, timeout=timeout))
+
+    # --- 内部処理 ---
+
+    def _get_client(self):
+        """paypayopa.Client を初回呼び出し時に作成する（keep-alive の Session を共有）"""
+        with self._lock:
+            if self._client is None:
+                import paypayopa
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.settings['PAYPAY_POOL_SIZE'], max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+
+                options = {'base_url': self.credentials['base_url']} if self.credentials.get('base_url') else {}
+                client = paypayopa.Client(
+                    session=session,
+                    auth=(self.credentials.get('api_key'), self.credentials.get('api_secret')),
+                    production_mode=False,  # サンドボックス環境を使用
+                    **options)
+                client.set_assume_merchant(self.credentials.get('merchant_id'))
+                self._client = client
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.settings['PAYPAY_MAX_CONCURRENCY'],
+                                                    thread_name_prefix='paypay')
+                self._slots = threading.BoundedSemaphore(self.settings['PAYPAY_MAX_PENDING'])
+            return self._client
+
+    def _call(self, name, func):
+        # 枠とクライアントを先に確保してからブレーカーに問い合わせる。
+        # allow() が half_open にした後は、どの経路で抜けても成功か失敗を必ず記録する
+        # （記録しないと half_open のままになり、再起動するまで PayPay を呼べなくなる）
+        client = self._get_client()
+        if not self._slots.acquire(blocking=False):
+            self._record(name, 0.0, 'rejected')
+            raise GatewayBusy("PayPay への呼び出しが混み合っています")
+        if not self.breaker.allow():
+            self._slots.release()
+            self._record(name, 0.0, 'rejected')
+            raise GatewayUnavailable("PayPay が一時的に利用できません")
+
+        timeout = (self.settings['PAYPAY_CONNECT_TIMEOUT'], self.settings['PAYPAY_READ_TIMEOUT'])
+        start = time.perf_counter()
+        try:
+            future = self._executor.submit(func, client, timeout)
+            future.add_done_callback(lambda _: self._slots.release())
+        except Exception:
+            self._slots.release()
+            self.breaker.record_failure()
+            self._record(name, time.perf_counter() - start, 'error')
+            raise
+        try:
+            result = future.result(timeout=self.settings['PAYPAY_CALL_DEADLINE'])
+        except FutureTimeoutError:
+            self.breaker.record_failure()
+            self._record(name, time.perf_counter() - start, 'timeout')
+            raise GatewayTimeout(f"PayPay {name} が {self.settings['PAYPAY_CALL_DEADLINE']} 秒以内に応答しませんでした")
+        except Exception:
+            self.breaker.record_failure()
+            self._record(name, time.perf_counter() - start, 'error')
+            raise
+        # paypayopa は 5xx などのエラー応答も例外にせず JSON のまま返すので、resultInfo で判定する
+        # （応答は呼び出し元に返し、RATE_LIMIT などの扱いは呼び出し元で決める）
+        if _result_code(result) == 'SUCCESS':
+            self.breaker.record_success()
+            self._record(name, time.perf_counter() - start, 'ok')
+        else:
+            self.breaker.record_failure()
+            self._record(name, time.perf_counter() - start, 'error')
+        return result
+
+    def _record(self, name, elapsed, outcome):
+        with self._lock:
+            m = self.metrics.setdefault(name, {
+                'calls': 0, 'ok': 0, 'error': 0, 'timeout': 0, 'rejected': 0,
+                'total_seconds': 0.0, 'max_seconds': 0.0,
+            })
+            m['calls'] += 1
+            m[outcome] += 1
+            m['total_seconds'] += elapsed
+            m['max_seconds'] = max(m['max_seconds'], elapsed)
+        metrics.observe_outbound('paypay', name, outcome, elapsed)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'breaker': self.breaker.state,
+                'operations': {name: dict(m) for name, m in self.metrics.items()},
+            }
+
+
+paypay_gateway = PaymentGateway()
+
+
+def init_app(app):
+    for key, value in DEFAULT_SETTINGS.items():
+        app.config.setdefault(key, value)
+    app.config.setdefault('PAYPAY_API_KEY', os.environ.get('API_KEY'))
+    app.config.setdefault('PAYPAY_API_SECRET', os.environ.get('API_SECRET'))
+    app.config.setdefault('PAYPAY_MERCHANT_ID', os.environ.get('MERCHANT_ID'))
+    # ローカルの代替サーバー（services/fake_paypay.py）を使う場合に指定
+    app.config.setdefault('PAYPAY_BASE_URL', os.environ.get('PAYPAY_BASE_URL'))
+    paypay_gateway.configure(
+        credentials={
+            'api_key': app.config['PAYPAY_API_KEY'],
+            'api_secret': app.config['PAYPAY_API_SECRET'],
+            'merchant_id': app.config['PAYPAY_MERCHANT_ID'],
+            'base_url': app.config['PAYPAY_BASE_URL'],
+        },
+        **{key: app.config[key] for key in DEFAULT_SETTINGS})
@@ -0,0 +1,229 @@
+# services/paypay_poller.py
+# --- PayPay 決済ステータスのバックグラウンドポーリング ---
+# ブラウザごとに PayPay へ問い合わせるのをやめ、サーバー側の1スレッドが
+# 未確定の merchantPaymentId をまとめてポーリングして結果をキャッシュする。
+# order_status はキャッシュを読むだけなので、同じ決済を何人・何回確認しても
+# PayPay への問い合わせは1間隔につき最大1回になる。
+import logging
+import threading
+import time
+
+from services.paypay_gateway import paypay_gateway, PaymentGatewayError
+
+logger = logging.getLogger(__name__)
+
+# これ以上変化しないステータス（ポーリングを止める）
+FINAL_STATUSES = {'COMPLETED', 'FAILED', 'CANCELED', 'EXPIRED', 'REFUNDED'}
+
+DEFAULT_SETTINGS = {
+    'PAYPAY_POLL_INTERVAL': 2.0,          # 最初のポーリング間隔（秒）
+    'PAYPAY_POLL_MAX_INTERVAL': 10.0,     # 変化がない場合に伸ばす上限
+    'PAYPAY_POLL_BACKOFF': 1.5,           # 変化がないたびに間隔に掛ける倍率
+    'PAYPAY_RATE_LIMIT_BACKOFF': 5.0,     # RATE_LIMIT を受けたときに全体を止める秒数（連続で倍増）
+    'PAYPAY_MAX_CALLS_PER_SECOND': 5.0,   # PayPay への問い合わせの上限
+    'PAYPAY_STATUS_TTL': 30.0,            # キャッシュした未確定のステータスの有効期間（確定したものは期限切れにしない）
+    'PAYPAY_POLL_IDLE_TIMEOUT': 600.0,    # これだけ参照されなかった決済は追跡をやめる
+    'PAYPAY_POLL_MAX_TRACKED': 1000,      # 追跡する決済の上限（超えたら参照の古いものから外す）
+}
+
+
+class PaymentStatusPoller:
+    def __init__(self, fetch=None, **settings):
+        self.fetch = fetch  # merchant_payment_id -> ステータス文字列（init_app で fetch_payment_details を設定）
+        self.settings = dict(DEFAULT_SETTINGS, **settings)
+        self._tracked = {}  # merchant_payment_id -> 状態
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stopped = False
+        self._paused_until = 0.0
+        self._rate_limit_streak = 0
+        self.upstream_calls = 0
+        self.rate_limited = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def configure(self, **settings):
+        self.settings.update(settings)
+
+    def track(self, merchant_payment_id):
+        """ポーリング対象に追加する（追加済みなら参照時刻だけ更新）
+
+        追加するのは QR コードを作成した決済だけ（create_qr から呼ぶ）。
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._tracked.get(merchant_payment_id)
+            if entry is None:
+                if len(self._tracked) >= self.settings['PAYPAY_POLL_MAX_TRACKED']:
+                    self._evict()
+                entry = self._tracked[merchant_payment_id] = {
+                    'status': None, 'updated_at': None, 'last_access': now,
+                    'next_poll': now, 'interval': self.settings['PAYPAY_POLL_INTERVAL'],
+                }
+                self._wakeup.set()
+            entry['last_access'] = now
+        self._ensure_started()
+        return entry
+
+    def get_status(self, merchant_payment_id):
+        """キャッシュされたステータスを返す。追跡していない・まだ取得していない・期限切れの場合は None。
+
+        キャッシュを読むだけで、追跡していない決済をポーリング対象に加えることはしない
+        （ログインなしで呼ばれるので、でたらめな ID で PayPay への問い合わせ枠を使い切られないようにする）。
+        COMPLETED などの確定したステータスはポーリングを止めて二度と更新されないため、期限切れにしない
+        （決済後にしばらくしてアプリから戻ってきた利用者にも COMPLETED を返し、注文を確定させる）。
+        """
+        with self._lock:
+            entry = self._tracked.get(merchant_payment_id)
+            if entry is not None:
+                entry['last_access'] = time.monotonic()
+        if entry is None:
+            self.cache_misses += 1
+            return None
+        if entry['status'] in FINAL_STATUSES:
+            self.cache_hits += 1
+            return entry['status']
+        if entry['updated_at'] is None or time.monotonic() - entry['updated_at'] > self.settings['PAYPAY_STATUS_TTL']:
+            self.cache_misses += 1
+            return None
+        self.cache_hits += 1
+        return entry['status']
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+
+    def stats(self):
+        with self._lock:
+            tracked = len(self._tracked)
+        return {'tracked': tracked, 'upstream_calls': self.upstream_calls, 'rate_limited': self.rate_limited,
+                'cache_hits': self.cache_hits, 'cache_misses': self.cache_misses}
+
+    def _evict(self):
+        """上限に達したときに、確定済みのものを優先して参照の最も古い決済を外す（ロックを取った状態で呼ぶ）"""
+        victim = min(self._tracked.items(),
+                     key=lambda item: (item[1]['status'] not in FINAL_STATUSES, item[1]['last_access']))[0]
+        del self._tracked[victim]
+
+    # --- バックグラウンドスレッド ---
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name='paypay-poller', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            merchant_payment_id, wait = self._next_due()
+            if merchant_payment_id is None:
+                self._wakeup.wait(timeout=wait)
+                self._wakeup.clear()
+                continue
+            self._poll(merchant_payment_id)
+            # 問い合わせの間隔を空けて PayPay 側のレート制限に近づかないようにする
+            time.sleep(1.0 / self.settings['PAYPAY_MAX_CALLS_PER_SECOND'])
+
+    def _next_due(self):
+        """次にポーリングする決済IDと、なければ待つ秒数を返す"""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return None, self._paused_until - now
+        with self._lock:
+            # 長く参照されていない決済は追跡をやめる
+            idle = [mid for mid, e in self._tracked.items()
+                    if now - e['last_access'] > self.settings['PAYPAY_POLL_IDLE_TIMEOUT']]
+            for mid in idle:
+                del self._tracked[mid]
+            pending = [(e['next_poll'], mid) for mid, e in self._tracked.items() if e['status'] not in FINAL_STATUSES]
+        if not pending:
+            return None, self.settings['PAYPAY_POLL_MAX_INTERVAL']
+        next_poll, merchant_payment_id = min(pending)
+        if next_poll > now:
+            return None, next_poll - now
+        return merchant_payment_id, 0
+
+    def _poll(self, merchant_payment_id):
+        self.upstream_calls += 1
+        try:
+            status = self.fetch(merchant_payment_id)
+        except Exception:
+            logger.exception(f"{merchant_payment_id} のポーリング中にエラーが発生しました")
+            status = 'FETCH_ERROR'
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._tracked.get(merchant_payment_id)
+            if entry is None:
+                return
+            if status == 'RATE_LIMIT_ERROR':
+                # 全体のポーリングを一時停止し、連続するたびに停止時間を倍にする
+                self.rate_limited += 1
+                self._rate_limit_streak += 1
+                pause = self.settings['PAYPAY_RATE_LIMIT_BACKOFF'] * (2 ** (self._rate_limit_streak - 1))
+                self._paused_until = now + pause
+                entry['next_poll'] = self._paused_until
+                logger.warning(f"PayPay RATE_LIMIT のため {pause:.1f} 秒ポーリングを停止します")
+                return
+            self._rate_limit_streak = 0
+
+            if status == 'FETCH_ERROR':
+                # 前回の結果はそのまま（更新されなければ TTL 切れで PENDING 扱いになる）
+                changed = False
+            else:
+                if status == 'PENDING_NO_DATA':
+                    status = 'PENDING'
+                changed = status != entry['status']
+                entry['status'] = status
+                entry['updated_at'] = now
+            # 変化がなければ間隔を伸ばし、変化があれば元に戻す
+            if changed:
+                entry['interval'] = self.settings['PAYPAY_POLL_INTERVAL']
+            else:
+                entry['interval'] = min(entry['interval'] * self.settings['PAYPAY_POLL_BACKOFF'],
+                                        self.settings['PAYPAY_POLL_MAX_INTERVAL'])
+            entry['next_poll'] = now + entry['interval']
+
+
+payment_poller = PaymentStatusPoller()
+
+
+def fetch_payment_details(merchant_id):
+    """指定されたマーチャントIDの支払い詳細をPayPayから取得するヘルパー関数"""
+    try:
+        resp = paypay_gateway.get_payment_details(merchant_id)
+        logger.debug(f"Fetched payment details for {merchant_id}: {resp}")
+
+        if resp.get('resultInfo', {}).get('code') == 'RATE_LIMIT':
+            logger.warning(f"RATE_LIMIT エラー {merchant_id}。リトライします。")
+            return 'RATE_LIMIT_ERROR'
+
+        if resp.get('data') is None:
+            error_code = resp.get('resultInfo', {}).get('code')
+            error_message = resp.get('resultInfo', {}).get('message')
+            if error_code:
+                logger.warning(f"PayPay APIが {merchant_id} にエラーを返しました: {error_code} - {error_message}。保留または一時的な問題と見なします。")
+            else:
+                logger.warning(f"{merchant_id} の支払い詳細が 'None' データとして返されました。保留または見つからないと見なします。")
+            return 'PENDING_NO_DATA'
+
+        return resp['data']['status']
+    except PaymentGatewayError as e:
+        logger.warning(f"{merchant_id} の支払い詳細を取得できませんでした: {e}")
+        return 'FETCH_ERROR'
+    except Exception as e:
+        logger.exception(f"{merchant_id} の支払い詳細の取得中にエラーが発生しました: {e}")
+        return 'FETCH_ERROR'
+
+
+def init_app(app):
+    for key, value in DEFAULT_SETTINGS.items():
+        app.config.setdefault(key, value)
+    payment_poller.configure(**{key: app.config[key] for key in DEFAULT_SETTINGS})
+    # PayPayへの問い合わせはバックグラウンドのポーラーだけが行う
+    payment_poller.fetch = fetch_payment_details
@@ -0,0 +1,46 @@
+# services/prep_items.py
+# --- キッチン表示（作る商品の数の集計） ---
+# 店舗ごとに「完了・キャンセル前の注文に含まれる商品の数」をメニューごとに区分けして返す。
+# 数量は対応中の注文の投影（services/open_orders.py）が メニュー×ステータス のカウンタとして
+# 注文イベントで加減算しているものを読むだけなので、対応中の注文数ではなくメニュー数に比例する。
+from services.open_orders import open_orders
+from services.store_orders import ACTIVE_STATUSES
+
+# 表示する区分（ステータス -> 区分）
+WAITING_STATUSES = ('注文受付中', '受付完了')
+PREPARING_STATUSES = ('商品作成中', '作成直前')
+READY_STATUSES = ('受け取り待ち',)
+
+
+def get_board(store_id, menus_by_id):
+    """メニューごとの数量を、まだ作っていない数の多い順に返す
+
+    menus_by_id は menu_cache の by_id（メニュー名・カテゴリの表示用）。
+    """
+    counts, open_count = open_orders.item_counts(store_id)
+    items = []
+    for menu_id, row in counts.items():
+        by_status = dict(zip(ACTIVE_STATUSES, row))
+        waiting = sum(by_status[s] for s in WAITING_STATUSES)
+        preparing = sum(by_status[s] for s in PREPARING_STATUSES)
+        ready = sum(by_status[s] for s in READY_STATUSES)
+        if not (waiting or preparing or ready):
+            continue
+        menu = menus_by_id.get(menu_id) or {}
+        items.append({
+            'menu_id': menu_id,
+            'menu_name': menu.get('menu_name', '(削除済み)'),
+            'category': menu.get('category'),
+            'waiting': waiting,
+            'preparing': preparing,
+            'ready': ready,
+            'to_make': waiting + preparing,
+            'by_status': by_status,
+        })
+    items.sort(key=lambda item: (-item['to_make'], -item['ready'], item['menu_id']))
+    return {
+        'store_id': store_id,
+        'open_orders': open_count,
+        'to_make': sum(item['to_make'] for item in items),
+        'items': items,
+    }
@@ -0,0 +1,208 @@
+# services/profiler.py
+# --- リクエスト単位のサンプリングプロファイラ ---
+# 特定の店舗・ユーザーでだけ遅いページを本番で調べるためのもの。
+# 次のどちらかのリクエストだけ、処理中の呼び出しスタックとその実行時間を記録する
+# （テンプレートの描画やセッションの保存も含む）。
+#   ・ヘッダ X-Profile-Token に PROFILER_TOKEN と同じ値を付けたリクエスト（管理者用）
+#   ・PROFILER_SAMPLE_RATE の割合で無作為に選んだリクエスト
+# 結果は flamegraph.pl / speedscope でそのまま読める folded 形式（"a;b;c マイクロ秒"）で
+# PROFILER_DIR に「日時_エンドポイント.folded」として保存し、/_profiles に一覧を表示する。
+import hmac
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from flask import abort, current_app, g, render_template, request, send_from_directory
+
+DEFAULT_SETTINGS = {
+    'PROFILER_TOKEN': None,          # None なら環境変数 PROFILER_TOKEN。未設定ならヘッダでの指定と一覧ページは無効
+    'PROFILER_SAMPLE_RATE': None,    # 0〜1。None なら環境変数 PROFILER_SAMPLE_RATE（未設定なら 0）
+    'PROFILER_DIR': os.path.join(tempfile.gettempdir(), 'ds_hakka_profiles'),
+    'PROFILER_KEEP': 100,            # 保存しておく件数（古いものから削除）
+}
+
+INDEX_FILE = 'index.jsonl'
+
+
+class CallStackProfiler:
+    """sys.setprofile で呼び出し・戻りを記録し、呼び出しスタックごとの自身の実行時間（マイクロ秒）を集計する。
+
+    別スレッドからスタックを採取する方式は GIL の切り替え間隔（5ms）より細かく採れず、
+    数ms で終わるリクエストではほとんど何も残らないため、対象のリクエストの間だけ全呼び出しを記録する。
+    """
+
+    def __init__(self, root=None):
+        self.root = root  # このディレクトリ以下のファイル名は相対パスで表示する
+        self.stacks = {}  # folded 形式のスタック -> 秒
+        self.calls = 0
+        self._keys = []
+        self._labels = {}
+        self._last = 0.0
+
+    def start(self, frame):
+        # 計測開始時点の呼び出し元を積んでおき、戻りのイベントで正しく取り出せるようにする
+        chain = []
+        while frame is not None:
+            chain.append(self._label(frame.f_code))
+            frame = frame.f_back
+        for label in reversed(chain):
+            self._keys.append(f"{self._keys[-1]};{label}" if self._keys else label)
+        self._last = time.perf_counter()
+        sys.setprofile(self._callback)
+
+    def stop(self):
+        sys.setprofile(None)
+        self._account(time.perf_counter())
+        return {key: int(seconds * 1_000_000) for key, seconds in self.stacks.items() if seconds >= 0.000001}
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            if isinstance(code, str):
+                label = code  # C 関数
+            else:
+                filename = code.co_filename
+                if self.root and filename.startswith(self.root):
+                    filename = os.path.relpath(filename, self.root)
+                else:
+                    filename = os.path.join(*filename.split(os.sep)[-2:])
+                label = f"{code.co_name} ({filename}:{code.co_firstlineno})"
+            # folded 形式では ';' が区切り文字になるため置き換える
+            label = self._labels[code] = label.replace(';', ':')
+        return label
+
+    def _account(self, now):
+        if self._keys:
+            key = self._keys[-1]
+            self.stacks[key] = self.stacks.get(key, 0.0) + (now - self._last)
+
+    def _callback(self, frame, event, arg):
+        self._account(time.perf_counter())
+        if event == 'call':
+            label = self._label(frame.f_code)
+        elif event == 'c_call':
+            label = self._label(f"{getattr(arg, '__qualname__', repr(arg))} (builtin)")
+        else:  # return / c_return / c_exception
+            if self._keys:
+                self._keys.pop()
+            self._last = time.perf_counter()
+            return
+        self.calls += 1
+        self._keys.append(f"{self._keys[-1]};{label}" if self._keys else label)
+        self._last = time.perf_counter()
+
+
+def _profile_requested():
+    token = current_app.config['PROFILER_TOKEN']
+    header = request.headers.get('X-Profile-Token')
+    if token and header and hmac.compare_digest(header, token):
+        return 'header'
+    rate = current_app.config['PROFILER_SAMPLE_RATE']
+    if rate and random.random() < rate:
+        return 'sampled'
+    return None
+
+
+def start_request():
+    if request.endpoint in ('profiler_index', 'profiler_download', 'static'):
+        return
+    reason = _profile_requested()
+    if reason is None:
+        return
+    profiler = CallStackProfiler(current_app.root_path)
+    g._profiler = (profiler, reason, time.time(), time.perf_counter())
+    profiler.start(sys._getframe())
+
+
+def finish_request(exc=None):
+    entry = g.pop('_profiler', None)
+    if entry is None:
+        return
+    profiler, reason, started_at, start = entry
+    stacks = profiler.stop()
+    elapsed = time.perf_counter() - start
+    try:
+        _save(stacks, profiler.calls, reason, started_at, elapsed)
+    except OSError:
+        current_app.logger.exception("プロファイルの保存に失敗しました")
+
+
+def _save(stacks, calls, reason, started_at, elapsed):
+    directory = current_app.config['PROFILER_DIR']
+    os.makedirs(directory, exist_ok=True)
+    endpoint = request.url_rule.endpoint if request.url_rule else 'unmatched'
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(started_at)) + f"-{int(started_at * 1000) % 1000:03d}"
+    name = f"{stamp}_{endpoint}.folded"
+    with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+        for stack, count in sorted(stacks.items()):
+            f.write(f"{stack} {count}\n")
+
+    record = {'file': name, 'endpoint': endpoint, 'method': request.method, 'path': request.full_path.rstrip('?'),
+              'at': started_at, 'ms': round(elapsed * 1000, 1), 'calls': calls, 'reason': reason}
+    index_path = os.path.join(directory, INDEX_FILE)
+    with open(index_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    _prune(directory)
+
+
+def _prune(directory):
+    keep = current_app.config['PROFILER_KEEP']
+    files = sorted(name for name in os.listdir(directory) if name.endswith('.folded'))
+    for name in files[:-keep]:
+        os.remove(os.path.join(directory, name))
+
+
+def recent_captures(directory, limit):
+    """新しい順に、ファイルが残っているキャプチャの情報を返す"""
+    path = os.path.join(directory, INDEX_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    existing = set(os.listdir(directory))
+    captures = [r for r in reversed(records) if r['file'] in existing][:limit]
+    if len(captures) < len(records):
+        # 削除済みのキャプチャを索引からも取り除く
+        with open(path, 'w', encoding='utf-8') as f:
+            for record in reversed([r for r in records if r['file'] in existing]):
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    return captures
+
+
+def _check_token():
+    token = current_app.config['PROFILER_TOKEN']
+    given = request.headers.get('X-Profile-Token') or request.args.get('token') or ''
+    if not token or not hmac.compare_digest(given, token):
+        abort(404)
+
+
+def profiler_index():
+    _check_token()
+    captures = recent_captures(current_app.config['PROFILER_DIR'], current_app.config['PROFILER_KEEP'])
+    for capture in captures:
+        capture['time'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(capture['at']))
+    return render_template('profiler/profiles.html', captures=captures, token=request.args.get('token', ''))
+
+
+def profiler_download(name):
+    _check_token()
+    return send_from_directory(current_app.config['PROFILER_DIR'], name, mimetype='text/plain', as_attachment=True)
+
+
+def init_app(app):
+    for key, value in DEFAULT_SETTINGS.items():
+        app.config.setdefault(key, value)
+    if not app.config['PROFILER_TOKEN']:
+        app.config['PROFILER_TOKEN'] = os.environ.get('PROFILER_TOKEN')
+    if app.config['PROFILER_SAMPLE_RATE'] is None:
+        app.config['PROFILER_SAMPLE_RATE'] = float(os.environ.get('PROFILER_SAMPLE_RATE') or 0)
+    if not app.config['PROFILER_TOKEN'] and not app.config['PROFILER_SAMPLE_RATE']:
+        return  # 無効（フックも登録しない）
+
+    app.before_request(start_request)
+    app.teardown_request(finish_request)
+    app.add_url_rule('/_profiles', 'profiler_index', profiler_index)
+    app.add_url_rule('/_profiles/<path:name>', 'profiler_download', profiler_download)
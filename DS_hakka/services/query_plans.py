@@ -0,0 +1,101 @@
+# services/query_plans.py
+# --- ホットパスのクエリの実行計画チェック ---
+# ルートで実行している主なクエリに EXPLAIN QUERY PLAN をかけ、
+# インデックスを使わずテーブル全体を走査（SCAN）しているものを検出する。
+# クエリはルート・サービスのモジュール定数を参照するので、ルート側の変更はそのまま反映される。
+import re
+
+from routes.stores import store
+from routes.stores_detail import stores_detail
+from routes.users_home import users_home
+from routes.users_login import users_login
+from services import geocoding, menu_cache, menu_import_jobs, open_orders, order_status, order_status_log, sales_analytics, sales_rollup, session_store, store_customers, store_locator, store_orders, user_orders, wait_times
+
+# 名前: (SQL, 全件走査を許可するテーブル/別名)
+HOT_QUERIES = {
+    'users_login.login': (users_login.LOGIN_SQL, ()),
+    'users_login.re_enrollment': (users_login.USER_BY_EMAIL_SQL, ()),
+    'store.store_login': (store.STORE_LOGIN_SQL, ()),
+    'users_home.home': (users_home.STORES_SQL, ('store',)),  # 店舗一覧は全件表示が仕様
+    'users_home.map_shop_stores': (store_locator.BBOX_SQL, ('r',)),  # r は R*Tree の仮想テーブル（インデックスで検索される）
+    'users_home.payment_history': (
+        user_orders.HISTORY_PAGE_SQL.format(cursor_filter=store_orders.CURSOR_FILTER), ()),
+    'users_home.details_payment_history': (users_home.PAYMENT_DETAILS_SQL, ()),
+    'users_home.users_data': (users_home.USER_DATA_SQL, ()),
+    'menu_cache.store': (menu_cache.STORE_SQL, ()),
+    'menu_cache.version': (menu_cache.VERSION_SQL, ()),
+    'menu_cache.menus': (menu_cache.MENUS_SQL, ()),
+    'stores_detail.store_home.product_sales': (sales_rollup.PRODUCT_SALES_SQL, ()),
+    'stores_detail.store_home.daily': (sales_rollup.DAILY_SALES_SQL, ()),
+    'stores_detail.store_home.monthly': (sales_rollup.MONTHLY_SALES_SQL, ()),
+    'sales_analytics.version': (sales_analytics.VERSION_SQL, ()),
+    'sales_analytics.orders': (
+        sales_analytics.ORDERS_SQL.format(order_filter=sales_analytics.STORE_FILTER), ()),
+    'sales_analytics.orders.new': (
+        sales_analytics.ORDERS_SQL.format(order_filter=sales_analytics.NEW_ORDERS_FILTER), ()),
+    'sales_analytics.item_totals': (
+        sales_analytics.ITEM_TOTALS_SQL.format(order_filter=sales_analytics.STORE_FILTER), ()),
+    'sales_analytics.item_totals.new': (
+        sales_analytics.ITEM_TOTALS_SQL.format(order_filter=sales_analytics.NEW_ORDERS_FILTER), ()),
+    'sales_analytics.menu_names': (sales_analytics.MENU_NAMES_SQL, ()),
+    'stores_detail.menu_registration': (stores_detail.MENU_REGISTRATION_SQL, ()),
+    'stores_detail.menu_check.job': (menu_import_jobs.JOB_SQL, ()),
+    'stores_detail.menu_check.rows': (menu_import_jobs.STAGED_ROWS_SQL, ()),
+    'stores_detail.order_list.active': (
+        store_orders.ORDERS_PAGE_SQL.format(
+            status_filter=store_orders.STATUS_FILTERS['active'],
+            cursor_filter=store_orders.CURSOR_FILTER), ()),
+    'stores_detail.order_list.closed': (
+        store_orders.ORDERS_PAGE_SQL.format(
+            status_filter=store_orders.STATUS_FILTERS['closed'],
+            cursor_filter=store_orders.CURSOR_FILTER), ()),
+    'stores_detail.order_list.items': (
+        store_orders.ORDER_ITEMS_SQL.format(placeholders='?, ?, ?'), ()),
+    'store_customers.summary': (store_customers.SUMMARY_SQL, ()),
+    'store_customers.customer': (store_customers.CUSTOMER_SQL, ()),
+    'store_customers.customer_orders': (store_customers.CUSTOMER_ORDERS_SQL, ()),
+    'store_customers.page.last': (
+        store_customers.CUSTOMERS_PAGE_SQL.format(
+            column='last_order_at', cursor_filter="AND (c.last_order_at, c.user_id) < (?, ?)"), ()),
+    'store_customers.page.visits': (
+        store_customers.CUSTOMERS_PAGE_SQL.format(
+            column='order_count', cursor_filter="AND (c.order_count, c.user_id) < (?, ?)"), ()),
+    'store_customers.page.spend': (
+        store_customers.CUSTOMERS_PAGE_SQL.format(
+            column='total_amount', cursor_filter="AND (c.total_amount, c.user_id) < (?, ?)"), ()),
+    'order_status_log.timeline': (order_status_log.TIMELINE_SQL, ()),
+    'order_status_log.last_status': (order_status_log.LAST_STATUS_SQL, ()),
+    'order_status_log.stats': (order_status_log.STATS_SQL, ()),
+    'order_status_log.buckets': (order_status_log.BUCKETS_SQL, ()),
+    'open_orders.store': (open_orders.OPEN_ORDERS_SQL.format(store_filter="o.store_id = ? AND"), ()),
+    'open_orders.all': (open_orders.OPEN_ORDERS_SQL.format(store_filter=""), ('o',)),  # 起動時に対応中の注文を全件読む
+    'order_status.batch_orders': (order_status.ORDERS_SQL.format(placeholders='?, ?, ?'), ()),
+    'wait_times.stage_means': (wait_times.STAGE_MEANS_SQL, ()),
+    'session_store.session': (session_store.SESSION_SQL, ()),
+    'session_store.cart': (session_store.CART_SQL, ()),
+    'geocoding.cache': (geocoding.CACHE_SQL, ()),
+    'geocoding.next_job': (geocoding.NEXT_JOB_SQL, ()),
+    'stores_detail.store_info': (stores_detail.STORE_INFO_SQL, ()),
+}
+
+_SCAN = re.compile(r'^SCAN (\S+)')
+
+
+def explain(conn, sql):
+    """EXPLAIN QUERY PLAN の detail 列をリストで返す（パラメータはダミー値で埋める）"""
+    params = (1,) * sql.count('?')
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+
+
+def find_table_scans(conn, queries=None):
+    """全件走査が許可されていないテーブルを SCAN しているクエリを {名前: [detail, ...]} で返す"""
+    problems = {}
+    for name, (sql, allowed) in (queries or HOT_QUERIES).items():
+        scans = []
+        for detail in explain(conn, sql):
+            match = _SCAN.match(detail)
+            if match and match.group(1) not in allowed and match.group(1) != 'CONSTANT':
+                scans.append(detail)
+        if scans:
+            problems[name] = scans
+    return problems
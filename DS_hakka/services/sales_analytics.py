@@ -0,0 +1,269 @@
+# services/sales_analytics.py
+# --- 店舗の売上分析 ---
+# 売り上げ予測分析ページ用に、時間帯×曜日のヒートマップ・曜日別の傾向・売れ筋商品・
+# 客単価・週ごとの推移と前週比を集計し、グラフ描画用の JSON にして返す。
+# 店舗のキャンセル以外の注文を一度だけ列ごとの配列（NumPy）に読み込んでプロセス内に持ち、
+# 集計は行ごとのループではなく配列演算（bincount など）で行う。注文明細は商品ごとの合計だけを使うため、
+# 明細の行は読み込まず SQL の GROUP BY で商品ごとに足し合わせたものを持つ。
+# order_versions の番号（注文の確定・キャンセルで sales_rollup が加算する）を一定間隔で確認し、
+# 新しい注文が入っていればその分だけを読み足し、キャンセル（またはその取り消し）があれば全件を読み直す。
+# pandas / NumPy は起動時間を抑えるため、初めて集計するときに読み込む。
+import datetime
+import threading
+import time
+from collections import OrderedDict
+
+from services.database import get_db_connection
+
+# order_filter は全件なら STORE_FILTER、読み足しなら NEW_ORDERS_FILTER
+# （読み足しでは order_id の範囲で検索させるため、store_id 側のインデックスは使わせない）
+STORE_FILTER = "o.store_id = ?"
+NEW_ORDERS_FILTER = "o.order_id > ? AND +o.store_id = ?"
+
+ORDERS_SQL = """
+    SELECT o.order_id, o.datetime, o.total_amount
+    FROM orders AS o
+    WHERE {order_filter} AND o.status != 'canceled'
+"""
+
+ITEM_TOTALS_SQL = """
+    SELECT oi.menu_id, SUM(oi.quantity) AS quantity, SUM(oi.quantity * oi.price_at_order) AS sales
+    FROM orders AS o
+    JOIN order_items AS oi ON oi.order_id = o.order_id
+    WHERE {order_filter} AND o.status != 'canceled'
+    GROUP BY oi.menu_id
+"""
+
+MENU_NAMES_SQL = "SELECT menu_id, menu_name FROM menus WHERE store_id = ?"
+
+VERSION_SQL = "SELECT version, cancel_version FROM order_versions WHERE store_id = ?"
+
+WEEKDAYS = ['月', '火', '水', '木', '金', '土', '日']
+
+DEFAULT_MAX_SIZE = 64
+DEFAULT_VERSION_CHECK_SECONDS = 5.0
+TOP_ITEMS = 10
+WEEKS = 8
+
+
+class SalesAnalytics:
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, version_check_seconds=DEFAULT_VERSION_CHECK_SECONDS):
+        self.max_size = max_size
+        self.version_check_seconds = version_check_seconds
+        self._entries = OrderedDict()  # store_id -> エントリ（LRU順）
+        self._lock = threading.Lock()
+        self._store_locks = {}         # 同じ店舗の読み込みを同時に何度も走らせないためのロック
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0             # 新しい注文だけを読み足した回数
+        self.evictions = 0
+
+    def get(self, store_id, today=None):
+        """店舗の分析結果（JSON にできる辞書）を返す"""
+        today = today or datetime.date.today()
+        now = time.monotonic()
+        # 件数の加算も複数スレッド（別の店舗の読み込み中を含む）から呼ばれるので、self._lock の中で行う
+        with self._lock:
+            entry = self._entries.get(store_id)
+            if entry is not None:
+                self._entries.move_to_end(store_id)
+                if now - entry['checked_at'] < self.version_check_seconds and entry['result_for'] == today:
+                    self.hits += 1
+                    return entry['result']
+            store_lock = self._store_locks.setdefault(store_id, threading.Lock())
+
+        with store_lock:
+            conn = get_db_connection()
+            version = _read_version(conn, store_id)
+            entry = self._entries.get(store_id)
+            if entry is None or entry['cancel_version'] != version[1]:
+                # 初回、または既存の注文のキャンセル・その取り消しがあった
+                counter = 'misses'
+                entry = {'data': load(conn, store_id), 'cancel_version': version[1], 'result_for': None}
+            elif entry['version'] != version[0]:
+                counter = 'refreshes'
+                entry['data'] = load(conn, store_id, entry['data'])
+                entry['result_for'] = None
+            else:
+                counter = 'hits'
+            entry['version'] = version[0]
+            entry['checked_at'] = time.monotonic()
+            if entry['result_for'] != today:
+                # 日付が変わると「直近7日」などの区切りがずれるため、読み込み済みの配列から集計し直す
+                entry['result'] = compute(entry['data'], today)
+                entry['result_for'] = today
+            with self._lock:
+                setattr(self, counter, getattr(self, counter) + 1)
+                self._entries[store_id] = entry
+                self._entries.move_to_end(store_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+            return entry['result']
+
+    def invalidate(self, store_id):
+        with self._lock:
+            self._entries.pop(store_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses + self.refreshes
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'refreshes': self.refreshes,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+sales_analytics = SalesAnalytics()
+
+
+def init_app(app):
+    app.config.setdefault('SALES_ANALYTICS_CACHE_SIZE', DEFAULT_MAX_SIZE)
+    app.config.setdefault('SALES_ANALYTICS_VERSION_CHECK_SECONDS', DEFAULT_VERSION_CHECK_SECONDS)
+    sales_analytics.max_size = app.config['SALES_ANALYTICS_CACHE_SIZE']
+    sales_analytics.version_check_seconds = app.config['SALES_ANALYTICS_VERSION_CHECK_SECONDS']
+
+
+def _read_version(conn, store_id):
+    row = conn.execute(VERSION_SQL, (store_id,)).fetchone()
+    return (row['version'], row['cancel_version']) if row else (0, 0)
+
+
+# --- 読み込み ---
+
+def load(conn, store_id, previous=None):
+    """注文を列ごとの配列に読み込む。previous を渡すと、それより後の注文だけを読み足す。
+
+    注文の日時は 1970-01-01 からの日数（days）と時（hours）にして持つ。
+    """
+    import numpy as np
+    import pandas as pd
+
+    if previous is None:
+        order_filter, params = STORE_FILTER, (store_id,)
+    else:
+        order_filter, params = NEW_ORDERS_FILTER, (previous['last_order_id'], store_id)
+    # 注文と明細の合計を別々に読むと、その間にコミットされた注文が明細側にだけ入ってしまうので、
+    # 1つの読み取りトランザクション（同じスナップショット）で読む
+    own_snapshot = not conn.in_transaction
+    if own_snapshot:
+        conn.execute("BEGIN")
+    try:
+        orders = pd.read_sql_query(ORDERS_SQL.format(order_filter=order_filter), conn, params=params)
+        # datetime は str(datetime.now()) で保存されている（マイクロ秒があるものとないものが混在）
+        stamps = pd.to_datetime(orders['datetime'], format='ISO8601')
+        data = {
+            'days': stamps.to_numpy().astype('datetime64[D]').astype(np.int64),
+            'hours': stamps.dt.hour.to_numpy(dtype=np.int64),
+            'amounts': orders['total_amount'].to_numpy(dtype=np.float64),
+            'last_order_id': int(orders['order_id'].max()) if len(orders) else 0,
+        }
+        item_totals = {row['menu_id']: (row['quantity'], row['sales'])
+                       for row in conn.execute(ITEM_TOTALS_SQL.format(order_filter=order_filter), params)}
+        names = dict(conn.execute(MENU_NAMES_SQL, (store_id,)).fetchall())
+    finally:
+        if own_snapshot:
+            conn.rollback()  # 読み取りだけなので終わらせるだけ
+
+    if previous is not None:
+        for key in ('days', 'hours', 'amounts'):
+            data[key] = np.concatenate([previous[key], data[key]])
+        data['last_order_id'] = max(previous['last_order_id'], data['last_order_id'])
+        for menu_id, (quantity, sales) in previous['item_totals'].items():
+            new_quantity, new_sales = item_totals.get(menu_id, (0, 0))
+            item_totals[menu_id] = (quantity + new_quantity, sales + new_sales)
+    data['item_totals'] = item_totals
+    data['names'] = names
+    return data
+
+
+# --- 集計 ---
+
+def compute(data, today):
+    """load() で読み込んだ配列から分析結果を作る（today を含む週・7日間を直近とする）"""
+    import numpy as np
+
+    amounts, days, hours = data['amounts'], data['days'], data['hours']
+    weekdays = (days + 3) % 7  # 1970-01-01 は木曜日。月曜日を 0 とする
+    today_day = (np.datetime64(today, 'D') - np.datetime64('1970-01-01', 'D')).astype(np.int64)
+
+    # 時間帯×曜日
+    cells = weekdays * 24 + hours
+    heatmap_orders = np.bincount(cells, minlength=7 * 24).reshape(7, 24)
+    heatmap_sales = np.bincount(cells, weights=amounts, minlength=7 * 24).reshape(7, 24)
+
+    # 曜日別（営業日1日あたりの平均も出すため、注文のあった日を曜日ごとに数える）
+    weekday_orders = heatmap_orders.sum(axis=1)
+    weekday_sales = heatmap_sales.sum(axis=1)
+    open_days = np.bincount((np.unique(days) + 3) % 7, minlength=7)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weekday_avg = np.where(open_days > 0, weekday_sales / open_days, 0.0)
+
+    # 週ごとの推移（月曜日始まり。today を含む週まで）
+    this_week = today_day - (today_day + 3) % 7
+    week_index = (days - (days + 3) % 7 - this_week) // 7 + (WEEKS - 1)
+    in_range = (week_index >= 0) & (week_index < WEEKS)
+    weekly_orders = np.bincount(week_index[in_range], minlength=WEEKS)
+    weekly_sales = np.bincount(week_index[in_range], weights=amounts[in_range], minlength=WEEKS)
+
+    # 前週比（today までの直近7日間とその前の7日間）
+    age = today_day - days
+    last7 = (age >= 0) & (age < 7)
+    prev7 = (age >= 7) & (age < 14)
+    last_sales, prev_sales = float(amounts[last7].sum()), float(amounts[prev7].sum())
+
+    # 売れ筋商品・客単価
+    names = data['names']
+    menu_ids = np.fromiter(data['item_totals'].keys(), dtype=np.int64, count=len(data['item_totals']))
+    totals = np.array(list(data['item_totals'].values()), dtype=np.float64).reshape(-1, 2)
+    qty_by_menu, sales_by_menu = totals[:, 0], totals[:, 1]
+    top = np.argsort(-sales_by_menu, kind='stable')[:TOP_ITEMS]
+
+    order_count = len(amounts)
+    return {
+        'generated_for': today.isoformat(),
+        'order_count': order_count,
+        'sales_total': int(amounts.sum()),
+        'heatmap': {
+            'weekdays': WEEKDAYS,
+            'hours': list(range(24)),
+            'orders': heatmap_orders.tolist(),
+            'sales': heatmap_sales.astype(np.int64).tolist(),
+        },
+        'weekday': {
+            'labels': WEEKDAYS,
+            'orders': weekday_orders.tolist(),
+            'sales': weekday_sales.astype(np.int64).tolist(),
+            'average_sales': np.round(weekday_avg).astype(np.int64).tolist(),
+        },
+        'top_items': [
+            {'menu_id': int(menu_ids[i]), 'menu_name': names.get(int(menu_ids[i]), '(削除済み)'),
+             'quantity': int(qty_by_menu[i]), 'sales': int(sales_by_menu[i])}
+            for i in top
+        ],
+        'basket': {
+            'average_amount': round(float(amounts.mean())) if order_count else 0,
+            'median_amount': round(float(np.median(amounts))) if order_count else 0,
+            'average_items': round(float(qty_by_menu.sum()) / order_count, 2) if order_count else 0,
+        },
+        'weekly': {
+            'labels': [str(np.datetime64(int(this_week - 7 * (WEEKS - 1 - i)), 'D')) for i in range(WEEKS)],
+            'orders': weekly_orders.tolist(),
+            'sales': weekly_sales.astype(np.int64).tolist(),
+        },
+        'week_over_week': {
+            'orders': int(last7.sum()),
+            'previous_orders': int(prev7.sum()),
+            'sales': int(last_sales),
+            'previous_sales': int(prev_sales),
+            'sales_change': round((last_sales - prev_sales) / prev_sales * 100, 1) if prev_sales else None,
+        },
+    }
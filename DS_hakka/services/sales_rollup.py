@@ -0,0 +1,155 @@
+# services/sales_rollup.py
+# --- 店舗ホーム用の売上集計（daily_sales / daily_item_sales / item_sales） ---
+# 注文の確定・キャンセル時に、呼び出し側と同じトランザクション内で集計行を加算・減算する。
+# 店舗ホームは orders / order_items を毎回集計せず、この集計テーブルだけを読む。
+# 商品別売上（全期間）は日別の行を合計せず、店舗×商品の合計（item_sales）を読む（店舗の営業日数によらない）。
+import datetime
+
+PRODUCT_SALES_SQL = """
+    SELECT m.menu_name, m.category,
+           MAX(r.price_at_order) AS price_at_order,
+           SUM(r.quantity) AS quantity,
+           SUM(r.sales_amount) AS total_sales
+    FROM item_sales r
+    JOIN menus m ON r.menu_id = m.menu_id
+    WHERE r.store_id = ?
+    GROUP BY m.menu_name, m.category
+    HAVING SUM(r.quantity) > 0
+    ORDER BY total_sales DESC
+"""
+
+DAILY_SALES_SQL = """
+    SELECT COALESCE(SUM(sales_amount), 0) AS daily_sales,
+           COALESCE(SUM(order_count), 0) AS daily_orders
+    FROM daily_sales
+    WHERE store_id = ? AND sales_date = ?
+"""
+
+MONTHLY_SALES_SQL = """
+    SELECT COALESCE(SUM(sales_amount), 0) AS monthly_sales
+    FROM daily_sales
+    WHERE store_id = ? AND sales_date >= ?
+"""
+
+
+def _sales_date(order_datetime):
+    """注文日時（datetime または DB に保存された文字列）を 'YYYY-MM-DD' にする"""
+    if isinstance(order_datetime, datetime.datetime):
+        return order_datetime.date().isoformat()
+    return str(order_datetime)[:10]
+
+
+def record_order(conn, store_id, order_datetime, total_amount, items, sign=1):
+    """注文1件分を集計に加算する（sign=-1 で減算）。
+
+    items は (menu_id, quantity, price_at_order) の並び。コミットは呼び出し側で行う。
+    """
+    sales_date = _sales_date(order_datetime)
+    # 売上分析のキャッシュに注文の変化を知らせる
+    conn.execute("""
+        INSERT INTO order_versions (store_id, version) VALUES (?, 1)
+        ON CONFLICT (store_id) DO UPDATE SET version = version + 1
+    """, (store_id,))
+    conn.execute("""
+        INSERT INTO daily_sales (store_id, sales_date, order_count, sales_amount)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (store_id, sales_date) DO UPDATE SET
+            order_count = order_count + excluded.order_count,
+            sales_amount = sales_amount + excluded.sales_amount
+    """, (store_id, sales_date, sign, sign * total_amount))
+    conn.executemany("""
+        INSERT INTO daily_item_sales (store_id, sales_date, menu_id, quantity, sales_amount, price_at_order)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (store_id, sales_date, menu_id) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            sales_amount = sales_amount + excluded.sales_amount,
+            price_at_order = CASE WHEN excluded.quantity > 0 THEN excluded.price_at_order ELSE price_at_order END
+    """, [
+        (store_id, sales_date, menu_id, sign * quantity, sign * quantity * price, price)
+        for menu_id, quantity, price in items
+    ])
+    conn.executemany("""
+        INSERT INTO item_sales (store_id, menu_id, quantity, sales_amount, price_at_order)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (store_id, menu_id) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            sales_amount = sales_amount + excluded.sales_amount,
+            price_at_order = MAX(price_at_order, excluded.price_at_order)
+    """, [
+        (store_id, menu_id, sign * quantity, sign * quantity * price, price)
+        for menu_id, quantity, price in items
+    ])
+
+
+def apply_status_change(conn, order_id, old_status, new_status):
+    """キャンセルされた／キャンセルが取り消された注文を集計に反映する"""
+    if (old_status == 'canceled') == (new_status == 'canceled'):
+        return
+    order = conn.execute(
+        "SELECT store_id, datetime, total_amount FROM orders WHERE order_id = ?", (order_id,)
+    ).fetchone()
+    if order is None:
+        return
+    items = conn.execute(
+        "SELECT menu_id, quantity, price_at_order FROM order_items WHERE order_id = ?", (order_id,)
+    ).fetchall()
+    sign = -1 if new_status == 'canceled' else 1
+    record_order(conn, order['store_id'], order['datetime'], order['total_amount'],
+                 [tuple(item) for item in items], sign=sign)
+    # 既存の注文が増減したので、売上分析のキャッシュには全件を読み直させる
+    conn.execute("UPDATE order_versions SET cancel_version = cancel_version + 1 WHERE store_id = ?",
+                 (order['store_id'],))
+
+
+def rebuild(conn, store_id=None):
+    """orders / order_items から集計を作り直す（store_id 指定時はその店舗のみ）"""
+    where = "AND o.store_id = ?" if store_id is not None else ""
+    params = (store_id,) if store_id is not None else ()
+    if store_id is not None:
+        conn.execute("DELETE FROM daily_sales WHERE store_id = ?", params)
+        conn.execute("DELETE FROM daily_item_sales WHERE store_id = ?", params)
+        conn.execute("DELETE FROM item_sales WHERE store_id = ?", params)
+    else:
+        conn.execute("DELETE FROM daily_sales")
+        conn.execute("DELETE FROM daily_item_sales")
+        conn.execute("DELETE FROM item_sales")
+
+    conn.execute(f"""
+        INSERT INTO daily_sales (store_id, sales_date, order_count, sales_amount)
+        SELECT o.store_id, DATE(o.datetime), COUNT(*), SUM(o.total_amount)
+        FROM orders o
+        WHERE o.status != 'canceled' {where}
+        GROUP BY o.store_id, DATE(o.datetime)
+    """, params)
+    conn.execute(f"""
+        INSERT INTO daily_item_sales (store_id, sales_date, menu_id, quantity, sales_amount, price_at_order)
+        SELECT o.store_id, DATE(o.datetime), oi.menu_id,
+               SUM(oi.quantity), SUM(oi.quantity * oi.price_at_order), MAX(oi.price_at_order)
+        FROM orders o
+        JOIN order_items oi ON oi.order_id = o.order_id
+        WHERE o.status != 'canceled' {where}
+        GROUP BY o.store_id, DATE(o.datetime), oi.menu_id
+    """, params)
+    conn.execute(f"""
+        INSERT INTO item_sales (store_id, menu_id, quantity, sales_amount, price_at_order)
+        SELECT o.store_id, oi.menu_id,
+               SUM(oi.quantity), SUM(oi.quantity * oi.price_at_order), MAX(oi.price_at_order)
+        FROM orders o
+        JOIN order_items oi ON oi.order_id = o.order_id
+        WHERE o.status != 'canceled' {where}
+        GROUP BY o.store_id, oi.menu_id
+    """, params)
+
+
+def get_dashboard(conn, store_id, today=None):
+    """店舗ホームに表示する売上データを集計テーブルから取得する"""
+    today = today or datetime.date.today()
+    product_sales = conn.execute(PRODUCT_SALES_SQL, (store_id,)).fetchall()
+    today_stats = conn.execute(DAILY_SALES_SQL, (store_id, today.isoformat())).fetchone()
+    monthly_sales = conn.execute(MONTHLY_SALES_SQL, (store_id, today.replace(day=1).isoformat())).fetchone()
+    return {
+        'product_sales': product_sales,
+        'daily_sales': today_stats['daily_sales'],
+        'daily_orders': today_stats['daily_orders'],
+        'monthly_sales': monthly_sales['monthly_sales'],
+    }
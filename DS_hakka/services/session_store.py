@@ -0,0 +1,356 @@
+# services/session_store.py
+# --- サーバー側セッション ---
+# Flask 標準のセッションは中身をすべて署名つきクッキーに入れるため、
+# カートなどが増えるほど毎リクエストのクッキーが大きくなり、そのたびに署名し直していた。
+# ここではクッキーにはランダムなセッションIDだけを入れ、中身はサーバー側に保存する。
+# 保存先は SESSION_BACKEND で選ぶ:
+#   'sqlite' … sessions / cart_items テーブル（複数ワーカーで共有できる。既定）
+#   'memory' … プロセス内の辞書（TTL で削除。ワーカー1つの開発環境向け）
+#   'cookie' … Flask 標準のクッキーセッション（従来どおり）
+# カートの操作は services/carts.py から行う。
+import copy
+import os
+import secrets
+import threading
+import time
+
+from flask import current_app, session
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from services import database
+
+DEFAULT_SETTINGS = {
+    'SESSION_BACKEND': None,                  # None の場合は環境変数 SESSION_BACKEND（未設定なら 'sqlite'）
+    'SESSION_TTL_SECONDS': 7 * 24 * 3600,     # 最後の利用からこの時間が経ったセッションは削除
+    'SESSION_CLEANUP_INTERVAL': 300,          # 期限切れセッションを掃除する間隔（秒）
+}
+
+SESSION_SQL = "SELECT data, expires_at FROM sessions WHERE sid = ? AND expires_at >= ?"
+CART_SQL = """
+    SELECT menu_id, name, price, quantity FROM cart_items
+    WHERE sid = ? AND store_id = ?
+    ORDER BY added_at, menu_id
+"""
+
+_serializer = TaggedJSONSerializer()
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False, expires_at=0.0):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires_at = expires_at
+        self.modified = False
+        self.discarded_sid = None
+
+    def clear(self):
+        # ログアウトなどで中身を消すときは ID も新しくし、古い ID のセッションとカートは保存時に削除する
+        super().clear()
+        if not self.new:
+            self.discarded_sid = self.sid
+            self.sid = secrets.token_urlsafe(32)
+            self.new = True
+
+    def regenerate(self):
+        """中身はそのままで ID だけを新しくし、古い ID を返す"""
+        old_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+        return old_sid
+
+
+class MemoryBackend:
+    """プロセス内の辞書に保存する（期限切れのものは掃除のたびに削除）"""
+
+    def __init__(self, cleanup_interval):
+        self.cleanup_interval = cleanup_interval
+        self._sessions = {}  # sid -> (data, expires_at)
+        self._carts = {}     # sid -> {store_id: {menu_id: item}}
+        self._lock = threading.Lock()
+        self._last_cleanup = time.time()
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None or entry[1] < time.time():
+                return None, 0.0
+            return copy.deepcopy(entry[0]), entry[1]
+
+    def save(self, sid, data, expires_at):
+        with self._lock:
+            self._sessions[sid] = (copy.deepcopy(data), expires_at)
+        self._cleanup()
+
+    def touch(self, sid, expires_at):
+        with self._lock:
+            if sid in self._sessions:
+                self._sessions[sid] = (self._sessions[sid][0], expires_at)
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+            self._carts.pop(sid, None)
+
+    def move(self, old_sid, new_sid):
+        """カートを新しい ID に移し、古い ID のセッションを削除する"""
+        with self._lock:
+            self._sessions.pop(old_sid, None)
+            cart = self._carts.pop(old_sid, None)
+            if cart is not None:
+                self._carts[new_sid] = cart
+
+    def _cleanup(self):
+        now = time.time()
+        if now - self._last_cleanup < self.cleanup_interval:
+            return
+        with self._lock:
+            self._last_cleanup = now
+            expired = [sid for sid, (_, expires_at) in self._sessions.items() if expires_at < now]
+            for sid in expired:
+                del self._sessions[sid]
+            for sid in [sid for sid in self._carts if sid not in self._sessions]:
+                del self._carts[sid]
+
+    # --- カート ---
+
+    def get_cart(self, sid, store_id):
+        with self._lock:
+            cart = self._carts.get(sid, {}).get(store_id, {})
+            return {str(menu_id): dict(item) for menu_id, item in cart.items()}
+
+    def add_item(self, sid, store_id, item, quantity):
+        with self._lock:
+            cart = self._carts.setdefault(sid, {}).setdefault(store_id, {})
+            if item['menu_id'] in cart:
+                cart[item['menu_id']]['quantity'] += quantity
+            else:
+                cart[item['menu_id']] = dict(item, quantity=quantity)
+            return sum(i['quantity'] for i in cart.values())
+
+    def set_quantity(self, sid, store_id, menu_id, quantity):
+        with self._lock:
+            cart = self._carts.get(sid, {}).get(store_id, {})
+            if menu_id not in cart:
+                return False
+            if quantity > 0:
+                cart[menu_id]['quantity'] = quantity
+            else:
+                del cart[menu_id]
+            return True
+
+    def clear_cart(self, sid, store_id):
+        with self._lock:
+            self._carts.get(sid, {}).pop(store_id, None)
+
+
+class SqliteBackend:
+    """sessions / cart_items テーブルに保存する。
+
+    ルート側の未確定のトランザクションを巻き込んでコミットしないよう、
+    共通接続（get_db_connection）とは別の接続をスレッドごとに持つ。
+    """
+
+    def __init__(self, cleanup_interval):
+        self.cleanup_interval = cleanup_interval
+        self._local = threading.local()
+        self._last_cleanup = time.time()
+
+    def _conn(self):
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.pid = os.getpid()
+            self._local.conn = database.connect()
+        return self._local.conn
+
+    def _write(self, sql, params=()):
+        conn = self._conn()
+        try:
+            cursor = conn.execute(sql, params)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return cursor
+
+    def load(self, sid):
+        row = self._conn().execute(SESSION_SQL, (sid, time.time())).fetchone()
+        if row is None:
+            return None, 0.0
+        return _serializer.loads(row['data']), row['expires_at']
+
+    def save(self, sid, data, expires_at):
+        self._write("""
+            INSERT INTO sessions (sid, data, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (sid) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at
+        """, (sid, _serializer.dumps(data), expires_at))
+        self._cleanup()
+
+    def touch(self, sid, expires_at):
+        self._write("UPDATE sessions SET expires_at = ? WHERE sid = ?", (expires_at, sid))
+
+    def delete(self, sid):
+        conn = self._conn()
+        try:
+            conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+            conn.execute("DELETE FROM cart_items WHERE sid = ?", (sid,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def move(self, old_sid, new_sid):
+        """カートを新しい ID に移し、古い ID のセッションを削除する"""
+        conn = self._conn()
+        try:
+            conn.execute("UPDATE cart_items SET sid = ? WHERE sid = ?", (new_sid, old_sid))
+            conn.execute("DELETE FROM sessions WHERE sid = ?", (old_sid,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _cleanup(self):
+        now = time.time()
+        if now - self._last_cleanup < self.cleanup_interval:
+            return
+        self._last_cleanup = now
+        conn = self._conn()
+        try:
+            conn.execute("DELETE FROM sessions WHERE expires_at < ?", (now,))
+            # セッションより先に作られた直後のカートを消さないよう、しばらく更新のないものだけ対象にする
+            conn.execute("""
+                DELETE FROM cart_items
+                WHERE updated_at < ? AND sid NOT IN (SELECT sid FROM sessions)
+            """, (now - 3600,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    # --- カート ---
+
+    def get_cart(self, sid, store_id):
+        rows = self._conn().execute(CART_SQL, (sid, store_id)).fetchall()
+        return {str(row['menu_id']): dict(row) for row in rows}
+
+    def add_item(self, sid, store_id, item, quantity):
+        now = time.time()
+        conn = self._conn()
+        try:
+            conn.execute("""
+                INSERT INTO cart_items (sid, store_id, menu_id, name, price, quantity, added_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (sid, store_id, menu_id)
+                DO UPDATE SET quantity = quantity + excluded.quantity, updated_at = excluded.updated_at
+            """, (sid, store_id, item['menu_id'], item['name'], item['price'], quantity, now, now))
+            total = conn.execute("SELECT SUM(quantity) FROM cart_items WHERE sid = ? AND store_id = ?",
+                                 (sid, store_id)).fetchone()[0]
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return total
+
+    def set_quantity(self, sid, store_id, menu_id, quantity):
+        if quantity > 0:
+            cursor = self._write("""
+                UPDATE cart_items SET quantity = ?, updated_at = ?
+                WHERE sid = ? AND store_id = ? AND menu_id = ?
+            """, (quantity, time.time(), sid, store_id, menu_id))
+        else:
+            cursor = self._write("DELETE FROM cart_items WHERE sid = ? AND store_id = ? AND menu_id = ?",
+                                 (sid, store_id, menu_id))
+        return cursor.rowcount > 0
+
+    def clear_cart(self, sid, store_id):
+        self._write("DELETE FROM cart_items WHERE sid = ? AND store_id = ?", (sid, store_id))
+
+
+class ServerSideSessionInterface(SessionInterface):
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data, expires_at = self.backend.load(sid)
+            if data is not None:
+                return ServerSideSession(data, sid=sid, expires_at=expires_at)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def regenerate(self, session):
+        """ログイン時などに ID を新しくし、中身とカートを移して古い ID を使えなくする
+
+        ログイン前に渡された（または盗み見られた）ID がログイン後もそのまま使われるのを防ぐ。
+        """
+        old_sid = session.regenerate()
+        self.backend.move(old_sid, session.sid)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.discarded_sid:
+            self.backend.delete(session.discarded_sid)
+
+        # 空のセッションは保存しない（消されたばかりならクッキーも削除する）
+        if not session:
+            if session.discarded_sid:
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app),
+                                       httponly=self.get_cookie_httponly(app))
+            return
+
+        now = time.time()
+        set_cookie = session.new
+        if session.modified or session.new:
+            self.backend.save(session.sid, dict(session), now + self.ttl)
+        elif session.expires_at - now < self.ttl / 2:
+            # 有効期限の延長は期限が半分を切ったときだけ行い、毎リクエストの書き込みを避ける
+            self.backend.touch(session.sid, now + self.ttl)
+            set_cookie = session.permanent
+        if set_cookie:
+            response.set_cookie(
+                name, session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain, path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+        response.vary.add('Cookie')
+
+
+def regenerate():
+    """現在のセッションの ID を新しくする。session['id'] / session['store_id'] を設定する前に呼ぶ。
+
+    クッキーセッションでは中身がクッキーそのもので、サーバー側に ID がないので何もしない。
+    """
+    interface = current_app.session_interface
+    if isinstance(interface, ServerSideSessionInterface):
+        interface.regenerate(session)
+
+
+def init_app(app):
+    for key, value in DEFAULT_SETTINGS.items():
+        app.config.setdefault(key, value)
+    if not app.config['SESSION_BACKEND']:
+        app.config['SESSION_BACKEND'] = os.environ.get('SESSION_BACKEND') or 'sqlite'
+    backend = app.config['SESSION_BACKEND']
+    if backend == 'cookie':
+        return  # Flask 標準のクッキーセッションのまま
+    if backend == 'memory':
+        store = MemoryBackend(app.config['SESSION_CLEANUP_INTERVAL'])
+    elif backend == 'sqlite':
+        store = SqliteBackend(app.config['SESSION_CLEANUP_INTERVAL'])
+    else:
+        raise ValueError(f"SESSION_BACKEND の値が不正です: {backend}")
+    app.session_interface = ServerSideSessionInterface(store, app.config['SESSION_TTL_SECONDS'])
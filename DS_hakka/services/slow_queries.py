@@ -0,0 +1,123 @@
+# services/slow_queries.py
+# --- 遅いクエリのログ ---
+# SLOW_QUERY_MS を設定すると、それより時間のかかった SQL を JSON Lines 形式のファイルに書き出す。
+# 1件ごとに、空白を詰めた SQL・パラメータの形（値そのものは書かない）・発行したルート・時間を記録し、
+# 同じ SQL が初めて遅かったときだけ EXPLAIN QUERY PLAN の結果も添える。
+# 集計は `python cli.py slow-query-report` で行う（合計時間順・回数順）。
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from flask import has_request_context, request
+
+from services import database
+
+DEFAULT_SETTINGS = {
+    'SLOW_QUERY_MS': None,        # None なら環境変数 SLOW_QUERY_MS。どちらもなければ記録しない
+    'SLOW_QUERY_LOG': None,       # None の場合は create_app() 側のディレクトリの slow_queries.log
+}
+
+_WHITESPACE = re.compile(r'\s+')
+_PLACEHOLDER_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+
+
+def normalize_sql(sql):
+    """空白を詰め、IN (?, ?, ...) のようなプレースホルダの並びを1つにまとめる"""
+    return _PLACEHOLDER_LIST.sub('?, ...', _WHITESPACE.sub(' ', sql).strip())
+
+
+def params_shape(params):
+    """パラメータの値ではなく型の並びを返す（個人情報をログに残さないため）"""
+    if isinstance(params, dict):
+        return '{' + ', '.join(f'{key}: {type(value).__name__}' for key, value in params.items()) + '}'
+    if isinstance(params, (list, tuple)):
+        return '(' + ', '.join(type(value).__name__ for value in params) + ')'
+    return type(params).__name__
+
+
+def _explain(conn, sql):
+    # sqlite3.Connection.execute を直接呼び、EXPLAIN 自体は計測・記録の対象にしない
+    try:
+        params = (1,) * sql.count('?')
+        rows = sqlite3.Connection.execute(conn, f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        return [row[3] for row in rows]
+    except sqlite3.Error as e:
+        return [f'(EXPLAIN できませんでした: {e})']
+
+
+class SlowQueryLog:
+    def __init__(self):
+        self.threshold = None  # 秒
+        self.path = None
+        self._explained = set()
+        self._lock = threading.Lock()
+
+    def configure(self, threshold_ms, path):
+        self.threshold = threshold_ms / 1000 if threshold_ms is not None else None
+        self.path = path
+
+    def observe_query(self, conn, sql, params, seconds):
+        """database の接続から実行のたびに呼ばれる"""
+        if self.threshold is None or seconds < self.threshold:
+            return
+        normalized = normalize_sql(sql)
+        if isinstance(params, (list, tuple)) and params and isinstance(params[0], (list, tuple, dict)):
+            shape = f'executemany {len(params)}件 {params_shape(params[0])}'
+        elif not isinstance(params, (list, tuple, dict)):
+            shape = 'executemany'  # ジェネレータなどは実行後に中身を確認できない
+        else:
+            shape = params_shape(params)
+        if has_request_context():
+            # セッションの読み込みは URL の照合より前に行われるため、エンドポイントがなければパスを使う
+            route = request.url_rule.endpoint if request.url_rule else f'{request.method} {request.path}'
+        else:
+            route = f'thread:{threading.current_thread().name}'
+        record = {'at': time.time(), 'ms': round(seconds * 1000, 3), 'sql': normalized,
+                  'params': shape, 'route': route}
+        with self._lock:
+            if normalized not in self._explained:
+                self._explained.add(normalized)
+                record['plan'] = _explain(conn, sql)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+slow_query_log = SlowQueryLog()
+
+
+def read_log(path):
+    """ログを読み、SQL ごとに集計した辞書のリストを返す"""
+    stats = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # 書き込み途中の行など
+            s = stats.get(record['sql'])
+            if s is None:
+                s = stats[record['sql']] = {'sql': record['sql'], 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                                            'routes': {}, 'params': {}, 'plan': None}
+            s['count'] += 1
+            s['total_ms'] += record['ms']
+            s['max_ms'] = max(s['max_ms'], record['ms'])
+            s['routes'][record['route']] = s['routes'].get(record['route'], 0) + 1
+            s['params'][record['params']] = s['params'].get(record['params'], 0) + 1
+            if record.get('plan'):
+                s['plan'] = record['plan']  # 最新の実行計画を残す
+    return list(stats.values())
+
+
+def init_app(app):
+    for key, value in DEFAULT_SETTINGS.items():
+        app.config.setdefault(key, value)
+    if app.config['SLOW_QUERY_MS'] is None and os.environ.get('SLOW_QUERY_MS'):
+        app.config['SLOW_QUERY_MS'] = float(os.environ['SLOW_QUERY_MS'])
+    if not app.config['SLOW_QUERY_LOG']:
+        app.config['SLOW_QUERY_LOG'] = os.environ.get('SLOW_QUERY_LOG') or os.path.join(app.root_path, 'slow_queries.log')
+    slow_query_log.configure(app.config['SLOW_QUERY_MS'], app.config['SLOW_QUERY_LOG'])
+    if app.config['SLOW_QUERY_MS'] is not None:
+        database.add_query_observer(slow_query_log.observe_query)
@@ -0,0 +1,153 @@
+# services/store_customers.py
+# --- 顧客履歴（store_customers） ---
+# 店舗×顧客ごとの来店回数・累計金額・初回／最終来店日時を、注文の確定・キャンセル時に
+# 呼び出し側と同じトランザクション内で更新する。顧客履歴ページは orders を毎回集計せず、この表だけを読む。
+# 一覧は並べ替えの列ごとのインデックスを使い、キーセット方式で page_size 件ずつ取得する。
+from services import store_orders
+
+# 並べ替えの指定 -> 列（いずれも store_id と組み合わせたインデックスがある）
+SORT_COLUMNS = {
+    'last': 'last_order_at',
+    'visits': 'order_count',
+    'spend': 'total_amount',
+}
+
+DEFAULT_PAGE_SIZE = 50
+DEFAULT_RECENT_ORDERS = 20
+
+CUSTOMERS_PAGE_SQL = """
+    SELECT c.user_id, u.u_name, c.order_count, c.total_amount, c.first_order_at, c.last_order_at
+    FROM store_customers AS c
+    JOIN users_table AS u ON u.id = c.user_id
+    WHERE c.store_id = ? {cursor_filter}
+    ORDER BY c.{column} DESC, c.user_id DESC
+    LIMIT ?
+"""
+
+SUMMARY_SQL = """
+    SELECT COUNT(*) AS customers, COALESCE(SUM(order_count >= 2), 0) AS repeaters
+    FROM store_customers
+    WHERE store_id = ?
+"""
+
+CUSTOMER_SQL = """
+    SELECT c.user_id, u.u_name, c.order_count, c.total_amount, c.first_order_at, c.last_order_at
+    FROM store_customers AS c
+    JOIN users_table AS u ON u.id = c.user_id
+    WHERE c.store_id = ? AND c.user_id = ?
+"""
+
+CUSTOMER_ORDERS_SQL = """
+    SELECT order_id, datetime, total_amount, status
+    FROM orders
+    WHERE store_id = ? AND user_id = ?
+    ORDER BY datetime DESC
+    LIMIT ?
+"""
+
+
+def record_order(conn, store_id, user_id, order_datetime, total_amount):
+    """確定した注文1件分を顧客の集計に加算する。コミットは呼び出し側で行う。"""
+    order_datetime = str(order_datetime)
+    conn.execute("""
+        INSERT INTO store_customers (store_id, user_id, order_count, total_amount, first_order_at, last_order_at)
+        VALUES (?, ?, 1, ?, ?, ?)
+        ON CONFLICT (store_id, user_id) DO UPDATE SET
+            order_count = order_count + 1,
+            total_amount = total_amount + excluded.total_amount,
+            first_order_at = MIN(first_order_at, excluded.first_order_at),
+            last_order_at = MAX(last_order_at, excluded.last_order_at)
+    """, (store_id, user_id, total_amount, order_datetime, order_datetime))
+
+
+def refresh_customer(conn, store_id, user_id):
+    """1人分の集計をその顧客の注文から作り直す（idx_orders_store_user_datetime で顧客の注文だけを読む）"""
+    conn.execute("DELETE FROM store_customers WHERE store_id = ? AND user_id = ?", (store_id, user_id))
+    conn.execute("""
+        INSERT INTO store_customers (store_id, user_id, order_count, total_amount, first_order_at, last_order_at)
+        SELECT store_id, user_id, COUNT(*), SUM(total_amount), MIN(datetime), MAX(datetime)
+        FROM orders
+        WHERE store_id = ? AND user_id = ? AND status != 'canceled'
+        GROUP BY store_id, user_id
+    """, (store_id, user_id))
+
+
+def apply_status_change(conn, order_id, old_status, new_status):
+    """キャンセルされた／キャンセルが取り消された注文の顧客の集計を作り直す
+
+    キャンセルされたのが最後の注文なら最終来店日時も変わるため、加算・減算ではなく作り直す。
+    """
+    if (old_status == 'canceled') == (new_status == 'canceled'):
+        return
+    order = conn.execute("SELECT store_id, user_id FROM orders WHERE order_id = ?", (order_id,)).fetchone()
+    if order is not None:
+        refresh_customer(conn, order['store_id'], order['user_id'])
+
+
+def rebuild(conn, store_id=None):
+    """orders から集計を作り直す（store_id 指定時はその店舗のみ）"""
+    where = "AND store_id = ?" if store_id is not None else ""
+    params = (store_id,) if store_id is not None else ()
+    conn.execute(f"DELETE FROM store_customers WHERE 1 = 1 {where}", params)
+    conn.execute(f"""
+        INSERT INTO store_customers (store_id, user_id, order_count, total_amount, first_order_at, last_order_at)
+        SELECT store_id, user_id, COUNT(*), SUM(total_amount), MIN(datetime), MAX(datetime)
+        FROM orders
+        WHERE status != 'canceled' {where}
+        GROUP BY store_id, user_id
+    """, params)
+
+
+def encode_cursor(customer, sort):
+    return f"{customer['user_id']}:{customer[SORT_COLUMNS[sort]]}"
+
+
+def decode_cursor(cursor, sort):
+    """'user_id:並べ替えの値' を (値, user_id) にする。不正な値は None。"""
+    if not cursor:
+        return None
+    user_id, _, value = cursor.partition(':')
+    try:
+        if sort != 'last':
+            value = int(value)
+        return value, int(user_id)
+    except ValueError:
+        return None
+
+
+def fetch_customer_page(conn, store_id, sort='last', cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """顧客を1ページ分返す。戻り値は (顧客リスト, 次ページのカーソル or None)。"""
+    if sort not in SORT_COLUMNS:
+        sort = 'last'
+    column = SORT_COLUMNS[sort]
+    params = [store_id]
+    cursor_filter = ""
+    position = decode_cursor(cursor, sort)
+    if position:
+        cursor_filter = f"AND (c.{column}, c.user_id) < (?, ?)"
+        params.extend(position)
+    params.append(page_size + 1)  # 次のページがあるか判定するため1件多く取る
+
+    rows = conn.execute(CUSTOMERS_PAGE_SQL.format(column=column, cursor_filter=cursor_filter), params).fetchall()
+    has_next = len(rows) > page_size
+    customers = [dict(row) for row in rows[:page_size]]
+    next_cursor = encode_cursor(customers[-1], sort) if has_next else None
+    return customers, next_cursor
+
+
+def get_summary(conn, store_id):
+    row = conn.execute(SUMMARY_SQL, (store_id,)).fetchone()
+    return {'customers': row['customers'], 'repeaters': row['repeaters']}
+
+
+def get_customer(conn, store_id, user_id, limit=DEFAULT_RECENT_ORDERS):
+    """(顧客の集計, 直近の注文（明細つき）) を返す。この店舗で注文のない顧客なら None。"""
+    customer = conn.execute(CUSTOMER_SQL, (store_id, user_id)).fetchone()
+    if customer is None:
+        return None
+    orders = [{
+        'id': row['order_id'], 'datetime': row['datetime'], 'status': row['status'],
+        'total_amount': row['total_amount'], 'items_list': [],
+    } for row in conn.execute(CUSTOMER_ORDERS_SQL, (store_id, user_id, limit))]
+    store_orders.attach_items(conn, orders)
+    return dict(customer), orders
@@ -0,0 +1,92 @@
+# services/store_locator.py
+# --- マップ用の店舗検索（R*Tree の空間インデックスを使用） ---
+# 表示範囲（矩形）に入る店舗と、指定地点から近い順の店舗を返す。
+# どちらも locations_rtree（psql/migrations/0007）で候補を絞り込んでから
+# locations / store と結合するので、店舗数が増えても範囲内の件数分しか読まない。
+import math
+
+DEFAULT_BBOX_LIMIT = 500      # 1回の範囲検索で返す最大件数（広域表示で全店舗を返さないため）
+DEFAULT_NEAREST_LIMIT = 20
+MAX_NEAREST_LIMIT = 100
+EARTH_RADIUS_KM = 6371.0
+_KM_PER_DEGREE = 111.32
+
+BBOX_SQL = """
+    SELECT s.store_id, s.store_name, s.description, s.email, s.representative,
+           l.latitude, l.longitude
+    FROM locations_rtree AS r
+    JOIN locations AS l ON l.location_id = r.id
+    JOIN store AS s ON s.store_id = l.store_id
+    WHERE r.min_lat >= ? AND r.max_lat <= ?
+      AND r.min_lng >= ? AND r.max_lng <= ?
+    LIMIT ?
+"""
+
+
+def _store_dict(row):
+    return {
+        'id': row['store_id'],
+        'store_name': row['store_name'],
+        'description': row['description'],
+        'email': row['email'],
+        'representative': row['representative'],
+        'lat': row['latitude'],
+        'lng': row['longitude'],
+    }
+
+
+def parse_bbox(value):
+    """'south,west,north,east' を (south, west, north, east) にする。不正なら ValueError。"""
+    parts = [float(v) for v in (value or '').split(',')]
+    if len(parts) != 4 or not all(math.isfinite(v) for v in parts):
+        raise ValueError("bbox は south,west,north,east の4つの数値で指定してください")
+    south, west, north, east = parts
+    if south > north:
+        raise ValueError("bbox の south が north より大きくなっています")
+    # 地図を横にスクロールし続けると経度が ±180 を超えるので範囲内に収める
+    return max(south, -90.0), max(west, -180.0), min(north, 90.0), min(east, 180.0)
+
+
+def stores_in_bbox(conn, south, west, north, east, limit=DEFAULT_BBOX_LIMIT):
+    """矩形内の店舗を返す。戻り値は (店舗リスト, 件数の上限で打ち切ったか)。
+
+    打ち切ったときの店舗は R*Tree の走査順の先頭で、位置による優先順はない。limit=None なら打ち切らない。
+    """
+    if limit is None:
+        rows = conn.execute(BBOX_SQL, (south, north, west, east, -1)).fetchall()  # LIMIT -1 は無制限
+        return [_store_dict(row) for row in rows], False
+    rows = conn.execute(BBOX_SQL, (south, north, west, east, limit + 1)).fetchall()
+    return [_store_dict(row) for row in rows[:limit]], len(rows) > limit
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    """2点間の距離（km、ハバーサイン公式）"""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+def nearest_stores(conn, lat, lng, limit=DEFAULT_NEAREST_LIMIT, radius_km=2.0, max_radius_km=2500.0):
+    """(lat, lng) から近い順に店舗を limit 件返す（各店舗に distance_km をつける）。
+
+    半径 radius_km の円を囲む矩形で R*Tree を引き、円の中に limit 件そろうまで半径を倍にしていく。
+    円の中で limit 件見つかれば、それより遠い店舗が上位に入ることはない。
+    矩形内の候補が多すぎて打ち切られた場合は、近い店舗が候補から漏れている可能性があるので、
+    その半径のまま件数を制限せずに読み直す（半径を倍にする手前で limit 件に届かなかった範囲なので、
+    読み直しが必要になるのは店舗が密集している場所だけ）。
+    """
+    while True:
+        dlat = radius_km / _KM_PER_DEGREE
+        dlng = radius_km / (_KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+        bbox = (max(lat - dlat, -90.0), max(lng - dlng, -180.0), min(lat + dlat, 90.0), min(lng + dlng, 180.0))
+        candidates, truncated = stores_in_bbox(conn, *bbox, limit=max(limit * 50, DEFAULT_BBOX_LIMIT))
+        if truncated:
+            candidates, _ = stores_in_bbox(conn, *bbox, limit=None)
+        for store in candidates:
+            store['distance_km'] = round(distance_km(lat, lng, store['lat'], store['lng']), 3)
+        within = sorted((s for s in candidates if s['distance_km'] <= radius_km),
+                        key=lambda s: s['distance_km'])
+        if len(within) >= limit or radius_km >= max_radius_km:
+            return within[:limit]
+        radius_km *= 2
@@ -0,0 +1,93 @@
+# services/store_orders.py
+# --- 店舗の注文リスト（キーセット方式のページング） ---
+# 注文を (datetime, order_id) の降順で page_size 件ずつ取得し、
+# 明細は表示するページの注文分だけをまとめて1回で取得する。
+# ページの取得コストは履歴の長さではなくページサイズに比例する。
+
+ACTIVE_STATUSES = ['注文受付中', '受付完了', '商品作成中', '作成直前', '受け取り待ち']
+CLOSED_STATUSES = ['completed', 'canceled']
+
+# status フィルタ -> WHERE 句（active は idx_orders_store_active の条件と一致させる）
+STATUS_FILTERS = {
+    'active': "AND o.status NOT IN ('completed', 'canceled')",
+    'closed': "AND o.status IN ('completed', 'canceled')",
+    'all': "",
+}
+
+# 2ページ目以降の条件（カーソルの (datetime, order_id) より前）
+CURSOR_FILTER = "AND (o.datetime, o.order_id) < (?, ?)"
+
+DEFAULT_PAGE_SIZE = 50
+
+ORDERS_PAGE_SQL = """
+    SELECT o.order_id, o.datetime, o.total_amount, o.status, u.u_name
+    FROM orders AS o
+    JOIN users_table AS u ON o.user_id = u.id
+    WHERE o.store_id = ? {status_filter} {cursor_filter}
+    ORDER BY o.datetime DESC, o.order_id DESC
+    LIMIT ?
+"""
+
+ORDER_ITEMS_SQL = """
+    SELECT oi.order_id, m.menu_name, oi.quantity, oi.price_at_order
+    FROM order_items AS oi
+    JOIN menus AS m ON oi.menu_id = m.menu_id
+    WHERE oi.order_id IN ({placeholders})
+    ORDER BY oi.order_item_id
+"""
+
+
+def encode_cursor(order):
+    return f"{order['id']}:{order['datetime']}"
+
+
+def decode_cursor(cursor):
+    """'order_id:datetime' を (datetime, order_id) にする。不正な値は None。"""
+    if not cursor:
+        return None
+    order_id, _, order_datetime = cursor.partition(':')
+    try:
+        return order_datetime, int(order_id)
+    except ValueError:
+        return None
+
+
+def attach_items(conn, orders):
+    """各注文の items_list に明細を入れる（1回のクエリでまとめて取得）"""
+    if not orders:
+        return
+    by_id = {order['id']: order for order in orders}
+    placeholders = ', '.join('?' * len(by_id))
+    for item in conn.execute(ORDER_ITEMS_SQL.format(placeholders=placeholders), list(by_id)):
+        by_id[item['order_id']]['items_list'].append({
+            'name': item['menu_name'], 'quantity': item['quantity'], 'price': item['price_at_order']
+        })
+
+
+def fetch_order_page(conn, store_id, status='active', cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """注文を1ページ分返す。戻り値は (注文リスト, 次ページのカーソル or None)。"""
+    status_filter = STATUS_FILTERS.get(status, STATUS_FILTERS['active'])
+    params = [store_id]
+    cursor_filter = ""
+    position = decode_cursor(cursor)
+    if position:
+        cursor_filter = CURSOR_FILTER
+        params.extend(position)
+    params.append(page_size + 1)  # 次のページがあるか判定するため1件多く取る
+
+    rows = conn.execute(
+        ORDERS_PAGE_SQL.format(status_filter=status_filter, cursor_filter=cursor_filter), params
+    ).fetchall()
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+
+    orders = [{
+        'id': row['order_id'], 'datetime': row['datetime'], 'status': row['status'],
+        'user_name': row['u_name'], 'total_amount': row['total_amount'],
+        'items_list': [],
+    } for row in rows]
+
+    attach_items(conn, orders)
+
+    next_cursor = encode_cursor(orders[-1]) if has_next else None
+    return orders, next_cursor
@@ -0,0 +1,41 @@
+# services/user_orders.py
+# --- ユーザーの決済履歴（キーセット方式のページング） ---
+# 注文の概要だけを (datetime, order_id) の降順で1ページ分取得し、
+# 明細はそのページの注文分だけをまとめて取得する（store_orders と同じ方式）。
+from services.store_orders import CURSOR_FILTER, attach_items, decode_cursor, encode_cursor
+
+DEFAULT_PAGE_SIZE = 20
+
+HISTORY_PAGE_SQL = """
+    SELECT o.order_id, o.datetime, o.status, o.total_amount, s.store_name
+    FROM orders AS o
+    JOIN store AS s ON o.store_id = s.store_id
+    WHERE o.user_id = ? {cursor_filter}
+    ORDER BY o.datetime DESC, o.order_id DESC
+    LIMIT ?
+"""
+
+
+def fetch_history_page(conn, user_id, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """決済履歴を1ページ分返す。戻り値は (注文リスト, 次ページのカーソル or None)。"""
+    params = [user_id]
+    cursor_filter = ""
+    position = decode_cursor(cursor)
+    if position:
+        cursor_filter = CURSOR_FILTER
+        params.extend(position)
+    params.append(page_size + 1)
+
+    rows = conn.execute(HISTORY_PAGE_SQL.format(cursor_filter=cursor_filter), params).fetchall()
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+
+    orders = [{
+        'id': row['order_id'], 'datetime': row['datetime'], 'status': row['status'],
+        'total_amount': row['total_amount'], 'store_name': row['store_name'],
+        'items_list': [],
+    } for row in rows]
+    attach_items(conn, orders)
+
+    next_cursor = encode_cursor(orders[-1]) if has_next else None
+    return orders, next_cursor
@@ -0,0 +1,159 @@
+# services/wait_times.py
+# --- 受け取りまでの待ち時間の目安 ---
+# 店舗ごとの「段階ごとの所要時間の移動平均（指数移動平均）」をプロセス内に持ち、
+# 注文のステータス変更のたびに抜けた段階の所要時間で少しずつ更新する（履歴は読み直さない）。
+# 目安は次のように見積もる（厨房は同時に WAIT_TIMES_KITCHEN_CAPACITY 件ずつ作るものとする）。
+#   作成前の注文: max(自分が作成に入るまでの時間, 先に並んでいる注文の残りの作成時間の合計 / 同時に作れる件数)
+#                 + 作成・作成直前にかかる時間
+#   作成中以降の注文: 今の段階の残り時間 + それ以降の段階の時間
+# 対応中の注文の列は services/open_orders.py の投影を読み、ここでは店舗ごとの段階の所要時間だけを持つ。
+import math
+import threading
+import time
+
+from services.database import get_db_connection
+from services.open_orders import open_orders
+
+# 受け取りまでの段階（受け取り待ちになったら待ち時間は 0）
+STAGES = ['注文受付中', '受付完了', '商品作成中', '作成直前']
+READY = '受け取り待ち'
+PREP_STAGE = '商品作成中'
+
+# まだ所要時間の記録がない段階の既定値（秒）
+DEFAULT_STAGE_SECONDS = {'注文受付中': 60.0, '受付完了': 60.0, '商品作成中': 300.0, '作成直前': 60.0}
+
+DEFAULT_SETTINGS = {
+    'WAIT_TIMES_ALPHA': 0.2,              # 移動平均で新しい所要時間にかける重み
+    'WAIT_TIMES_KITCHEN_CAPACITY': 1,     # 同時に作れる注文の数
+}
+
+STAGE_MEANS_SQL = """
+    SELECT stage, SUM(total_seconds) / SUM(sample_count) AS mean
+    FROM stage_duration_stats
+    WHERE store_id = ?
+    GROUP BY stage
+"""
+
+
+class WaitTimeEstimator:
+    def __init__(self):
+        self.alpha = DEFAULT_SETTINGS['WAIT_TIMES_ALPHA']
+        self.kitchen_capacity = DEFAULT_SETTINGS['WAIT_TIMES_KITCHEN_CAPACITY']
+        self._stage_seconds = {}  # store_id -> 段階 -> 所要時間の移動平均（秒）
+        self._lock = threading.Lock()
+        self.transitions = 0
+
+    # --- ステータス変更での更新 ---
+
+    def handle_transition(self, store_id, old_status, seconds, new_status):
+        """open_orders のステータス変更のリスナー。抜けた段階の所要時間で移動平均を更新する。"""
+        if old_status not in STAGES or new_status == 'canceled':
+            return
+        with self._lock:
+            stage_seconds = self._stage_seconds.get(store_id)
+            if stage_seconds is None:
+                return  # まだ見積もっていない店舗は、最初に見積もるときに集計テーブルの平均から始める
+            self.transitions += 1
+            stage_seconds[old_status] += self.alpha * (seconds - stage_seconds[old_status])
+
+    # --- 見積もり ---
+
+    def estimate_store(self, store_id):
+        """今注文した場合の目安と、対応中の注文数を返す"""
+        orders = open_orders.queue(store_id)
+        stage_seconds = self._get_stage_seconds(store_id)
+        seconds, ahead = self._estimate(orders, stage_seconds, None, time.time())
+        waiting = sum(1 for _, status, _ in orders if status != READY)
+        return {'store_id': store_id, 'open_orders': waiting, 'seconds': round(seconds),
+                'minutes': math.ceil(seconds / 60), 'queue_ahead': ahead}
+
+    def estimate_order(self, store_id, order_id, resync_missing=False):
+        """注文の受け取りまでの目安を返す。列にない（対応が終わっている）注文なら None。
+
+        resync_missing=True は DB 上で対応中だとわかっている注文に使う。列になければ
+        （他のワーカーで受けた注文がまだ読み直されていないなど）店舗の列を読み直してから見積もる。
+        """
+        orders = open_orders.queue(store_id)
+        if resync_missing and not any(other_id == order_id for other_id, _, _ in orders):
+            orders = open_orders.queue(store_id, resync=True)
+        status = next((status for other_id, status, _ in orders if other_id == order_id), None)
+        if status is None:
+            return None
+        stage_seconds = self._get_stage_seconds(store_id)
+        seconds, ahead = self._estimate(orders, stage_seconds, order_id, time.time())
+        return {'order_id': order_id, 'status': status, 'ready': status == READY, 'seconds': round(seconds),
+                'minutes': math.ceil(seconds / 60), 'queue_ahead': ahead}
+
+    def _estimate(self, orders, stage_seconds, order_id, now):
+        """(残り秒数, 先に作る注文の数) を返す。order_id が None なら今から注文する場合。
+
+        orders は open_orders.queue() の作成順の列。
+        """
+        prep_index = STAGES.index(PREP_STAGE)
+        if order_id is None:
+            status, entered_at = STAGES[0], now
+        else:
+            status, entered_at = next((s, t) for other_id, s, t in orders if other_id == order_id)
+        if status not in STAGES:
+            return 0.0, 0  # 受け取り待ち
+
+        index = STAGES.index(status)
+        current_left = max(stage_seconds[status] - (now - entered_at), 0.0)
+        if index >= prep_index:
+            # すでに作成中以降なので、列の影響は受けない
+            return current_left + sum(stage_seconds[s] for s in STAGES[index + 1:]), 0
+
+        # 先に並んでいる注文が厨房を使う残り時間
+        kitchen_busy = 0.0
+        ahead = 0
+        for other_id, other_status, other_entered_at in orders:
+            if other_id == order_id:
+                break  # 作成順に並んでいるので、ここから後ろは自分より後の注文
+            if other_status not in STAGES or STAGES.index(other_status) > prep_index:
+                continue
+            ahead += 1
+            if other_status == PREP_STAGE:
+                kitchen_busy += max(stage_seconds[PREP_STAGE] - (now - other_entered_at), 0.0)
+            else:
+                kitchen_busy += stage_seconds[PREP_STAGE]
+        until_prep = current_left + sum(stage_seconds[s] for s in STAGES[index + 1:prep_index])
+        seconds = max(until_prep, kitchen_busy / max(self.kitchen_capacity, 1))
+        return seconds + sum(stage_seconds[s] for s in STAGES[prep_index:]), ahead
+
+    # --- 読み込み ---
+
+    def _get_stage_seconds(self, store_id):
+        """店舗の段階ごとの所要時間（初回だけ集計テーブルの平均で初期化する）のコピーを返す"""
+        with self._lock:
+            stage_seconds = self._stage_seconds.get(store_id)
+            if stage_seconds is not None:
+                return dict(stage_seconds)
+        stage_seconds = dict(DEFAULT_STAGE_SECONDS)
+        for row in get_db_connection().execute(STAGE_MEANS_SQL, (store_id,)):
+            if row['stage'] in stage_seconds and row['mean'] is not None:
+                stage_seconds[row['stage']] = row['mean']
+        with self._lock:
+            stage_seconds = self._stage_seconds.setdefault(store_id, stage_seconds)
+            return dict(stage_seconds)
+
+    def clear(self):
+        with self._lock:
+            self._stage_seconds.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'stores': len(self._stage_seconds),
+                'transitions': self.transitions,
+            }
+
+
+wait_times = WaitTimeEstimator()
+
+
+def init_app(app):
+    for key, value in DEFAULT_SETTINGS.items():
+        app.config.setdefault(key, value)
+    wait_times.alpha = app.config['WAIT_TIMES_ALPHA']
+    wait_times.kitchen_capacity = app.config['WAIT_TIMES_KITCHEN_CAPACITY']
+    open_orders.add_transition_listener(wait_times.handle_transition)
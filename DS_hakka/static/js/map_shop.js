@@ -1,11 +1,14 @@
 document.addEventListener('DOMContentLoaded', function () {
     const mapElement = document.getElementById('map');
-    const locationData = mapElement.getAttribute('data-locations');
-    let locations = JSON.parse(locationData);
+    const storesUrl = mapElement.getAttribute('data-stores-url');
+    const nearestUrl = mapElement.getAttribute('data-nearest-url');
     const menuUrlTemplate = mapElement.getAttribute('data-menu-url-template');
+    const storeList = document.querySelector('.store-list');
+    const notice = document.getElementById('map-notice');
+    const searchInput = document.getElementById('store-search');
 
-    // 地図中心を店舗の平均緯度経度に設定（あれば）
-    let centerLat = 35.6769; // デフォルト東京
+    // 初期表示は東京
+    let centerLat = 35.6769;
     let centerLng = 139.7661;
 
     const map = L.map('map').setView([centerLat, centerLng], 10);
@@ -14,62 +17,135 @@ document.addEventListener('DOMContentLoaded', function () {
         attribution: '© OpenStreetMap contributors'
     }).addTo(map);
 
-    let markers = [];
+    let locations = [];        // 表示範囲内の店舗（サーバーから取得）
+    let nearby = [];           // 地図の中心から近い店舗（サイドバー用）
+    const markers = new Map(); // 店舗ID -> マーカー
 
-    function addMarkers(locs) {
-        // 既存マーカー削除
-        markers.forEach(m => map.removeLayer(m));
-        markers = [];
+    function escapeHtml(text) {
+        const div = document.createElement('div');
+        div.textContent = text == null ? '' : String(text);
+        return div.innerHTML;
+    }
+
+    function menuUrlFor(id) {
+        return menuUrlTemplate.replace('/0', '/' + id);
+    }
+
+    function keyword() {
+        return searchInput ? searchInput.value.trim().toLowerCase() : '';
+    }
+
+    function matches(loc) {
+        return (loc.store_name || '').toLowerCase().includes(keyword());
+    }
+
+    function createMarker(loc) {
+        const menuUrl = menuUrlFor(loc.id);
+
+        const popupContent = `
+            <div style="font-size: 1em; line-height: 1.5; max-width: 220px;">
+                <div style="font-size: 1.5em;">📍</div>
+                <a href="${menuUrl}" style="font-weight:bold; color:#007bff; text-decoration: none;">
+                    ${escapeHtml(loc.store_name || '店舗名未登録')}
+                </a><br>
+                <span style="color:#444;">メール: ${escapeHtml(loc.email || '未登録')}</span><br>
+                <span style="color:#444;">担当者: ${escapeHtml(loc.representative || '不明')}</span><br>
+                <span style="color:#444;">説明: ${escapeHtml(loc.description || 'なし')}</span><br>
+                <span style="font-size: 0.8em; color: gray;">※クリックでメニュー画面へ</span>
+            </div>
+        `;
+
+        const marker = L.marker([loc.lat, loc.lng]).bindPopup(popupContent);
+
+        marker.on('mouseover', function () { this.openPopup(); });
+        marker.on('mouseout', function () { this.closePopup(); });
+        marker.on('click', function () { window.location.href = menuUrl; });
+
+        return marker;
+    }
 
+    function addMarkers(locs) {
+        // 表示範囲から外れた店舗のマーカーだけ削除し、残りは使い回す
+        const visible = new Set(locs.map(loc => loc.id));
+        markers.forEach((marker, id) => {
+            if (!visible.has(id)) {
+                map.removeLayer(marker);
+                markers.delete(id);
+            }
+        });
         locs.forEach(loc => {
-            const menuUrl = menuUrlTemplate.replace('/0', '/' + loc.id);
-
-            const popupContent = `
-                <div style="font-size: 1em; line-height: 1.5; max-width: 220px;">
-                    <div style="font-size: 1.5em;">📍</div>
-                    <a href="${menuUrl}" style="font-weight:bold; color:#007bff; text-decoration: none;">
-                        ${loc.store_name || '店舗名未登録'}
-                    </a><br>
-                    <span style="color:#444;">メール: ${loc.email || '未登録'}</span><br>
-                    <span style="color:#444;">担当者: ${loc.representative || '不明'}</span><br>
-                    <span style="color:#444;">説明: ${loc.description || 'なし'}</span><br>
-                    <span style="font-size: 0.8em; color: gray;">※クリックでメニュー画面へ</span>
-                </div>
-            `;
-
-            const marker = L.marker([loc.lat, loc.lng])
-                .addTo(map)
-                .bindPopup(popupContent);
-
-            marker.on('mouseover', function () { this.openPopup(); });
-            marker.on('mouseout', function () { this.closePopup(); });
-            marker.on('click', function () { window.location.href = menuUrl; });
-
-            markers.push(marker);
+            if (!markers.has(loc.id)) {
+                markers.set(loc.id, createMarker(loc).addTo(map));
+            }
         });
     }
 
+    function renderStoreList() {
+        const stores = nearby.filter(matches);
+        if (stores.length === 0) {
+            storeList.innerHTML = '<li>店舗情報がありません。</li>';
+            return;
+        }
+        storeList.innerHTML = stores.map(store => `
+            <li>
+                <a href="${menuUrlFor(store.id)}" class="custom-link">
+                    <h3>${escapeHtml(store.store_name)}</h3> <p>${escapeHtml(store.description)}</p>
+                </a>
+            </li>
+        `).join('');
+    }
+
+    function render() {
+        addMarkers(locations.filter(matches));
+        renderStoreList();
+    }
+
+    // --- 表示範囲が変わるたびにその範囲の店舗だけを読み込む ---
+    let controller = null;
+    let timer = null;
+
+    async function loadViewport() {
+        if (controller) {
+            controller.abort();  // 前の読み込みが終わっていなければ取り消す
+        }
+        controller = new AbortController();
+        const bounds = map.getBounds();
+        const center = map.getCenter();
+        const bbox = [bounds.getSouth(), bounds.getWest(), bounds.getNorth(), bounds.getEast()].join(',');
+
+        try {
+            const [storesRes, nearestRes] = await Promise.all([
+                fetch(`${storesUrl}?bbox=${encodeURIComponent(bbox)}`, { signal: controller.signal }),
+                fetch(`${nearestUrl}?lat=${center.lat}&lng=${center.lng}`, { signal: controller.signal })
+            ]);
+            if (!storesRes.ok || !nearestRes.ok) {
+                throw new Error('店舗情報の取得に失敗しました');
+            }
+            const storesData = await storesRes.json();
+            const nearestData = await nearestRes.json();
+
+            locations = storesData.stores;
+            nearby = nearestData.stores;
+            notice.hidden = !storesData.truncated;
+            render();
+        } catch (e) {
+            if (e.name !== 'AbortError') {
+                console.error(e);
+            }
+        }
+    }
+
+    map.on('moveend', function () {
+        // パンやズームの途中で何度も読み込まないよう少し待つ
+        clearTimeout(timer);
+        timer = setTimeout(loadViewport, 250);
+    });
+
     // 初期表示
-    addMarkers(locations);
+    loadViewport();
 
-    // 検索機能
-    const searchInput = document.getElementById('store-search');
+    // 検索機能（読み込み済みの店舗を店舗名で絞り込む）
     if (searchInput) {
-        searchInput.addEventListener('input', function () {
-            const keyword = this.value.trim().toLowerCase();
-            const filtered = locations.filter(loc => loc.store_name.toLowerCase().includes(keyword));
-            addMarkers(filtered);
-
-            // サイドバー店舗リストの表示切替（DOM操作）
-            const storeListItems = document.querySelectorAll('.store-list li');
-            storeListItems.forEach(li => {
-                const text = li.textContent.toLowerCase();
-                if (text.includes(keyword)) {
-                    li.style.display = '';
-                } else {
-                    li.style.display = 'none';
-                }
-            });
-        });
+        searchInput.addEventListener('input', render);
     }
 });
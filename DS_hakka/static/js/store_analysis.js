@@ -0,0 +1,55 @@
+document.addEventListener('DOMContentLoaded', function () {
+    const main = document.querySelector('main[data-url]');
+
+    const yen = value => value.toLocaleString() + ' 円';
+
+    // --- 前週比・客単価 ---
+    function renderSummary(data) {
+        const wow = data.week_over_week;
+        document.getElementById('wow-sales').textContent = yen(wow.sales);
+        document.getElementById('wow-change').textContent = wow.sales_change === null
+            ? '前の7日間: ' + yen(wow.previous_sales)
+            : '前の7日間比 ' + (wow.sales_change >= 0 ? '+' : '') + wow.sales_change + '%';
+        document.getElementById('basket-average').textContent = yen(data.basket.average_amount);
+        document.getElementById('basket-median').textContent = '中央値 ' + yen(data.basket.median_amount);
+        document.getElementById('basket-items').textContent = data.basket.average_items + ' 点';
+    }
+
+    // --- 曜日×時間帯（注文数が多いほど濃く表示） ---
+    function renderHeatmap(heatmap) {
+        const table = document.getElementById('heatmap');
+        const max = Math.max(1, ...heatmap.orders.flat());
+        let html = '<tr><th></th>' + heatmap.hours.map(h => '<th>' + h + '</th>').join('') + '</tr>';
+        heatmap.weekdays.forEach((day, i) => {
+            html += '<tr><th>' + day + '</th>';
+            heatmap.orders[i].forEach((count, hour) => {
+                const alpha = (count / max).toFixed(2);
+                html += '<td style="background-color: rgba(0, 123, 255, ' + alpha + ')" title="'
+                    + day + ' ' + hour + '時: ' + count + '件 / ' + yen(heatmap.sales[i][hour]) + '">'
+                    + (count || '') + '</td>';
+            });
+            html += '</tr>';
+        });
+        table.innerHTML = html;
+    }
+
+    function barChart(id, labels, label, values, horizontal) {
+        new Chart(document.getElementById(id), {
+            type: 'bar',
+            data: { labels: labels, datasets: [{ label: label, data: values, backgroundColor: '#007bff' }] },
+            options: { indexAxis: horizontal ? 'y' : 'x', plugins: { legend: { display: false } } }
+        });
+    }
+
+    fetch(main.dataset.url)
+        .then(response => response.json())
+        .then(data => {
+            renderSummary(data);
+            renderHeatmap(data.heatmap);
+            barChart('weekly-chart', data.weekly.labels.map(d => d + ' の週'), '売上（円）', data.weekly.sales);
+            barChart('weekday-chart', data.weekday.labels, '売上（円）', data.weekday.average_sales);
+            barChart('top-items-chart', data.top_items.map(item => item.menu_name), '売上（円）',
+                     data.top_items.map(item => item.sales), true);
+        })
+        .catch(error => console.error('分析データの取得に失敗しました:', error));
+});